@@ -0,0 +1,278 @@
+"""
+Dispatcharr Timeshift Plugin - Async timeshift proxy
+
+ASGI variant of views.timeshift_proxy.
+
+WHY?
+    The WSGI proxy relays the provider stream with a blocking
+    iter_content() loop, so every catch-up viewer holds a whole uWSGI worker
+    for the length of the program: concurrent catch-up capacity equals the
+    worker count. Here the upstream is read with an async HTTP client and
+    the body is an async iterator, so a single ASGI process (Daphne,
+    Uvicorn) multiplexes hundreds of viewers on one event loop.
+
+    Authentication, channel lookup and URL building are unchanged: they run
+    in views._prepare_timeshift through sync_to_async (they touch the ORM).
+
+REQUIREMENTS:
+    - The "async_proxy" setting enabled
+    - The optional "httpx" package installed
+    - The /timeshift/ route served by an ASGI server. Under WSGI (uWSGI)
+      the regular view is used: Django would run the async view through
+      async_to_sync, which collects the whole body before sending a byte.
+
+LIMITATIONS:
+    This view only relays. It shares the redirect cache, max_streams slots
+    (budget.py) and provider health (health.py) with views.py, but not the
+    features built on its blocking relay: segment cache and request
+    merging, failover/hedging, read-ahead, continuous playback and the
+    client watchdog.
+
+GitHub: https://github.com/cedric-marcoux/dispatcharr_timeshift
+"""
+
+import asyncio
+import logging
+import threading
+import time
+import weakref
+
+from django.http import StreamingHttpResponse, HttpResponse, HttpResponseBadRequest
+
+from . import budget, health
+from .cache import get_plugin_setting
+from .upstream import (
+    DEFAULT_POOL_SIZE,
+    DEFAULT_IDLE_TIMEOUT,
+    DEFAULT_REDIRECT_TTL,
+    get_cached_redirect,
+    remember_redirect,
+    forget_redirect,
+)
+
+logger = logging.getLogger("plugins.dispatcharr_timeshift.async_views")
+
+try:
+    import httpx
+except ImportError:  # Optional dependency
+    httpx = None
+
+UPSTREAM_TIMEOUT = 10.0
+
+# event loop -> {account id: [client, pool_size]}
+# httpx clients are bound to the loop that created them; weak keys drop
+# them together with their loop
+_clients = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+
+def use_async_proxy():
+    """Return True if /timeshift/ should be served by the async view."""
+    if httpx is None:
+        return False
+    return bool(get_plugin_setting("async_proxy", False))
+
+
+def serving_asgi():
+    """Return True when called while an ASGI server handles the request."""
+    # Django resolves ASGI requests on the event loop, WSGI ones without one
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def _setting_int(settings, key, default):
+    try:
+        return int(settings.get(key, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _prepare(username, password, timestamp, duration):
+    """Blocking half of the request, run in a thread by sync_to_async."""
+    from .views import _prepare_timeshift
+
+    error, target = _prepare_timeshift(username, password, timestamp, duration)
+    # Settings are read here too: a plugin_state reload queries the DB,
+    # which Django forbids on the event loop
+    settings = {
+        key: get_plugin_setting(key, default)
+        for key, default in (
+            ("upstream_pool_size", DEFAULT_POOL_SIZE),
+            ("upstream_idle_timeout", DEFAULT_IDLE_TIMEOUT),
+            ("redirect_cache_ttl", DEFAULT_REDIRECT_TTL),
+        )
+    }
+    return error, target, settings
+
+
+def _get_client(account_id, settings):
+    """Return this loop's pooled AsyncClient for an M3U account."""
+    pool_size = max(1, _setting_int(settings, "upstream_pool_size", DEFAULT_POOL_SIZE))
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        clients = _clients.get(loop)
+        if clients is None:
+            clients = _clients[loop] = {}
+
+    entry = clients.get(account_id)
+    if entry is None or entry[1] != pool_size:
+        if entry is not None:
+            loop.create_task(entry[0].aclose())
+        client = httpx.AsyncClient(
+            follow_redirects=True,
+            timeout=httpx.Timeout(UPSTREAM_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=None,
+                max_keepalive_connections=pool_size,
+                keepalive_expiry=_setting_int(settings, "upstream_idle_timeout", DEFAULT_IDLE_TIMEOUT),
+            ),
+        )
+        entry = [client, pool_size]
+        clients[account_id] = entry
+        logger.debug(f"[Timeshift] New async upstream client for account {account_id} (pool {pool_size})")
+    return entry[0]
+
+
+async def _open_stream(client, account_id, url, headers, redirect_ttl):
+    """Async counterpart of upstream.open_stream (same redirect cache and health)."""
+    from asgiref.sync import sync_to_async
+
+    target = get_cached_redirect(account_id, url)
+
+    if target is not None:
+        try:
+            response = await client.send(client.build_request("GET", target, headers=headers), stream=True)
+            if response.status_code in (200, 206):
+                return response
+            logger.info(f"[Timeshift] Cached redirect target returned {response.status_code}, retrying via provider")
+            await response.aclose()
+        except httpx.HTTPError as e:
+            logger.info(f"[Timeshift] Cached redirect target failed ({e}), retrying via provider")
+        forget_redirect(account_id, url)
+
+    started = time.monotonic()
+    try:
+        response = await client.send(client.build_request("GET", url, headers=headers), stream=True)
+    except httpx.HTTPError:
+        await sync_to_async(health.record_failure)(account_id)
+        raise
+    if response.status_code >= 500:
+        await sync_to_async(health.record_failure)(account_id)
+    else:
+        await sync_to_async(health.record_success)(account_id, time.monotonic() - started)
+    final_url = str(response.url)
+    if response.history and response.status_code in (200, 206) and final_url != url:
+        remember_redirect(account_id, url, final_url, ttl=redirect_ttl)
+    return response
+
+
+async def timeshift_proxy_async(request, username, password, stream_id, timestamp, duration):
+    """
+    Async version of views.timeshift_proxy (same arguments and responses).
+
+    Returns:
+        StreamingHttpResponse with an async body (status 200 or 206)
+    """
+    from asgiref.sync import sync_to_async
+    from django.core.handlers.asgi import ASGIRequest
+
+    if not isinstance(request, ASGIRequest):
+        # WSGI: an async body would be buffered whole by async_to_sync
+        from .views import timeshift_proxy
+        return await sync_to_async(timeshift_proxy)(request, username, password, stream_id, timestamp, duration)
+
+    error, target, settings = await sync_to_async(_prepare)(username, password, timestamp, duration)
+    if error is not None:
+        return error
+
+    headers = {'User-Agent': target.user_agent}
+    range_header = request.META.get('HTTP_RANGE')
+    if range_header:
+        headers['Range'] = range_header
+
+    account_id = target.m3u_account.id
+    client = _get_client(account_id, settings)
+    redirect_ttl = _setting_int(settings, "redirect_cache_ttl", DEFAULT_REDIRECT_TTL)
+
+    # Queueing for a max_streams slot blocks: keep it off the event loop
+    slot = await sync_to_async(budget.acquire)(target.m3u_account)
+    if slot is None:
+        busy = HttpResponse("Provider connection limit reached", status=503)
+        busy['Retry-After'] = '5'
+        return busy
+
+    # Fail fast while the provider's circuit is open (health.py). Checked
+    # once a slot is held: allow() may claim the half-open probe, which
+    # nothing would release if we then gave up for lack of a slot
+    if not await sync_to_async(health.allow)(account_id):
+        slot.release()
+        unavailable = HttpResponse("Provider unavailable", status=503)
+        unavailable['Retry-After'] = '30'
+        return unavailable
+
+    try:
+        response = await _open_stream(client, account_id, target.url, headers, redirect_ttl)
+    except httpx.TimeoutException:
+        logger.error("[Timeshift] Provider timeout")
+        slot.release()
+        return HttpResponseBadRequest("Provider timeout")
+    except httpx.HTTPError as e:
+        logger.error(f"[Timeshift] Provider error: {e}")
+        slot.release()
+        return HttpResponseBadRequest("Provider connection error")
+
+    if response.status_code not in (200, 206):
+        logger.error(f"[Timeshift] Provider returned {response.status_code}")
+        await response.aclose()
+        slot.release()
+        return HttpResponseBadRequest(f"Provider error: {response.status_code}")
+
+    async def stream_body():
+        try:
+            async for chunk in response.aiter_bytes():
+                if chunk:
+                    # Throttled single Redis write; fine on the loop
+                    slot.refresh()
+                    yield chunk
+        except httpx.HTTPError as e:
+            logger.info(f"[Timeshift] Upstream ended early: {e}")
+        finally:
+            # Runs on client disconnect too (the ASGI handler cancels us)
+            await response.aclose()
+            slot.release()
+
+    streaming_response = StreamingHttpResponse(
+        stream_body(),
+        content_type=response.headers.get('Content-Type', 'video/mp2t'),
+        status=response.status_code
+    )
+    for header in ['Content-Length', 'Content-Range', 'Accept-Ranges']:
+        if header in response.headers:
+            streaming_response[header] = response.headers[header]
+
+    logger.info("[Timeshift] Streaming started (async)")
+    return streaming_response
+
+
+def close_all():
+    """
+    Close every async client (used when hooks are uninstalled).
+
+    Closing needs the owning event loop: each loop still running closes
+    its own clients; those of closed loops are just dropped.
+    """
+    with _clients_lock:
+        loops = list(_clients.items())
+        _clients.clear()
+
+    for loop, clients in loops:
+        if loop.is_closed():
+            continue
+        for client, _pool_size in clients.values():
+            try:
+                loop.call_soon_threadsafe(lambda loop=loop, client=client: loop.create_task(client.aclose()))
+            except RuntimeError:
+                pass  # Loop closed meanwhile
@@ -0,0 +1,222 @@
+"""
+Dispatcharr Timeshift Plugin - Provider connection budget
+
+Admission control for the upstream connections opened by the timeshift
+proxy, per M3U account and shared by all workers.
+
+WHY?
+    timeshift_proxy opened provider connections without looking at the
+    account's max_streams, so catch-up viewers competed blindly with live
+    streams and providers answered "max connections reached" (4xx) at
+    random. Now a catch-up request takes a slot before contacting the
+    provider, and waits (bounded) when the account is full.
+
+HOW:
+    - Capacity is the sum of max_streams over the account's active
+      profiles (0 on any profile = unlimited), like Dispatcharr's own
+      stream selection.
+    - Usage is Dispatcharr's live counters (profile_connections:<id> in
+      Redis) plus our own catch-up leases: a Redis sorted set per account,
+      scored by expiry. Relays refresh their lease while streaming, so a
+      killed worker's slots free themselves after LEASE_TTL.
+    - Waiters queue in arrival order (another sorted set): a waiter may take
+      a free slot only if fewer waiters are ahead of it than there are free
+      slots, so a steady stream of new requests cannot starve an old one.
+
+    Without Redis (or for unlimited accounts) every request is admitted, as
+    before.
+
+GitHub: https://github.com/cedric-marcoux/dispatcharr_timeshift
+"""
+
+import logging
+import random
+import time
+import uuid
+
+from .cache import get_redis
+
+logger = logging.getLogger("plugins.dispatcharr_timeshift.budget")
+
+DEFAULT_QUEUE_TIMEOUT = 10
+
+# Leases expire unless refreshed by the relay holding them
+LEASE_TTL = 30.0
+_LEASE_REFRESH = 10.0
+
+_POLL_INTERVAL = 0.25
+_WAITER_TTL = 5
+
+# Account capacity is re-read from the database this often
+_CAPACITY_TTL = 60.0
+
+_SLOTS_KEY = "dispatcharr_timeshift:slots:{}"
+_QUEUE_KEY = "dispatcharr_timeshift:queue:{}"
+_WAITER_KEY = "dispatcharr_timeshift:waiter:{}"
+_LIVE_KEY = "profile_connections:{}"
+
+_capacities = {}  # account id -> (limit, profile ids, loaded_at)
+
+
+def _setting(key, default):
+    from .cache import get_plugin_setting
+    return get_plugin_setting(key, default)
+
+
+def is_enabled():
+    return _setting("respect_max_streams", True) not in (False, "false", "0", 0)
+
+
+def queue_timeout():
+    try:
+        return float(_setting("upstream_queue_timeout", DEFAULT_QUEUE_TIMEOUT))
+    except (TypeError, ValueError):
+        return float(DEFAULT_QUEUE_TIMEOUT)
+
+
+def _capacity(m3u_account):
+    """
+    Return (limit, profile ids) for an account; limit 0 means unlimited.
+    """
+    cached = _capacities.get(m3u_account.id)
+    if cached is not None and time.monotonic() - cached[2] < _CAPACITY_TTL:
+        return cached[0], cached[1]
+
+    from apps.m3u.models import M3UAccountProfile
+
+    profiles = list(
+        M3UAccountProfile.objects.filter(m3u_account_id=m3u_account.id, is_active=True)
+        .values_list("id", "max_streams")
+    )
+    if profiles:
+        limits = [max_streams or 0 for _pk, max_streams in profiles]
+        limit = 0 if 0 in limits else sum(limits)
+    else:
+        limit = getattr(m3u_account, "max_streams", 0) or 0
+    profile_ids = [pk for pk, _max_streams in profiles]
+
+    _capacities[m3u_account.id] = (limit, profile_ids, time.monotonic())
+    return limit, profile_ids
+
+
+class Slot:
+    """One admitted upstream connection. A Slot without Redis is a no-op."""
+
+    def __init__(self, redis=None, account_id=None, lease=None):
+        self._redis = redis
+        self._account_id = account_id
+        self._lease = lease
+        self._refreshed_at = time.monotonic()
+
+    def refresh(self):
+        """Extend the lease (cheap to call per chunk; throttled)."""
+        if self._redis is None or time.monotonic() - self._refreshed_at < _LEASE_REFRESH:
+            return
+        self._refreshed_at = time.monotonic()
+        try:
+            self._redis.zadd(_SLOTS_KEY.format(self._account_id), {self._lease: time.time() + LEASE_TTL})
+        except Exception as e:
+            logger.debug(f"[Timeshift] Could not refresh connection lease: {e}")
+
+    def release(self):
+        if self._redis is None:
+            return
+        try:
+            self._redis.zrem(_SLOTS_KEY.format(self._account_id), self._lease)
+        except Exception as e:
+            logger.debug(f"[Timeshift] Could not release connection lease: {e}")
+        self._redis = None
+
+
+def _usage(redis, account_id, profile_ids):
+    """Live connections (Dispatcharr's counters) plus active catch-up leases."""
+    slots_key = _SLOTS_KEY.format(account_id)
+    redis.zremrangebyscore(slots_key, "-inf", time.time())
+    live = 0
+    if profile_ids:
+        live = sum(int(value or 0) for value in redis.mget([_LIVE_KEY.format(pk) for pk in profile_ids]))
+    return live + redis.zcard(slots_key)
+
+
+def _queue_position(redis, queue_key, lease):
+    """Return how many live waiters are ahead of lease (pruning dead ones)."""
+    ahead = 0
+    for member in redis.zrange(queue_key, 0, -1):
+        if isinstance(member, bytes):
+            member = member.decode()
+        if member == lease:
+            return ahead
+        if redis.exists(_WAITER_KEY.format(member)):
+            ahead += 1
+        else:
+            redis.zrem(queue_key, member)
+    return ahead
+
+
+def acquire(m3u_account, timeout=None):
+    """
+    Take an upstream connection slot for an M3U account.
+
+    Args:
+        m3u_account: M3UAccount about to be contacted
+        timeout: Seconds to wait in the queue (default: upstream_queue_timeout)
+
+    Returns:
+        Slot (call release() when the connection closes), or None if the
+        account stayed full for the whole timeout
+    """
+    if not is_enabled():
+        return Slot()
+    redis = get_redis()
+    if redis is None:
+        return Slot()
+
+    try:
+        limit, profile_ids = _capacity(m3u_account)
+    except Exception as e:
+        logger.debug(f"[Timeshift] Could not read account capacity: {e}")
+        return Slot()
+    if not limit:
+        return Slot()
+
+    timeout = queue_timeout() if timeout is None else timeout
+    deadline = time.monotonic() + timeout
+    lease = uuid.uuid4().hex
+    slots_key = _SLOTS_KEY.format(m3u_account.id)
+    queue_key = _QUEUE_KEY.format(m3u_account.id)
+    waiter_key = _WAITER_KEY.format(lease)
+    waited = False
+
+    try:
+        redis.set(waiter_key, 1, ex=_WAITER_TTL)
+        redis.zadd(queue_key, {lease: time.time()})
+        while True:
+            free = limit - _usage(redis, m3u_account.id, profile_ids)
+            if free > 0 and _queue_position(redis, queue_key, lease) < free:
+                redis.zadd(slots_key, {lease: time.time() + LEASE_TTL})
+                # Another worker may have taken the last slot meanwhile
+                if _usage(redis, m3u_account.id, profile_ids) <= limit:
+                    if waited:
+                        logger.info(f"[Timeshift] Account {m3u_account.id} slot granted after queueing")
+                    return Slot(redis, m3u_account.id, lease)
+                redis.zrem(slots_key, lease)
+
+            if time.monotonic() >= deadline:
+                if timeout > 0:
+                    logger.warning(f"[Timeshift] Account {m3u_account.id} at max_streams ({limit}), gave up after {timeout:.0f}s")
+                return None
+            if not waited:
+                logger.info(f"[Timeshift] Account {m3u_account.id} at max_streams ({limit}), queueing")
+                waited = True
+            redis.set(waiter_key, 1, ex=_WAITER_TTL)
+            time.sleep(_POLL_INTERVAL * (0.5 + random.random()))
+    except Exception as e:
+        # Budget bookkeeping must never block streaming
+        logger.warning(f"[Timeshift] Connection budget unavailable: {e}")
+        return Slot()
+    finally:
+        try:
+            redis.zrem(queue_key, lease)
+            redis.delete(waiter_key)
+        except Exception:
+            pass
@@ -0,0 +1,743 @@
+"""
+Dispatcharr Timeshift Plugin - Per-worker caches
+
+Holds in-process snapshots of data that the hooks need on hot paths, so that
+resolving a URL or answering an API call does not cost a database round trip.
+
+WHY PER-WORKER CACHES?
+    Dispatcharr runs multiple uWSGI workers (separate processes). Every worker
+    installs its own hooks (see plugin.py), and before this module every hook
+    queried PluginConfig on each call - including URLResolver.resolve, which
+    runs for EVERY request Dispatcharr serves (live TS, API, static files).
+
+CROSS-WORKER INVALIDATION:
+    Django signals only fire in the process that saved the model, so a save
+    in worker 3 is invisible to worker 7. Each cached value is therefore tied
+    to a "generation" token stored in Django's shared cache (Redis in
+    Dispatcharr):
+
+    - The saving worker receives the signal, bumps the shared generation and
+      drops its local copy immediately.
+    - Other workers re-check the shared generation at most once every
+      GENERATION_CHECK_INTERVAL seconds (a cache GET, not a SQL query) and
+      rebuild when it changed.
+    - A hard MAX_AGE forces a rebuild even if the shared cache is unavailable
+      or the change bypassed signals (e.g. QuerySet.update()).
+
+GitHub: https://github.com/cedric-marcoux/dispatcharr_timeshift
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+logger = logging.getLogger("plugins.dispatcharr_timeshift.cache")
+
+PLUGIN_KEY = "dispatcharr_timeshift"
+DEFAULT_TIMEZONE = "Europe/Brussels"
+
+# How often a worker asks the shared cache whether its local copy is stale
+GENERATION_CHECK_INTERVAL = 2.0
+
+# Local copies are rebuilt after this many seconds no matter what
+MAX_AGE = 60.0
+
+_GENERATION_KEY = "dispatcharr_timeshift:generation:{}"
+
+
+def _shared_cache():
+    """Return Django's default cache, or None if it is not usable."""
+    try:
+        from django.core.cache import cache
+        return cache
+    except Exception:
+        return None
+
+
+def get_redis():
+    """
+    Return Dispatcharr's Redis client, or None if it is not usable.
+
+    For shared state that needs more than get/set (sorted sets, lists,
+    atomic counters); see budget.py and health.py.
+    """
+    try:
+        from core.utils import RedisClient
+        return RedisClient.get_client()
+    except Exception as e:
+        logger.debug(f"[Timeshift] Redis unavailable: {e}")
+        return None
+
+
+def get_generation(name):
+    """
+    Read the shared generation token for a cached value.
+
+    Returns:
+        The token (any hashable), or None if unknown / cache unavailable
+    """
+    cache = _shared_cache()
+    if cache is None:
+        return None
+    try:
+        return cache.get(_GENERATION_KEY.format(name))
+    except Exception as e:
+        logger.debug(f"[Timeshift] Could not read generation '{name}': {e}")
+        return None
+
+
+def bump_generation(name):
+    """Publish a new generation token so every worker drops its copy."""
+    cache = _shared_cache()
+    if cache is None:
+        return
+    try:
+        cache.set(_GENERATION_KEY.format(name), time.time_ns(), timeout=None)
+    except Exception as e:
+        logger.debug(f"[Timeshift] Could not bump generation '{name}': {e}")
+
+
+_generation_seen = {}
+
+
+def current_generation(name, check_interval=GENERATION_CHECK_INTERVAL):
+    """
+    Return the shared generation token, asking the shared cache at most once
+    per check_interval seconds in this worker.
+
+    Used by caches that key their entries by generation instead of holding a
+    single value (see WorkerCache for the single-value case).
+    """
+    now = time.monotonic()
+    seen = _generation_seen.get(name)
+    if seen and now - seen[0] < check_interval:
+        return seen[1]
+    generation = get_generation(name)
+    _generation_seen[name] = (now, generation)
+    return generation
+
+
+def invalidate_generation(name):
+    """Bump a shared generation and forget this worker's throttled copy."""
+    bump_generation(name)
+    _generation_seen.pop(name, None)
+
+
+class WorkerCache:
+    """
+    A single value cached in this worker and invalidated across workers.
+
+    The loader is called with no arguments and its result is kept until the
+    shared generation changes or MAX_AGE expires. Rebuilds are serialized
+    with a lock so concurrent requests in threaded workers share one load.
+    """
+
+    def __init__(self, name, loader, check_interval=GENERATION_CHECK_INTERVAL, max_age=MAX_AGE):
+        self.name = name
+        self._loader = loader
+        self._check_interval = check_interval
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        # (value, generation, loaded_at) or None: one attribute, so readers
+        # that don't take the lock never see a half-invalidated state
+        self._entry = None
+        self._checked_at = 0.0
+
+    @property
+    def loaded_value(self):
+        """The current value without loading anything, or None."""
+        entry = self._entry
+        return entry[0] if entry is not None else None
+
+    def get(self):
+        now = time.monotonic()
+        entry = self._entry
+        if entry is not None:
+            value, generation, loaded_at = entry
+            if now - loaded_at < self._max_age:
+                if now - self._checked_at < self._check_interval:
+                    return value
+                self._checked_at = now
+                if get_generation(self.name) == generation:
+                    return value
+
+        with self._lock:
+            # Another thread may have rebuilt while we waited for the lock
+            entry = self._entry
+            if entry is not None and entry[2] > now:
+                return entry[0]
+            generation = get_generation(self.name)
+            value = self._loader()
+            loaded_at = time.monotonic()
+            self._entry = (value, generation, loaded_at)
+            self._checked_at = loaded_at
+            return value
+
+    def invalidate(self, broadcast=True):
+        """Drop the local copy; with broadcast, tell the other workers too."""
+        self._entry = None
+        if broadcast:
+            bump_generation(self.name)
+
+
+# =============================================================================
+# Plugin state (enabled flag + settings)
+# =============================================================================
+
+def _load_plugin_state():
+    """
+    Read the plugin's PluginConfig row.
+
+    Returns:
+        tuple: (enabled, config dict) - (False, {}) if the row is missing
+    """
+    try:
+        from apps.plugins.models import PluginConfig
+        config = PluginConfig.objects.filter(key=PLUGIN_KEY).first()
+        if config:
+            return bool(config.enabled), dict(config.config or {})
+    except Exception as e:
+        logger.debug(f"[Timeshift] Could not load plugin state: {e}")
+    return False, {}
+
+
+# Short max_age: the enable toggle may be written with QuerySet.update()
+plugin_state = WorkerCache("plugin_state", _load_plugin_state, max_age=10.0)
+
+
+def is_plugin_enabled():
+    """Return the cached enabled flag for this plugin."""
+    return plugin_state.get()[0]
+
+
+def get_plugin_setting(key, default=None):
+    """
+    Return a plugin setting from the cached config.
+
+    Empty strings are treated as unset so that cleared fields in the UI fall
+    back to the default.
+    """
+    value = plugin_state.get()[1].get(key)
+    if value is None or value == "":
+        return default
+    return value
+
+
+def get_plugin_timezone():
+    """Return the configured provider timezone (IANA name)."""
+    return get_plugin_setting("timezone", DEFAULT_TIMEZONE)
+
+
+def get_cache_dir(*parts):
+    """
+    Return (and create) the plugin's on-disk cache directory.
+
+    Defaults to a folder in the system temp dir; point the "cache_dir"
+    setting at a persistent volume (e.g. /data/cache/timeshift) to keep
+    caches across container restarts.
+    """
+    import os
+    import tempfile
+
+    base = get_plugin_setting("cache_dir") or os.path.join(tempfile.gettempdir(), "dispatcharr_timeshift")
+    path = os.path.join(base, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+# =============================================================================
+# Provider stream_id index
+# =============================================================================
+
+# What a provider stream_id resolves to, as primary keys only
+StreamRef = namedtuple("StreamRef", ["channel_id", "stream_id", "m3u_account_id"])
+
+# Resolved (Channel, Stream) objects are kept briefly so a zap or EPG fetch
+# does not even need the two primary-key queries
+RESOLVED_TTL = 60.0
+RESOLVED_MAX_ENTRIES = 4096
+
+# Set while some worker holds an index built in the last TTL seconds (its
+# own copy or the shared file): without one there is nothing to invalidate
+_INDEX_BUILT_KEY = "dispatcharr_timeshift:stream_index_built"
+_INDEX_BUILT_TTL = 2 * 3600
+
+# Stream saves in a worker without an index are invalidated in one batch
+# this long after the first (an M3U refresh saves thousands)
+INDEX_INVALIDATION_DELAY = 5.0
+
+
+def _build_stream_index():
+    """
+    Build the provider stream_id -> StreamRef index in one query.
+
+    Walks ChannelStream rows (streams attached to a channel) from XC
+    accounts. When several streams share a provider stream_id, the lowest
+    stream pk wins, and for that stream the lowest channel pk - the same
+    choice as the former Stream.filter(...).first() / channels.first().
+
+    Returns:
+        tuple: (by_provider_id dict, provider_id_by_stream_pk dict)
+    """
+    from apps.channels.models import ChannelStream
+
+    by_provider_id = {}
+    provider_id_by_stream = {}
+
+    rows = ChannelStream.objects.filter(
+        stream__m3u_account__account_type='XC',
+    ).values_list(
+        'stream__custom_properties__stream_id',
+        'stream_id',
+        'stream__m3u_account_id',
+        'channel_id',
+    ).order_by('stream_id', 'channel_id')
+
+    for provider_id, stream_pk, account_id, channel_pk in rows.iterator(chunk_size=5000):
+        if provider_id in (None, ''):
+            continue
+        provider_id = str(provider_id)
+        provider_id_by_stream.setdefault(stream_pk, provider_id)
+        if provider_id not in by_provider_id:
+            by_provider_id[provider_id] = StreamRef(channel_pk, stream_pk, account_id)
+
+    logger.info(f"[Timeshift] Built provider stream_id index ({len(by_provider_id)} entries)")
+    cache = _shared_cache()
+    if cache is not None:
+        try:
+            cache.set(_INDEX_BUILT_KEY, 1, timeout=_INDEX_BUILT_TTL)
+        except Exception as e:
+            logger.debug(f"[Timeshift] Could not mark the stream index as built: {e}")
+    return by_provider_id, provider_id_by_stream
+
+
+# Rebuilt on signals; the long max_age is only a safety net
+stream_index = WorkerCache("stream_index", _build_stream_index, max_age=900.0)
+
+# Stream pk -> (expires, channel, stream), for the index in _resolved_for
+# only: cleared when the index is replaced, so entries never keep an old
+# index (and its mmap) alive
+_resolved_lock = threading.Lock()
+_resolved = OrderedDict()
+_resolved_for = [None]
+
+# _indexed_provider_id() when this worker has no index to ask
+NOT_INDEXED_HERE = object()
+
+
+def _clear_resolved():
+    with _resolved_lock:
+        _resolved.clear()
+        _resolved_for[0] = None
+
+
+def _stream_index_source():
+    """
+    Return (token, lookup) for the index to use.
+
+    Prefers the memory-mapped index shared by all workers (shared_index.py)
+    and falls back to this worker's own copy. token identifies the index
+    version for the resolved-object cache.
+    """
+    from .shared_index import get_shared_index
+    shared = get_shared_index()
+    if shared is not None and shared.covers_all_streams:
+        return shared, shared.stream_ref
+    index = stream_index.get()
+    return index, index[0].get
+
+
+def _indexed_provider_id(stream_pk):
+    """
+    Provider stream_id a stream is indexed under, without building anything.
+
+    Returns:
+        str, None if the stream is not indexed, or NOT_INDEXED_HERE if this
+        worker has not built an index
+    """
+    from .shared_index import get_shared_index
+    shared = get_shared_index()
+    if shared is not None and shared.covers_all_streams:
+        return shared.provider_id_for_stream(stream_pk)
+    index = stream_index.loaded_value
+    return index[1].get(stream_pk) if index is not None else NOT_INDEXED_HERE
+
+
+def get_stream_ref(provider_stream_id):
+    """Return the StreamRef for a provider stream_id, or None."""
+    if provider_stream_id in (None, ''):
+        return None
+    return _stream_index_source()[1](str(provider_stream_id))
+
+
+def lookup_provider_stream(provider_stream_id):
+    """
+    Resolve a provider stream_id to its (Channel, Stream).
+
+    The index is authoritative: an unknown ID returns (None, None) without
+    touching the database, which keeps stream_xc cheap for clients that
+    still use Dispatcharr's internal IDs.
+
+    Returns:
+        Tuple of (Channel, Stream) with stream.m3u_account preloaded,
+        or (None, None) if not found
+    """
+    index, lookup = _stream_index_source()
+    key = str(provider_stream_id)
+    ref = lookup(key)
+    if ref is None:
+        return None, None
+
+    now = time.monotonic()
+    with _resolved_lock:
+        if _resolved_for[0] is not index:
+            # Index rebuilt (or shared file replaced) since the last lookup
+            _resolved.clear()
+            _resolved_for[0] = index
+        entry = _resolved.get(ref.stream_id)
+        if entry and entry[0] > now:
+            _resolved.move_to_end(ref.stream_id)
+            return entry[1], entry[2]
+
+    from apps.channels.models import Channel, Stream
+
+    channel = Channel.objects.filter(id=ref.channel_id).first()
+    stream = Stream.objects.select_related('m3u_account').filter(id=ref.stream_id).first()
+    if not channel or not stream:
+        return None, None
+
+    with _resolved_lock:
+        if _resolved_for[0] is not index:
+            return channel, stream  # Replaced while we queried
+        _resolved[ref.stream_id] = (now + RESOLVED_TTL, channel, stream)
+        _resolved.move_to_end(ref.stream_id)
+        while len(_resolved) > RESOLVED_MAX_ENTRIES:
+            _resolved.popitem(last=False)
+    return channel, stream
+
+
+def invalidate_stream_index():
+    """Drop the provider stream_id index in every worker."""
+    stream_index.invalidate()
+    _clear_resolved()
+    # The shared index notices the generation bump and rebuilds itself
+
+
+_pending_invalidation = None
+_pending_invalidation_lock = threading.Lock()
+
+
+def _invalidate_stream_index_soon():
+    """Invalidate the index (and listings) once, INDEX_INVALIDATION_DELAY from now."""
+    global _pending_invalidation
+
+    with _pending_invalidation_lock:
+        if _pending_invalidation is not None:
+            return  # Already scheduled: this save is covered by it
+        cache = _shared_cache()
+        try:
+            if cache is not None and not cache.get(_INDEX_BUILT_KEY):
+                return  # No worker has an index to go stale
+        except Exception:
+            pass
+        _pending_invalidation = threading.Timer(INDEX_INVALIDATION_DELAY, _run_pending_invalidation)
+        _pending_invalidation.daemon = True
+        _pending_invalidation.start()
+
+
+def _run_pending_invalidation():
+    global _pending_invalidation
+
+    with _pending_invalidation_lock:
+        _pending_invalidation = None
+    logger.debug("[Timeshift] Stream saves without a local index, invalidating the stream index")
+    invalidate_stream_index()
+    invalidate_live_streams()
+
+
+# =============================================================================
+# get_live_streams response cache
+# =============================================================================
+
+LIVE_STREAMS_GENERATION = "live_streams"
+
+# Bumped on EPG/channel changes; consumed by the XMLTV cache in xmltv.py
+XMLTV_GENERATION = "xmltv"
+
+# Bumped on EPG source/data changes; consumed by the listing cache in epg.py
+EPG_GENERATION = "epg"
+LIVE_STREAMS_DEFAULT_TTL = 300
+LIVE_STREAMS_LOCAL_ENTRIES = 64
+
+_LIVE_STREAMS_KEY = "dispatcharr_timeshift:live_streams:{}:{}"
+
+
+class SerializedList(list):
+    """
+    A list that also carries its JSON encoding.
+
+    Returned by the patched xc_get_live_streams so callers that iterate keep
+    working, while the patched JsonResponse (hooks.py) sends json_bytes
+    without encoding the list again.
+    """
+
+    json_bytes = b""
+
+    def compressed(self, encoding):
+        """
+        Return json_bytes compressed with encoding, computed once per object.
+
+        Cached lists are shared by every request in the worker, so each
+        variant is compressed at most once per cache entry.
+        """
+        from .compression import compress
+
+        variants = self.__dict__.setdefault("_variants", {})
+        body = variants.get(encoding)
+        if body is None and self.json_bytes:
+            body = variants[encoding] = compress(self.json_bytes, encoding)
+        return body
+
+
+def serialize_json(data):
+    """Encode data exactly like Django's JsonResponse does by default."""
+    import json
+    from django.core.serializers.json import DjangoJSONEncoder
+    return json.dumps(data, cls=DjangoJSONEncoder).encode("utf-8")
+
+
+_live_streams_lock = threading.Lock()
+_live_streams_local = OrderedDict()
+
+
+def _live_streams_ttl():
+    try:
+        return int(get_plugin_setting("live_streams_cache_ttl", LIVE_STREAMS_DEFAULT_TTL))
+    except (TypeError, ValueError):
+        return LIVE_STREAMS_DEFAULT_TTL
+
+
+def get_cached_live_streams(key):
+    """
+    Look up a cached get_live_streams response.
+
+    Checks this worker first, then Django's shared cache (so a response built
+    by one worker is reused by the others).
+
+    Args:
+        key: Hashable-to-string scope key (access level, profiles, category, host)
+
+    Returns:
+        SerializedList, or None on a miss or when caching is disabled
+    """
+    ttl = _live_streams_ttl()
+    if ttl <= 0:
+        return None
+
+    generation = current_generation(LIVE_STREAMS_GENERATION)
+    now = time.monotonic()
+    with _live_streams_lock:
+        entry = _live_streams_local.get(key)
+        if entry and entry[0] == generation and entry[1] > now:
+            _live_streams_local.move_to_end(key)
+            return entry[2]
+
+    cache = _shared_cache()
+    if cache is None:
+        return None
+    try:
+        payload = cache.get(_LIVE_STREAMS_KEY.format(generation, key))
+    except Exception as e:
+        logger.debug(f"[Timeshift] Live streams cache read failed: {e}")
+        return None
+    if payload is None:
+        return None
+
+    import json
+    result = SerializedList(json.loads(payload))
+    result.json_bytes = payload
+    _remember_live_streams(key, generation, result, now + ttl)
+    return result
+
+
+def set_cached_live_streams(key, streams):
+    """
+    Store an enriched get_live_streams result and return it as SerializedList.
+
+    The JSON is encoded once here; every later hit reuses the bytes.
+    """
+    result = SerializedList(streams)
+    result.json_bytes = serialize_json(result)
+
+    ttl = _live_streams_ttl()
+    if ttl <= 0:
+        return result
+
+    generation = current_generation(LIVE_STREAMS_GENERATION)
+    _remember_live_streams(key, generation, result, time.monotonic() + ttl)
+
+    cache = _shared_cache()
+    if cache is not None:
+        try:
+            cache.set(_LIVE_STREAMS_KEY.format(generation, key), result.json_bytes, timeout=ttl)
+        except Exception as e:
+            logger.debug(f"[Timeshift] Live streams cache write failed: {e}")
+    return result
+
+
+def _remember_live_streams(key, generation, result, expires_at):
+    with _live_streams_lock:
+        _live_streams_local[key] = (generation, expires_at, result)
+        _live_streams_local.move_to_end(key)
+        while len(_live_streams_local) > LIVE_STREAMS_LOCAL_ENTRIES:
+            _live_streams_local.popitem(last=False)
+
+
+def invalidate_live_streams():
+    """Drop cached get_live_streams responses in every worker."""
+    invalidate_generation(LIVE_STREAMS_GENERATION)
+    with _live_streams_lock:
+        _live_streams_local.clear()
+
+
+# =============================================================================
+# Signal wiring
+# =============================================================================
+
+def _on_plugin_config_saved(sender, instance, **kwargs):
+    if getattr(instance, "key", None) == PLUGIN_KEY:
+        logger.debug("[Timeshift] PluginConfig changed, invalidating plugin state")
+        plugin_state.invalidate()
+        invalidate_live_streams()
+
+
+# Stream fields that end up in the get_live_streams output
+_LIVE_STREAMS_STREAM_FIELDS = {"custom_properties", "m3u_account", "m3u_account_id"}
+
+
+def _on_stream_saved(sender, instance, created=False, update_fields=None, **kwargs):
+    """
+    Stream saves are frequent (stats, M3U refresh), so only rebuild the
+    index when the saved stream is indexed and its provider ID moved.
+    Also consulted with the shared index, where the per-process copy is
+    never built.
+    """
+    with _resolved_lock:
+        # Cached Stream objects carry custom_properties (tv_archive, ...)
+        _resolved.pop(instance.id, None)
+    indexed_as = _indexed_provider_id(instance.id)
+    if indexed_as is NOT_INDEXED_HERE:
+        # Nothing to compare with here, but other workers' indexes may
+        # hold the old provider ID: invalidate, batched across saves
+        if update_fields is None or _LIVE_STREAMS_STREAM_FIELDS & set(update_fields):
+            _invalidate_stream_index_soon()
+        return
+    if indexed_as is None:
+        # Not attached to a channel: the ChannelStream signal covers it
+        return
+    if update_fields is None or _LIVE_STREAMS_STREAM_FIELDS & set(update_fields):
+        invalidate_live_streams()
+    provider_id = (instance.custom_properties or {}).get('stream_id')
+    if str(provider_id) != indexed_as:
+        invalidate_stream_index()
+
+
+def _on_stream_deleted(sender, instance, **kwargs):
+    invalidate_stream_index()
+    invalidate_live_streams()
+
+
+def _on_channel_stream_changed(sender, **kwargs):
+    invalidate_stream_index()
+    invalidate_live_streams()
+    invalidate_generation(XMLTV_GENERATION)
+
+
+def _on_channel_changed(sender, **kwargs):
+    # Only the resolved objects embed Channel fields (name, user_level, uuid)
+    _clear_resolved()
+    invalidate_live_streams()
+    invalidate_generation(XMLTV_GENERATION)
+
+
+def _on_epg_changed(sender, **kwargs):
+    # EPG imports bulk-create programmes without signals; the source/status
+    # saves around the import are what we can observe
+    invalidate_generation(XMLTV_GENERATION)
+    invalidate_generation(EPG_GENERATION)
+
+
+def _on_m3u_account_changed(sender, **kwargs):
+    # Covers account type changes, deletions and M3U refresh completion
+    # (the refresh task bulk-creates streams without signals, then saves
+    # the account status)
+    invalidate_stream_index()
+    invalidate_live_streams()
+
+
+def _on_lineup_changed(sender, **kwargs):
+    # Profiles, memberships, groups and logos affect listings and XMLTV
+    invalidate_live_streams()
+    invalidate_generation(XMLTV_GENERATION)
+
+
+def _signal_receivers():
+    """
+    List (signal, receiver, sender, dispatch_uid) tuples to connect.
+
+    Models are imported lazily because Django apps are not ready when this
+    module is imported.
+    """
+    from django.db.models.signals import post_save, post_delete, m2m_changed
+    from apps.plugins.models import PluginConfig
+    from apps.channels.models import (
+        Channel, ChannelGroup, ChannelProfile, ChannelProfileMembership,
+        ChannelStream, Logo, Stream,
+    )
+    from apps.m3u.models import M3UAccount
+    from apps.epg.models import EPGData, EPGSource
+
+    return [
+        (post_save, _on_plugin_config_saved, PluginConfig, "timeshift_plugin_config_saved"),
+        (post_delete, _on_plugin_config_saved, PluginConfig, "timeshift_plugin_config_deleted"),
+        (post_save, _on_stream_saved, Stream, "timeshift_stream_saved"),
+        (post_delete, _on_stream_deleted, Stream, "timeshift_stream_deleted"),
+        (post_save, _on_channel_stream_changed, ChannelStream, "timeshift_channel_stream_saved"),
+        (post_delete, _on_channel_stream_changed, ChannelStream, "timeshift_channel_stream_deleted"),
+        (m2m_changed, _on_channel_stream_changed, Channel.streams.through, "timeshift_channel_streams_m2m"),
+        (post_save, _on_channel_changed, Channel, "timeshift_channel_saved"),
+        (post_delete, _on_channel_stream_changed, Channel, "timeshift_channel_deleted"),
+        (post_save, _on_m3u_account_changed, M3UAccount, "timeshift_m3u_account_saved"),
+        (post_delete, _on_m3u_account_changed, M3UAccount, "timeshift_m3u_account_deleted"),
+        (post_save, _on_lineup_changed, ChannelProfile, "timeshift_channel_profile_saved"),
+        (post_delete, _on_lineup_changed, ChannelProfile, "timeshift_channel_profile_deleted"),
+        (post_save, _on_lineup_changed, ChannelProfileMembership, "timeshift_profile_membership_saved"),
+        (post_delete, _on_lineup_changed, ChannelProfileMembership, "timeshift_profile_membership_deleted"),
+        (post_save, _on_lineup_changed, ChannelGroup, "timeshift_channel_group_saved"),
+        (post_delete, _on_lineup_changed, ChannelGroup, "timeshift_channel_group_deleted"),
+        (post_save, _on_lineup_changed, Logo, "timeshift_logo_saved"),
+        (post_delete, _on_lineup_changed, Logo, "timeshift_logo_deleted"),
+        (post_save, _on_epg_changed, EPGSource, "timeshift_epg_source_saved"),
+        (post_delete, _on_epg_changed, EPGSource, "timeshift_epg_source_deleted"),
+        (post_save, _on_epg_changed, EPGData, "timeshift_epg_data_saved"),
+        (post_delete, _on_epg_changed, EPGData, "timeshift_epg_data_deleted"),
+    ]
+
+
+def connect_signals():
+    """
+    Connect model signals that keep the worker caches fresh.
+
+    Uses dispatch_uid so calling this more than once (enable action after
+    auto-install) does not register duplicate receivers.
+    """
+    for signal, receiver, sender, uid in _signal_receivers():
+        signal.connect(receiver, sender=sender, dispatch_uid=uid)
+    logger.info("[Timeshift] Connected cache invalidation signals")
+
+
+def disconnect_signals():
+    """Disconnect everything registered by connect_signals()."""
+    for signal, receiver, sender, uid in _signal_receivers():
+        signal.disconnect(sender=sender, dispatch_uid=uid)
@@ -0,0 +1,159 @@
+"""
+Dispatcharr Timeshift Plugin - Response compression
+
+Accept-Encoding negotiation and gzip/zstd encoders for the guide endpoints
+(XMLTV via generate_epg, JSON via player_api.php).
+
+WHY?
+    XMLTV compresses about 10x and EPG JSON (base64 titles included) about
+    5x, and guide downloads are most of our egress to mobile clients.
+    Compression is done where the data is produced so it can be paid once:
+
+    - Cached outputs (XMLTV files, get_live_streams bytes) keep compressed
+      variants next to the plain one, built once per cache rebuild.
+    - Uncached responses are compressed on the fly, streaming when the
+      response streams.
+
+zstd is optional: it is offered only when the "zstandard" package is
+installed. gzip always works (stdlib zlib).
+
+GitHub: https://github.com/cedric-marcoux/dispatcharr_timeshift
+"""
+
+import logging
+import zlib
+
+logger = logging.getLogger("plugins.dispatcharr_timeshift.compression")
+
+try:
+    import zstandard
+except ImportError:  # Optional dependency
+    zstandard = None
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 6
+
+# Bodies smaller than this are not worth a Content-Encoding
+MIN_COMPRESS_SIZE = 1024
+
+# Preference order when the client accepts several with the same q-value
+ENCODINGS = ("zstd", "gzip") if zstandard is not None else ("gzip",)
+
+# File suffixes for stored variants
+SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+
+
+def negotiate(request, available=ENCODINGS):
+    """
+    Pick the best content-coding for a request.
+
+    Args:
+        request: Django request (reads HTTP_ACCEPT_ENCODING)
+        available: Encodings we can produce, in server preference order
+
+    Returns:
+        str encoding name, or None for identity
+    """
+    header = request.META.get("HTTP_ACCEPT_ENCODING", "")
+    if not header:
+        return None
+
+    accepted = {}
+    for part in header.split(","):
+        fields = part.strip().split(";")
+        coding = fields[0].strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in fields[1:]:
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+
+    best, best_q = None, 0.0
+    for encoding in available:
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compressor(encoding):
+    """
+    Return a streaming compressor with compress(data) / flush() methods.
+
+    Raises:
+        ValueError: Unknown or unavailable encoding
+    """
+    if encoding == "gzip":
+        return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+def compress(data, encoding):
+    """Compress a complete body."""
+    c = compressor(encoding)
+    return c.compress(data) + c.flush()
+
+
+def compress_stream(chunks, encoding):
+    """Compress an iterable of byte chunks, yielding compressed chunks."""
+    c = compressor(encoding)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        out = c.compress(chunk)
+        if out:
+            yield out
+    tail = c.flush()
+    if tail:
+        yield tail
+
+
+def set_encoding_headers(response, encoding):
+    """Mark a response as encoded and varying on Accept-Encoding."""
+    from django.utils.cache import patch_vary_headers
+
+    patch_vary_headers(response, ("Accept-Encoding",))
+    if encoding:
+        response["Content-Encoding"] = encoding
+    return response
+
+
+def compress_response(request, response, get_variant=None):
+    """
+    Compress a non-streaming response in place if the client accepts it.
+
+    Args:
+        request: Django request
+        response: HttpResponse with a complete body
+        get_variant: Optional callable(encoding) returning a pre-compressed
+            body (or None) to use instead of compressing again
+
+    Returns:
+        The same response object
+    """
+    if response.has_header("Content-Encoding") or getattr(response, "streaming", False):
+        return response
+    if not getattr(response, "is_rendered", True):
+        # Unrendered DRF/template responses: leave them to their renderer
+        return response
+    if response.status_code != 200 or len(response.content) < MIN_COMPRESS_SIZE:
+        return response
+
+    encoding = negotiate(request)
+    if encoding is None:
+        return set_encoding_headers(response, None)
+
+    body = get_variant(encoding) if get_variant else None
+    if body is None:
+        body = compress(response.content, encoding)
+    response.content = body
+    response["Content-Length"] = str(len(body))
+    return set_encoding_headers(response, encoding)
@@ -0,0 +1,390 @@
+"""
+Dispatcharr Timeshift Plugin - Catch-up EPG listings
+
+Builds the get_simple_data_table listings for archive (tv_archive=1)
+channels, served by the patched xc_get_epg in hooks.py.
+
+WHY A PER-CHANNEL CACHE?
+    An archive channel's table covers tv_archive_duration days of past
+    programmes plus the future schedule: ~1,500 rows, each with two
+    base64-encoded strings and two timezone conversions. Clients request
+    the same channel's table every time the user opens the guide, and
+    between two calls only now_playing and has_archive can change.
+
+    So the encoded rows are cached per channel (without those two fields),
+    and at response time we only slice the archive window and add the
+    time-dependent flags.
+
+PROGRAM TIMELINE:
+    ProgramTimeline keeps a channel's schedule as parallel arrays (start and
+    end epoch seconds, programme ids) sorted by start, so "programme at time
+    T" and "first programme from time T" are bisects instead of scans. The
+    listing cache slices its rows with one, and
+    get_timeline() serves the lookups the timeshift path needs (mapping a
+    catch-up start timestamp to its programme, see catchup_duration()).
+
+INVALIDATION:
+    EPG imports bulk-create programmes (no per-row signals), so an entry is
+    dropped when:
+    - the shared "epg" generation changes (EPGSource/EPGData signals), or
+    - the programme fingerprint of its epg_data (count + max id, one
+      aggregate query) changed; checked at most every FINGERPRINT_INTERVAL
+      seconds, which catches imports done in other processes (Celery).
+
+GitHub: https://github.com/cedric-marcoux/dispatcharr_timeshift
+"""
+
+import base64
+import bisect
+import logging
+import math
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from datetime import timedelta
+from zoneinfo import ZoneInfo
+
+logger = logging.getLogger("plugins.dispatcharr_timeshift.epg")
+
+# Past programmes kept beyond the archive window, so an entry stays usable
+# while "now" moves forward
+_WINDOW_MARGIN_DAYS = 1
+
+FINGERPRINT_INTERVAL = 120.0
+MAX_CHANNELS = 256
+
+# How far back get_timeline() loads programmes (longest archives are ~14 days)
+TIMELINE_DAYS_BACK = 15
+
+# Clients may start catch-up a little before the programme's scheduled start
+_START_TOLERANCE = 300
+
+
+class ProgramTimeline:
+    """
+    A channel's programmes as parallel arrays sorted by start time.
+
+    starts/ends are epoch seconds (float, so aware datetimes round-trip
+    exactly) and ids are ProgramData primary keys. All queries return
+    indices into the arrays.
+    """
+
+    __slots__ = ("starts", "ends", "ids")
+
+    def __init__(self, starts=(), ends=(), ids=()):
+        self.starts = array('d', starts)
+        self.ends = array('d', ends)
+        self.ids = array('q', ids)
+
+    @classmethod
+    def from_buffers(cls, starts, ends, ids):
+        """
+        Wrap existing sequences (e.g. memoryviews over the shared index)
+        without copying. The result must be treated as read-only.
+        """
+        timeline = cls.__new__(cls)
+        timeline.starts = starts
+        timeline.ends = ends
+        timeline.ids = ids
+        return timeline
+
+    def append(self, start, end, program_id):
+        """Add a programme; callers must append in start order."""
+        self.starts.append(start)
+        self.ends.append(end)
+        self.ids.append(program_id or 0)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def first_starting_at_or_after(self, t):
+        """Index of the first programme with start >= t (len() if none)."""
+        return bisect.bisect_left(self.starts, t)
+
+    def index_at(self, t):
+        """
+        Index of the programme airing at t (start <= t < end), or None.
+
+        With overlapping schedules the latest-starting match wins.
+        """
+        i = bisect.bisect_right(self.starts, t) - 1
+        # Overlaps are rare and short: look back a few programmes at most
+        for j in range(i, max(i - 4, -1), -1):
+            if self.ends[j] > t:
+                return j
+        return None
+
+
+class _ListingEntry:
+    """Encoded rows of one channel, aligned with a ProgramTimeline."""
+
+    __slots__ = ("signature", "generation", "fingerprint", "checked_at", "window_start",
+                 "timeline", "rows")
+
+    def __init__(self, signature, generation, fingerprint, window_start, timeline, rows):
+        self.signature = signature
+        self.generation = generation
+        self.fingerprint = fingerprint
+        self.checked_at = time.monotonic()
+        self.window_start = window_start
+        self.timeline = timeline
+        self.rows = rows
+
+
+_lock = threading.Lock()
+_entries = OrderedDict()
+
+
+def _programs_fingerprint(epg_data):
+    """Cheap summary that changes whenever an import rewrites programmes."""
+    from django.db.models import Count, Max
+    result = epg_data.programs.aggregate(count=Count('id'), max_id=Max('id'))
+    return result['count'], result['max_id']
+
+
+def _still_valid(entry, epg_data, generation):
+    """Generation check, plus a throttled programme fingerprint check."""
+    if entry.generation != generation:
+        return False
+    if time.monotonic() - entry.checked_at > FINGERPRINT_INTERVAL:
+        if _programs_fingerprint(epg_data) != entry.fingerprint:
+            return False
+        entry.checked_at = time.monotonic()
+    return True
+
+
+def _encode_row(program, channel, props):
+    """Build the static part of one listing row (no now_playing/has_archive)."""
+    start = program.start_time
+    end = program.end_time
+
+    # Convert timestamps to local timezone (Europe/Brussels)
+    # Original provider sends 'start' field in local time, not UTC
+    # Snappier expects this format to match the user's timezone
+    local_tz = ZoneInfo("Europe/Brussels")
+    start_local = start.astimezone(local_tz)
+    end_local = end.astimezone(local_tz)
+
+    # Generate unique ID for each program using timestamp
+    # This is critical for clients like Snappier to distinguish programs
+    program_id = int(start.timestamp())
+
+    return {
+        "id": str(program_id),
+        "epg_id": str(program.id) if hasattr(program, 'id') and program.id else str(program_id),
+        "title": base64.b64encode(program.title.encode()).decode(),
+        "lang": "fr",  # Match provider's language field
+        "start": start_local.strftime("%Y-%m-%d %H:%M:%S"),    # Local time (Europe/Brussels) - match original provider
+        "end": end_local.strftime("%Y-%m-%d %H:%M:%S"),        # Local time (Europe/Brussels) - match original provider
+        "description": base64.b64encode(program.description.encode()).decode(),
+        "channel_id": props.get('epg_channel_id') or str(channel.id),  # Use EPG channel ID from provider (e.g., "RTSUn.ch")
+        "start_timestamp": str(int(start.timestamp())),  # STRING not int - match provider format
+        "stop_timestamp": str(int(end.timestamp())),     # STRING not int - match provider format
+        "stream_id": props.get('stream_id'),  # Use provider's stream_id, not internal channel ID
+    }
+
+
+def _build_entry(channel, props, archive_duration_days, signature, generation, now):
+    epg_data = channel.epg_data
+    window_start = now - timedelta(days=archive_duration_days + _WINDOW_MARGIN_DAYS)
+    programs = epg_data.programs.filter(start_time__gte=window_start).order_by('start_time')
+
+    timeline = ProgramTimeline()
+    rows = []
+    for program in programs:
+        timeline.append(program.start_time.timestamp(), program.end_time.timestamp(), program.id)
+        rows.append(_encode_row(program, channel, props))
+
+    return _ListingEntry(signature, generation, _programs_fingerprint(epg_data),
+                         window_start.timestamp(), timeline, rows)
+
+
+def _get_entry(channel, props, archive_duration_days, now):
+    from .cache import current_generation, EPG_GENERATION
+
+    key = channel.id
+    signature = (channel.epg_data_id, props.get('stream_id'), props.get('epg_channel_id'))
+    generation = current_generation(EPG_GENERATION)
+    window_start = (now - timedelta(days=archive_duration_days)).timestamp()
+
+    with _lock:
+        entry = _entries.get(key)
+    if entry is not None and (
+        entry.signature != signature
+        or entry.window_start > window_start
+        or not _still_valid(entry, channel.epg_data, generation)
+    ):
+        entry = None
+
+    if entry is None:
+        entry = _build_entry(channel, props, archive_duration_days, signature, generation, now)
+        with _lock:
+            _entries[key] = entry
+            _entries.move_to_end(key)
+            while len(_entries) > MAX_CHANNELS:
+                _entries.popitem(last=False)
+    return entry
+
+
+def build_archive_listings(channel, props, archive_duration_days, now):
+    """
+    Return the epg_listings rows for an archive channel.
+
+    Rows match what the provider sends (see CHANGES_SUMMARY.md for the field
+    types Snappier requires): programmes starting within the last
+    archive_duration_days plus all future ones, with now_playing and
+    has_archive computed against now.
+
+    Args:
+        channel: Channel with epg_data
+        props: custom_properties of the channel's first stream
+        archive_duration_days: Provider's tv_archive_duration
+        now: Current aware datetime
+
+    Returns:
+        list of dicts
+    """
+    if not channel.epg_data:
+        return []
+
+    entry = _get_entry(channel, props, archive_duration_days, now)
+    timeline = entry.timeline
+    now_ts = now.timestamp()
+    first = timeline.first_starting_at_or_after((now - timedelta(days=archive_duration_days)).timestamp())
+    # Rows from here on start after now: not playing, no archive yet
+    upcoming = bisect.bisect_right(timeline.starts, now_ts)
+
+    listings = []
+    for i in range(first, upcoming):
+        end = timeline.ends[i]
+        row = dict(entry.rows[i])
+        row["now_playing"] = 0 if end < now_ts else 1
+
+        # Set has_archive for past programs within archive duration
+        # INTEGER not string - match provider format
+        if end < now_ts:
+            days_ago = int((now_ts - end) // 86400)
+            row["has_archive"] = 1 if days_ago <= archive_duration_days else 0
+        else:
+            row["has_archive"] = 0
+
+        listings.append(row)
+
+    for i in range(max(first, upcoming), len(entry.rows)):
+        row = dict(entry.rows[i])
+        row["now_playing"] = 0
+        row["has_archive"] = 0
+        listings.append(row)
+    return listings
+
+
+# =============================================================================
+# Timelines for timeshift lookups
+# =============================================================================
+
+class _TimelineEntry:
+    __slots__ = ("generation", "fingerprint", "checked_at", "window_start", "timeline")
+
+    def __init__(self, generation, fingerprint, window_start, timeline):
+        self.generation = generation
+        self.fingerprint = fingerprint
+        self.checked_at = time.monotonic()
+        self.window_start = window_start
+        self.timeline = timeline
+
+
+_timelines = OrderedDict()
+
+
+def get_timeline(epg_data, now=None):
+    """
+    Return the cached ProgramTimeline of an EPGData.
+
+    Covers programmes starting within the last TIMELINE_DAYS_BACK days and
+    all future ones. Archive channels are served zero-copy from the shared
+    index (shared_index.py); others are loaded with a single values_list
+    query (no titles or descriptions) and invalidated like the listing
+    cache.
+
+    Args:
+        epg_data: EPGData instance (or None)
+        now: Current aware datetime (defaults to django.utils.timezone.now())
+
+    Returns:
+        ProgramTimeline (empty if epg_data is None)
+    """
+    if epg_data is None:
+        return ProgramTimeline()
+
+    # Archive channels are in the memory-mapped index shared by all workers
+    from .shared_index import get_shared_index
+    shared = get_shared_index()
+    if shared is not None:
+        timeline = shared.timeline(epg_data.id)
+        if timeline is not None:
+            return timeline
+
+    from django.utils import timezone as django_timezone
+    from .cache import current_generation, EPG_GENERATION
+
+    now = now or django_timezone.now()
+    generation = current_generation(EPG_GENERATION)
+    key = epg_data.id
+
+    with _lock:
+        entry = _timelines.get(key)
+    if entry is not None and (
+        entry.window_start > (now - timedelta(days=TIMELINE_DAYS_BACK - _WINDOW_MARGIN_DAYS)).timestamp()
+        or not _still_valid(entry, epg_data, generation)
+    ):
+        entry = None
+
+    if entry is None:
+        window_start = now - timedelta(days=TIMELINE_DAYS_BACK)
+        rows = epg_data.programs.filter(
+            start_time__gte=window_start
+        ).order_by('start_time').values_list('id', 'start_time', 'end_time')
+
+        timeline = ProgramTimeline()
+        for program_id, start, end in rows:
+            timeline.append(start.timestamp(), end.timestamp(), program_id)
+
+        entry = _TimelineEntry(generation, _programs_fingerprint(epg_data), window_start.timestamp(), timeline)
+        with _lock:
+            _timelines[key] = entry
+            _timelines.move_to_end(key)
+            while len(_timelines) > MAX_CHANNELS:
+                _timelines.popitem(last=False)
+    return entry.timeline
+
+
+def catchup_duration(channel, start_epoch, padding_minutes=0):
+    """
+    Minutes of catch-up to request for a start time: up to the end of the
+    programme airing at start_epoch, plus padding.
+
+    Args:
+        channel: Channel (its epg_data provides the schedule)
+        start_epoch: Requested start, epoch seconds
+        padding_minutes: Extra minutes for late-running programmes
+
+    Returns:
+        int minutes, or None if the schedule has no programme there
+    """
+    if not channel.epg_data_id:
+        return None
+
+    timeline = get_timeline(channel.epg_data)
+    if not len(timeline):
+        return None
+
+    i = timeline.index_at(start_epoch)
+    if i is None:
+        # Started in a gap or just before a programme: use the next one
+        i = timeline.first_starting_at_or_after(start_epoch)
+        if i >= len(timeline) or timeline.starts[i] - start_epoch > _START_TOLERANCE:
+            return None
+
+    minutes = math.ceil((timeline.ends[i] - start_epoch) / 60)
+    return max(1, minutes + padding_minutes)
@@ -0,0 +1,247 @@
+"""
+Dispatcharr Timeshift Plugin - Upstream failover and hedging
+
+Opens the provider connection for a catch-up request across the channel's
+archive-capable streams (views._alternate_targets), in channelstream order.
+
+WHY?
+    _proxy_stream used exactly one stream and answered "Provider timeout"
+    after 10 s when that provider's panel was slow. Time to first frame was
+    dominated by those occasional slow panels, even for channels with a
+    second provider that would have answered at once.
+
+HOW:
+    - Candidates are tried in order. A candidate whose account is at
+      max_streams is skipped (no queueing) so the request is routed to an
+      account with free capacity; only if every account is full does it
+      queue for the first one (budget.py).
+    - An error or bad status moves on to the next candidate immediately.
+    - Accounts whose circuit breaker is open (health.py) are skipped; if
+      all are, the request fails fast instead of waiting out a timeout.
+    - Hedging: if the current attempt has not answered after hedge_delay_ms,
+      the next candidate is started in parallel and whichever returns its
+      response headers first wins; the loser is closed and its slot freed.
+    - Different providers produce different byte streams, so a Range
+      request (a seek) must go back to the provider that served the first
+      bytes. The choice is remembered in Django's shared cache per program
+      and Range requests use it alone, without hedging.
+
+GitHub: https://github.com/cedric-marcoux/dispatcharr_timeshift
+"""
+
+import hashlib
+import logging
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import requests
+
+from . import budget, health
+from .upstream import open_stream
+
+logger = logging.getLogger("plugins.dispatcharr_timeshift.failover")
+
+DEFAULT_HEDGE_DELAY_MS = 1500
+UPSTREAM_TIMEOUT = 10
+
+# Attempts in flight at once (the current one plus one hedge)
+MAX_IN_FLIGHT = 2
+
+# How long a program remembers which provider served it
+CHOICE_TTL = 6 * 3600
+
+_CHOICE_KEY = "dispatcharr_timeshift:choice:{}"
+
+UpstreamResult = namedtuple("UpstreamResult", ["target", "response", "slot", "error"])
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _setting(key, default):
+    from .cache import get_plugin_setting
+    return get_plugin_setting(key, default)
+
+
+def is_enabled():
+    return _setting("failover_streams", True) not in (False, "false", "0", 0)
+
+
+def hedge_delay():
+    """Return the hedge delay in seconds, or None when hedging is off."""
+    try:
+        delay_ms = int(_setting("hedge_delay_ms", DEFAULT_HEDGE_DELAY_MS))
+    except (TypeError, ValueError):
+        delay_ms = DEFAULT_HEDGE_DELAY_MS
+    return delay_ms / 1000.0 if delay_ms > 0 else None
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="timeshift-upstream")
+        return _executor
+
+
+# =============================================================================
+# Sticky provider choice (for seeks)
+# =============================================================================
+
+def _choice_key(primary):
+    raw = f"{primary.m3u_account.id}:{primary.provider_stream_id}:{primary.start}:{primary.duration}"
+    return _CHOICE_KEY.format(hashlib.sha1(raw.encode("utf-8")).hexdigest())
+
+
+def remember_choice(primary, target):
+    """Record which candidate served a program (no-op if it was the primary)."""
+    from django.core.cache import cache
+
+    try:
+        if target is primary:
+            cache.delete(_choice_key(primary))
+        else:
+            cache.set(_choice_key(primary), [target.m3u_account.id, str(target.provider_stream_id)], CHOICE_TTL)
+    except Exception as e:
+        logger.debug(f"[Timeshift] Could not store provider choice: {e}")
+
+
+def sticky_target(targets):
+    """Return the candidate that served this program before (default: the primary)."""
+    from django.core.cache import cache
+
+    try:
+        choice = cache.get(_choice_key(targets[0]))
+    except Exception:
+        choice = None
+    if choice:
+        for target in targets:
+            if [target.m3u_account.id, str(target.provider_stream_id)] == list(choice):
+                return target
+    return targets[0]
+
+
+# =============================================================================
+# Opening the upstream
+# =============================================================================
+
+def _attempt(target, headers):
+    try:
+        return open_stream(target.m3u_account, target.url, dict(headers, **{'User-Agent': target.user_agent}), timeout=UPSTREAM_TIMEOUT)
+    finally:
+        # Executor threads touch the ORM only via plugin settings; don't
+        # leave a connection open per thread
+        from django.db import connection
+        connection.close()
+
+
+def _discard(future, slot):
+    """Close a losing attempt's response (now or when it completes)."""
+    def cleanup(done):
+        try:
+            response = done.result()
+            response.close()
+        except Exception:
+            pass
+        slot.release()
+
+    future.add_done_callback(cleanup)
+
+
+def open_upstream(targets, headers, hedge=True):
+    """
+    Open the provider response for the first candidate that answers.
+
+    Args:
+        targets: Candidate TimeshiftTargets, preferred first
+        headers: Request headers (User-Agent is set per candidate)
+        hedge: Allow parallel hedged attempts (False for Range requests)
+
+    Returns:
+        UpstreamResult; on failure response is None and error is one of
+        "busy", "unavailable", "timeout", "connection" or "status:<code>"
+    """
+    pending = list(targets)
+    in_flight = {}  # future -> (target, slot)
+    errors = []
+    delay = hedge_delay() if hedge and len(targets) > 1 else None
+
+    def start_next(queue=False):
+        while pending:
+            target = pending.pop(0)
+            # Slot first: allow() may claim the half-open probe, which
+            # would stay claimed (PROBE_TIMEOUT) if we then found no slot
+            slot = budget.acquire(target.m3u_account, timeout=None if queue else 0)
+            if slot is None:
+                logger.info(f"[Timeshift] Account {target.m3u_account.id} is full, trying next stream")
+                errors.append("busy")
+                continue
+            if not health.allow(target.m3u_account.id):
+                slot.release()
+                logger.info(f"[Timeshift] Account {target.m3u_account.id} circuit is open, trying next stream")
+                errors.append("unavailable")
+                continue
+            future = _get_executor().submit(_attempt, target, headers)
+            in_flight[future] = (target, slot)
+            return True
+        return False
+
+    if not start_next() and not in_flight:
+        if "busy" not in errors:
+            # Every provider is down: fail fast instead of timing out
+            return UpstreamResult(None, None, None, "unavailable")
+        # Every healthy account is full: queue (bounded) for the first one
+        pending[:] = [targets[errors.index("busy")]]
+        errors.clear()
+        if not start_next(queue=True):
+            return UpstreamResult(None, None, None, "busy")
+
+    started_at = time.monotonic()
+    while in_flight:
+        timeout = None
+        if delay is not None and pending and len(in_flight) < MAX_IN_FLIGHT:
+            timeout = max(0.0, delay - (time.monotonic() - started_at))
+
+        done, _ = wait(list(in_flight), timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done:
+            logger.info(f"[Timeshift] No answer after {delay:.1f}s, hedging with the next stream")
+            start_next()
+            started_at = time.monotonic()
+            continue
+
+        for future in done:
+            target, slot = in_flight.pop(future)
+            try:
+                response = future.result()
+            except requests.exceptions.Timeout:
+                errors.append("timeout")
+                slot.release()
+                logger.warning(f"[Timeshift] Provider timeout on account {target.m3u_account.id}")
+            except requests.exceptions.RequestException as e:
+                errors.append("connection")
+                slot.release()
+                logger.warning(f"[Timeshift] Provider error on account {target.m3u_account.id}: {e}")
+            else:
+                if response.status_code in (200, 206):
+                    for other, (_other_target, other_slot) in in_flight.items():
+                        _discard(other, other_slot)
+                    in_flight.clear()
+                    if target is not targets[0]:
+                        logger.info(f"[Timeshift] Served by alternate stream on account {target.m3u_account.id}")
+                    return UpstreamResult(target, response, slot, None)
+                errors.append(f"status:{response.status_code}")
+                response.close()
+                slot.release()
+                logger.warning(f"[Timeshift] Provider returned {response.status_code} on account {target.m3u_account.id}")
+
+            # Failed: move on right away instead of waiting for the hedge delay
+            if len(in_flight) < MAX_IN_FLIGHT and start_next():
+                started_at = time.monotonic()
+
+    # Report the most specific failure (a real answer beats "busy")
+    for error in errors:
+        if error not in ("busy", "unavailable"):
+            return UpstreamResult(None, None, None, error)
+    return UpstreamResult(None, None, None, "busy" if "busy" in errors else "unavailable")
@@ -0,0 +1,205 @@
+"""
+Dispatcharr Timeshift Plugin - Provider health and circuit breaker
+
+Per M3U account health shared by all workers, used to stop sending
+catch-up requests to a provider that is down.
+
+WHY?
+    Every timeshift request to a dead provider waited out the 10 s upstream
+    timeout before failing. During an outage workers piled up in those
+    waits and live streams on the same box suffered.
+
+HOW:
+    - Every upstream request records its outcome in a short Redis list per
+      account (timestamp, ok/error, time to response headers). Timeouts,
+      connection errors and 5xx count as errors; 4xx are answers, not
+      outages.
+    - The circuit opens when the recent error rate reaches ERROR_RATE_TRIP
+      (with at least MIN_SAMPLES outcomes), or after CONSECUTIVE_TRIP
+      errors in a row. While open, failover.py skips the account (routing
+      to another stream) or fails fast with 503.
+    - When the open period ends the circuit is half-open: exactly one
+      request (across all workers) is let through as a probe. Success
+      closes the circuit; failure reopens it for twice as long, up to
+      MAX_OPEN.
+
+    Without Redis every account is considered healthy, as before.
+
+GitHub: https://github.com/cedric-marcoux/dispatcharr_timeshift
+"""
+
+import logging
+import time
+
+from .cache import get_redis
+
+logger = logging.getLogger("plugins.dispatcharr_timeshift.health")
+
+# Outcomes kept per account, and how far back they count
+WINDOW_SIZE = 50
+WINDOW_SECONDS = 300
+
+MIN_SAMPLES = 5
+ERROR_RATE_TRIP = 0.5
+CONSECUTIVE_TRIP = 3
+
+INITIAL_OPEN = 30
+MAX_OPEN = 300
+
+# A probe that never reports (killed worker) frees the half-open slot after this
+PROBE_TIMEOUT = 20
+
+_EVENTS_KEY = "dispatcharr_timeshift:health:{}:events"
+_OPEN_UNTIL_KEY = "dispatcharr_timeshift:health:{}:open_until"
+_OPEN_FOR_KEY = "dispatcharr_timeshift:health:{}:open_for"
+_PROBE_KEY = "dispatcharr_timeshift:health:{}:probe"
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def allow(account_id):
+    """
+    Return True if a request may be sent to this account now.
+
+    In the half-open state this claims the single probe slot, so only one
+    caller gets True until the probe reports.
+    """
+    redis = get_redis()
+    if redis is None:
+        return True
+    try:
+        open_until = redis.get(_OPEN_UNTIL_KEY.format(account_id))
+        if open_until is None:
+            return True
+        if time.time() < float(open_until):
+            return False
+        # Half-open: one probe at a time across all workers
+        if redis.set(_PROBE_KEY.format(account_id), 1, nx=True, ex=PROBE_TIMEOUT):
+            logger.info(f"[Timeshift] Account {account_id} circuit half-open, probing")
+            return True
+        return False
+    except Exception as e:
+        logger.debug(f"[Timeshift] Health check unavailable: {e}")
+        return True
+
+
+def record_success(account_id, ttfb):
+    """Record a request answered in ttfb seconds; closes a half-open circuit."""
+    redis = get_redis()
+    if redis is None:
+        return
+    try:
+        if redis.get(_OPEN_UNTIL_KEY.format(account_id)) is not None:
+            # Start over: the outage's errors must not re-trip the circuit
+            redis.delete(
+                _OPEN_UNTIL_KEY.format(account_id),
+                _OPEN_FOR_KEY.format(account_id),
+                _PROBE_KEY.format(account_id),
+                _EVENTS_KEY.format(account_id),
+            )
+            logger.info(f"[Timeshift] Account {account_id} circuit closed (provider recovered)")
+        _push(redis, account_id, f"{time.time():.3f}:ok:{int(ttfb * 1000)}")
+    except Exception as e:
+        logger.debug(f"[Timeshift] Could not record provider success: {e}")
+
+
+def record_failure(account_id):
+    """Record a failed request; may open (or reopen) the circuit."""
+    redis = get_redis()
+    if redis is None:
+        return
+    try:
+        _push(redis, account_id, f"{time.time():.3f}:error:0")
+        open_until = redis.get(_OPEN_UNTIL_KEY.format(account_id))
+        if open_until is not None:
+            # Only the half-open probe reopens; stragglers from before the
+            # circuit opened don't extend it
+            if time.time() >= float(open_until):
+                _open(redis, account_id, reopen=True)
+        elif _should_trip(redis, account_id):
+            _open(redis, account_id, reopen=False)
+    except Exception as e:
+        logger.debug(f"[Timeshift] Could not record provider failure: {e}")
+
+
+def _push(redis, account_id, event):
+    key = _EVENTS_KEY.format(account_id)
+    redis.lpush(key, event)
+    redis.ltrim(key, 0, WINDOW_SIZE - 1)
+    redis.expire(key, WINDOW_SECONDS)
+
+
+def _recent_events(redis, account_id):
+    """Return [(ok, ttfb_ms)] newest first, within WINDOW_SECONDS."""
+    cutoff = time.time() - WINDOW_SECONDS
+    events = []
+    for raw in redis.lrange(_EVENTS_KEY.format(account_id), 0, -1):
+        stamp, outcome, ttfb_ms = _decode(raw).split(":")
+        if float(stamp) < cutoff:
+            break
+        events.append((outcome == "ok", int(ttfb_ms)))
+    return events
+
+
+def _should_trip(redis, account_id):
+    events = _recent_events(redis, account_id)
+    if len(events) >= CONSECUTIVE_TRIP and not any(ok for ok, _ttfb in events[:CONSECUTIVE_TRIP]):
+        return True
+    if len(events) < MIN_SAMPLES:
+        return False
+    errors = sum(1 for ok, _ttfb in events if not ok)
+    return errors / len(events) >= ERROR_RATE_TRIP
+
+
+def _open(redis, account_id, reopen):
+    open_for = INITIAL_OPEN
+    if reopen:
+        previous = redis.get(_OPEN_FOR_KEY.format(account_id))
+        open_for = min(MAX_OPEN, int(float(previous or INITIAL_OPEN)) * 2)
+    redis.set(_OPEN_UNTIL_KEY.format(account_id), time.time() + open_for)
+    redis.set(_OPEN_FOR_KEY.format(account_id), open_for)
+    redis.delete(_PROBE_KEY.format(account_id))
+    logger.warning(f"[Timeshift] Account {account_id} circuit open for {open_for}s (provider failing)")
+
+
+def stats(account_id):
+    """
+    Summarize an account's recent health.
+
+    Returns:
+        dict with samples, error_rate, ttfb_p50_ms, ttfb_p95_ms and state
+        ("closed", "open" or "half-open"), or None without Redis (or on
+        a Redis error)
+    """
+    redis = get_redis()
+    if redis is None:
+        return None
+    try:
+        events = _recent_events(redis, account_id)
+        open_until = redis.get(_OPEN_UNTIL_KEY.format(account_id))
+    except Exception as e:
+        logger.debug(f"[Timeshift] Health stats unavailable: {e}")
+        return None
+    ttfbs = sorted(ttfb for ok, ttfb in events if ok)
+
+    def percentile(p):
+        if not ttfbs:
+            return None
+        return ttfbs[min(len(ttfbs) - 1, int(p * len(ttfbs)))]
+
+    if open_until is None:
+        state = "closed"
+    elif time.time() < float(open_until):
+        state = "open"
+    else:
+        state = "half-open"
+
+    return {
+        "samples": len(events),
+        "error_rate": (sum(1 for ok, _ttfb in events if not ok) / len(events)) if events else 0.0,
+        "ttfb_p50_ms": percentile(0.5),
+        "ttfb_p95_ms": percentile(0.95),
+        "state": state,
+    }
@@ -0,0 +1,376 @@
+"""
+Dispatcharr Timeshift Plugin - HLS output for catch-up
+
+Optional segmented output: the timeshift window as an HLS playlist
+(/timeshift/.../{provider_stream_id}.m3u8) of short MPEG-TS segments
+(/timeshift/.../{provider_stream_id}/{n}.ts), cut from the provider's single
+timeshift.php body in pure Python.
+
+WHY?
+    The only output was one long .ts proxied byte for byte, so every seek
+    was an upstream Range request and Apple clients (Snappier) had to scrub
+    a progressive download. With segments, a seek is a request for one
+    small, cacheable piece.
+
+HOW:
+    - The playlist needs the body size: it comes from the segment cache, or
+      from one upstream request whose first segments keep streaming into
+      the cache in the background (segment 0 then follows that fetch).
+    - Segment n covers the bytes around n * (size / count). Each cut point
+      is moved to the first keyframe (ts_index.find_keyframe) within a
+      short window after the nominal offset. The cut is a function of the
+      program's bytes only, so segment n's end and segment n+1's start
+      agree without any shared state.
+    - Segment bytes go through views._cached_body: served from the segment
+      cache, or fetched with a Range request and stored. The next segment
+      is prefetched in parallel when the account has a free connection.
+    - Every segment after the first starts with the program's PAT and PMT
+      (ts_index.find_tables, read once from the stored start), so a player
+      joining at any segment can decode right away.
+    - Windows that can't be cut (not yet aired, segment cache disabled, no
+      known size) get a one-entry playlist pointing at the regular .ts URL.
+
+    EXTINF durations come from the program's PCR index (ts_index.py) where
+    it covers both ends of a segment, and are nominal (segment_seconds)
+    elsewhere: segments are cut by byte rate, not by time.
+
+GitHub: https://github.com/cedric-marcoux/dispatcharr_timeshift
+"""
+
+import logging
+import math
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.http import HttpResponse, Http404, StreamingHttpResponse
+
+from . import failover
+from .cache import get_plugin_setting
+from .relay import find_sync
+from .ts_index import TS_PACKET_SIZE, find_keyframe, find_tables
+from .views import (
+    _cached_body, _candidate_targets, _prepare_timeshift, _relay_response,
+    _segment_cache_program, _segment_writer, _upstream_error, _wait_for_owner,
+)
+
+logger = logging.getLogger("plugins.dispatcharr_timeshift.hls")
+
+DEFAULT_SEGMENT_SECONDS = 6
+
+# Cut points move to a keyframe at most this far past the nominal offset
+MAX_KEYFRAME_SCAN = 2 * 1024 * 1024
+
+# Segments pulled into the cache behind the playlist's upstream request
+PLAYLIST_PRIMED_SEGMENTS = 2
+
+# PAT/PMT are looked for in this much of the program's start
+TABLE_SCAN_BYTES = 512 * 1024
+
+# Index samples further apart than this don't time a segment boundary
+MAX_SAMPLE_SPAN = 16 * 1024 * 1024
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# Program key -> PAT + PMT packets
+_tables = OrderedDict()
+_tables_lock = threading.Lock()
+_TABLES_MAX_ENTRIES = 64
+
+
+def is_enabled():
+    return get_plugin_setting("hls_output", False) in (True, "true", "1", 1)
+
+
+def segment_seconds():
+    try:
+        seconds = int(get_plugin_setting("hls_segment_seconds", DEFAULT_SEGMENT_SECONDS))
+    except (TypeError, ValueError):
+        seconds = DEFAULT_SEGMENT_SECONDS
+    return max(2, seconds)
+
+
+def segment_count(duration_minutes):
+    return max(1, math.ceil(int(duration_minutes) * 60 / segment_seconds()))
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="timeshift-hls")
+        return _executor
+
+
+def _in_background(func, *args):
+    def run():
+        try:
+            func(*args)
+        except Exception as e:
+            logger.debug(f"[Timeshift] HLS background fetch failed: {e}")
+        finally:
+            from django.db import connection
+            connection.close()
+
+    _get_executor().submit(run)
+
+
+# =============================================================================
+# Views
+# =============================================================================
+
+def timeshift_playlist(request, username, password, stream_id, timestamp, duration):
+    """Serve the HLS playlist of a timeshift window (see module docstring)."""
+    error, target = _prepare_timeshift(username, password, timestamp, duration)
+    if error is not None:
+        return error
+
+    error, target, program = _segmented_program(_candidate_targets(target))
+    if error is not None:
+        return error
+
+    if program is None:
+        # Can't be cut: one segment, the regular progressive URL
+        logger.info("[Timeshift] HLS: window not segmentable, single-entry playlist")
+        entries = [(int(target.duration) * 60, f"{target.provider_stream_id}.ts")]
+    else:
+        count = segment_count(target.duration)
+        durations = _segment_durations(program, target.duration, count)
+        entries = [(durations[n], f"{target.provider_stream_id}/{n}.ts") for n in range(count)]
+        logger.info(f"[Timeshift] HLS playlist: {count} segments of {segment_seconds()}s")
+
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:3",
+        f"#EXT-X-TARGETDURATION:{math.ceil(max(seconds for seconds, _uri in entries))}",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+        "#EXT-X-PLAYLIST-TYPE:VOD",
+    ]
+    for seconds, uri in entries:
+        lines.append(f"#EXTINF:{seconds:.3f},")
+        lines.append(uri)
+    lines.append("#EXT-X-ENDLIST")
+    return HttpResponse("\n".join(lines) + "\n", content_type="application/vnd.apple.mpegurl")
+
+
+def timeshift_segment(request, username, password, stream_id, timestamp, duration, segment):
+    """Serve one HLS segment of a timeshift window."""
+    error, target = _prepare_timeshift(username, password, timestamp, duration)
+    if error is not None:
+        return error
+
+    error, target, program = _segmented_program(_candidate_targets(target))
+    if error is not None:
+        return error
+    number, count = int(segment), segment_count(target.duration)
+    if program is None or number >= count:
+        raise Http404("Segment not found")
+
+    headers = {'User-Agent': target.user_agent}
+    if number + 1 < count:
+        _prefetch(program, target, headers, number + 1, count)
+
+    body = _segment_body(program, target.url, headers, target.m3u_account, number, count)
+    if number:
+        tables = _program_tables(program)
+        if tables:
+            body = _prepended(tables, body)
+    return StreamingHttpResponse(body, content_type=program.content_type)
+
+
+# =============================================================================
+# Segmenting
+# =============================================================================
+
+def _segmented_program(candidates):
+    """
+    Return (error, target, program) for the provider serving this window.
+
+    program is a CachedProgram whose total size is known, or None when the
+    window can't be segmented. Learns the size with one upstream request
+    if needed, leaving the first segments streaming into the cache.
+    """
+    primary = candidates[0]
+    target = failover.sticky_target(candidates)
+    program = _segment_cache_program(target)
+    if program is None:
+        return None, target, None
+    if program.total:
+        return None, target, program
+
+    state = _wait_for_owner(program)
+    if state is not None and state.total:
+        program.reload()
+        return None, target, program
+
+    # Sticky provider first: segment byte offsets are only valid on it
+    ordered = [target] + [candidate for candidate in candidates if candidate is not target]
+    result = failover.open_upstream(ordered, {'Range': 'bytes=0-'})
+    if result.response is None:
+        return _upstream_error(result.error), target, None
+
+    target, response, slot = result.target, result.response, result.slot
+    failover.remember_choice(primary, target)
+    program = _segment_cache_program(target)
+    claim = program.claim()
+    writer = _segment_writer(program, response, claim)
+    if writer is None or not writer.program.total or writer.start != 0:
+        if writer is not None:
+            writer.close()
+        elif claim is not None:
+            claim.release()
+        response.close()
+        slot.release()
+        return None, target, None
+
+    total = writer.program.total
+    primed = total * PLAYLIST_PRIMED_SEGMENTS // segment_count(target.duration)
+    _in_background(_drain, _relay_response(response, target.m3u_account, writer, limit=primed, slot=slot))
+    return None, target, program
+
+
+def _drain(body):
+    for _chunk in body:
+        pass
+
+
+def _segment_durations(program, duration_minutes, count):
+    """EXTINF seconds of each segment: from the PCR index where it covers both ends."""
+    seconds = segment_seconds()
+    nominal = [seconds] * (count - 1) + [int(duration_minutes) * 60 - (count - 1) * seconds]
+    index = program.time_index()
+    if not index.starts_at_zero:
+        return nominal
+
+    total = program.total
+    times = [index.time_at(_nominal_offset(total, count, n), MAX_SAMPLE_SPAN) for n in range(count)]
+    times.append(index.time_at(total, MAX_SAMPLE_SPAN))
+    durations = []
+    for n in range(count):
+        begin, end = times[n], times[n + 1]
+        durations.append(end - begin if begin is not None and end is not None and end > begin else nominal[n])
+    return durations
+
+
+def _program_tables(program):
+    """PAT + PMT packets of a program (b"" until its start is stored)."""
+    with _tables_lock:
+        tables = _tables.get(program.key)
+        if tables is not None:
+            _tables.move_to_end(program.key)
+            return tables
+
+    covered = program.covered_until(0)
+    if not covered:
+        return b""
+    scanned = min(covered, TABLE_SCAN_BYTES)
+    try:
+        data = b"".join(program.read(0, scanned))
+    except OSError:
+        return b""
+    sync = find_sync(data)
+    tables = find_tables(data, sync) if sync is not None else b""
+    if not tables and scanned < TABLE_SCAN_BYTES:
+        return b""  # Maybe in bytes not stored yet: look again next time
+
+    with _tables_lock:
+        _tables[program.key] = tables
+        while len(_tables) > _TABLES_MAX_ENTRIES:
+            _tables.popitem(last=False)
+    return tables
+
+
+def _prepended(tables, body):
+    try:
+        yield tables
+        yield from body
+    finally:
+        body.close()
+
+
+def _nominal_offset(total, count, number):
+    offset = total * number // count
+    return offset - offset % TS_PACKET_SIZE
+
+
+def _scan_bytes(total, count):
+    return min(MAX_KEYFRAME_SCAN, max(TS_PACKET_SIZE, (total // count) // 2))
+
+
+def _segment_body(program, url, headers, m3u_account, number, count, queue_timeout=None):
+    """
+    Yield segment number's bytes: from the first keyframe in the scan
+    window at its nominal start up to the first keyframe in the scan
+    window at the next segment's nominal start.
+    """
+    total = program.total
+    scan = _scan_bytes(total, count)
+    begin = _nominal_offset(total, count, number)
+    last_segment = number + 1 >= count
+    cut = None if last_segment else _nominal_offset(total, count, number + 1)
+    stop = total if last_segment else min(total, cut + scan)
+
+    buffer = bytearray()
+    base = begin          # absolute offset of buffer[0]
+    started = number == 0
+    searched = 0          # buffer offset where the next keyframe search resumes
+
+    body = _cached_body(program, url, headers, m3u_account, begin, stop - 1, queue_timeout)
+    try:
+        for chunk in body:
+            buffer += chunk
+            if not started:
+                # Bytes before the keyframe belong to the previous segment
+                keyframe = find_keyframe(buffer, searched, scan)
+                if keyframe is None:
+                    if len(buffer) < scan and base + len(buffer) < total:
+                        searched = max(0, (len(buffer) - TS_PACKET_SIZE) // TS_PACKET_SIZE * TS_PACKET_SIZE)
+                        continue
+                    keyframe = 0
+                del buffer[:keyframe]
+                base += keyframe
+                started, searched = True, 0
+
+            if cut is not None and base + len(buffer) > cut:
+                if base < cut:
+                    head = cut - base
+                    yield bytes(buffer[:head])
+                    del buffer[:head]
+                    base, searched = cut, 0
+                keyframe = find_keyframe(buffer, searched, scan)
+                if keyframe is not None:
+                    yield bytes(buffer[:keyframe])
+                    return
+                if len(buffer) >= scan or base + len(buffer) >= total:
+                    return  # No keyframe: the next segment starts at cut
+                searched = max(0, (len(buffer) - TS_PACKET_SIZE) // TS_PACKET_SIZE * TS_PACKET_SIZE)
+                continue
+
+            if buffer:
+                yield bytes(buffer)
+                base += len(buffer)
+                buffer.clear()
+
+        if started and buffer and cut is None:
+            yield bytes(buffer)
+    finally:
+        # Closes the upstream response if we stopped early
+        body.close()
+
+
+def _prefetch(program, target, headers, number, count):
+    """Pull a segment into the cache in the background if a connection is free."""
+    begin = _nominal_offset(program.total, count, number)
+    end = program.total if number + 1 >= count else _nominal_offset(program.total, count, number + 1)
+    covered = program.covered_until(begin)
+    if covered is not None and covered >= end:
+        return
+    state = program.live_state()
+    if state is not None and state.start >= 0 and state.start <= begin <= state.position:
+        return  # Another request is already fetching it
+
+    _in_background(
+        _drain,
+        _segment_body(program, target.url, headers, target.m3u_account, number, count, queue_timeout=0),
+    )
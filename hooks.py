@@ -3,15 +3,23 @@ Dispatcharr Timeshift Plugin - Hooks
 
 Implements timeshift via monkey-patching (no modification to Dispatcharr source):
 1. Patches xc_get_live_streams to add tv_archive and use provider's stream_id
+   (cached per access scope, sent pre-serialized via a JsonResponse patch)
 2. Patches stream_xc to find channels by provider stream_id (for live streaming)
 3. Patches xc_get_epg to find channels by provider stream_id (for EPG/timeshift data)
-4. Patches URLResolver.resolve to intercept /timeshift/ URLs
+   and, when enabled, warm up the provider for the catch-up that follows (warmup.py)
+4. Patches URLResolver.resolve to intercept /timeshift/ URLs (WSGI view, or the
+   optional async view in async_views.py; .m3u8 playlists and their segments
+   when HLS output is enabled, hls.py)
 5. Patches generate_epg to convert XMLTV timestamps to local timezone (fixes IPTVX offset)
+   and serve the converted guide from an ETag-validated disk cache
+6. Patches xc_player_api to gzip/zstd-compress its JSON responses
 
 RUNTIME ENABLE/DISABLE:
     Hooks are installed once at startup (regardless of plugin enabled state).
     Each hook checks _is_plugin_enabled() at runtime before executing its logic.
     This allows enabling/disabling the plugin without restarting Dispatcharr.
+    The enabled flag comes from a per-worker snapshot (cache.py), so the check
+    does not hit the database on every request.
 
     Why this approach?
     - Dispatcharr's PluginManager only toggles the 'enabled' flag in database
@@ -51,32 +59,42 @@ GitHub: https://github.com/cedric-marcoux/dispatcharr_timeshift
 
 import re
 import logging
+import functools
+
+from .cache import (
+    is_plugin_enabled, get_plugin_timezone, lookup_provider_stream,
+    get_cached_live_streams, set_cached_live_streams, SerializedList,
+)
 
 logger = logging.getLogger("plugins.dispatcharr_timeshift.hooks")
 
 # Store original functions for potential restoration
 _original_xc_get_live_streams = None
 _original_stream_xc = None
+_original_xc_player_api = None
 _original_xc_get_epg = None
 _original_generate_epg = None
+_original_json_response = None
 _original_url_callbacks = {}
 _original_resolve = None
 
 
 def _is_plugin_enabled():
     """
-    Check if plugin is enabled in database.
+    Check if plugin is enabled.
 
     Called at runtime by each patched function to determine if timeshift
     logic should execute. This enables hot enable/disable without restart.
 
+    Reads the per-worker snapshot in cache.py instead of querying
+    PluginConfig on every call; the snapshot is refreshed by PluginConfig
+    signals and a short TTL (see cache.py for cross-worker invalidation).
+
     Returns:
         bool: True if plugin is enabled, False otherwise
     """
     try:
-        from apps.plugins.models import PluginConfig
-        config = PluginConfig.objects.get(key='dispatcharr_timeshift')
-        return config.enabled
+        return is_plugin_enabled()
     except Exception:
         return False
 
@@ -91,7 +109,11 @@ def install_hooks():
     logger.info("[Timeshift] Installing hooks...")
 
     try:
+        from .cache import connect_signals
+        connect_signals()
         _patch_xc_get_live_streams()
+        _patch_json_response()
+        _patch_xc_player_api()
         _patch_stream_xc()
         _patch_xc_get_epg()
         _patch_generate_epg()
@@ -109,10 +131,24 @@ def uninstall_hooks():
     """
     logger.info("[Timeshift] Uninstalling hooks...")
     _restore_xc_get_live_streams()
+    _restore_json_response()
+    _restore_xc_player_api()
     _restore_stream_xc()
     _restore_xc_get_epg()
     _restore_generate_epg()
     _restore_url_resolver()
+    try:
+        from .upstream import close_all
+        close_all()
+        from .async_views import close_all as close_all_async
+        close_all_async()
+    except Exception as e:
+        logger.debug(f"[Timeshift] Could not close upstream sessions: {e}")
+    try:
+        from .cache import disconnect_signals
+        disconnect_signals()
+    except Exception as e:
+        logger.debug(f"[Timeshift] Could not disconnect signals: {e}")
     logger.info("[Timeshift] All hooks uninstalled")
 
 
@@ -136,26 +172,30 @@ def _patch_xc_get_live_streams():
     _original_xc_get_live_streams = output_views.xc_get_live_streams
 
     def patched_xc_get_live_streams(request, user, category_id=None):
-        streams = _original_xc_get_live_streams(request, user, category_id)
-
         # Skip if plugin is disabled
         if not _is_plugin_enabled():
-            return streams
+            return _original_xc_get_live_streams(request, user, category_id)
 
-        from apps.channels.models import Channel
+        # Players refresh this list every few minutes and almost always get
+        # the same payload: serve it (pre-serialized) from the cache
+        cache_key = _live_streams_cache_key(request, user, category_id)
+        cached = get_cached_live_streams(cache_key)
+        if cached is not None:
+            return cached
+
+        streams = _original_xc_get_live_streams(request, user, category_id)
+
+        # One query for the whole list instead of two per channel
+        first_stream_props = _first_stream_properties(
+            [stream_data.get('stream_id') for stream_data in streams]
+        )
 
         for stream_data in streams:
             try:
-                channel = Channel.objects.filter(id=stream_data.get('stream_id')).first()
-                if not channel:
+                props = first_stream_props.get(int(stream_data.get('stream_id')))
+                if props is None:
                     continue
 
-                first_stream = channel.streams.order_by('channelstream__order').first()
-                if not first_stream:
-                    continue
-
-                props = first_stream.custom_properties or {}
-
                 # Add tv_archive values
                 stream_data['tv_archive'] = int(props.get('tv_archive', 0))
                 stream_data['tv_archive_duration'] = int(props.get('tv_archive_duration', 0))
@@ -169,12 +209,69 @@ def _patch_xc_get_live_streams():
             except Exception as e:
                 logger.debug(f"[Timeshift] Error enhancing stream: {e}")
 
-        return streams
+        return set_cached_live_streams(cache_key, streams)
 
     output_views.xc_get_live_streams = patched_xc_get_live_streams
     logger.info("[Timeshift] Patched xc_get_live_streams")
 
 
+def _live_streams_cache_key(request, user, category_id):
+    """
+    Build the cache scope for a get_live_streams response.
+
+    The output depends on what the user may see (access level and channel
+    profiles, admins see everything), the category filter, and the host the
+    client used (logo URLs are absolute).
+    """
+    import hashlib
+
+    if user.user_level >= 10:
+        scope = "all"
+    else:
+        profile_ids = sorted(user.channel_profiles.values_list('id', flat=True))
+        scope = f"{user.user_level}:{','.join(str(i) for i in profile_ids)}"
+
+    raw = f"{scope}|{category_id or ''}|{request.scheme}://{request.get_host()}"
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def _first_stream_properties(channel_ids):
+    """
+    Map channel id -> custom_properties of its first stream in one query.
+
+    "First" is the lowest channelstream order, the same stream that
+    channel.streams.order_by('channelstream__order').first() returns.
+    Channels without streams are absent from the result.
+
+    Args:
+        channel_ids: Iterable of Dispatcharr channel ids (None and
+            non-numeric values are ignored)
+
+    Returns:
+        dict: {channel_id: custom_properties dict}
+    """
+    from apps.channels.models import ChannelStream
+
+    ids = set()
+    for channel_id in channel_ids:
+        try:
+            ids.add(int(channel_id))
+        except (TypeError, ValueError):
+            continue
+    if not ids:
+        return {}
+
+    rows = ChannelStream.objects.filter(
+        channel_id__in=ids
+    ).order_by('channel_id', 'order').values_list('channel_id', 'stream__custom_properties')
+
+    result = {}
+    for channel_id, props in rows:
+        if channel_id not in result:
+            result[channel_id] = props or {}
+    return result
+
+
 def _restore_xc_get_live_streams():
     """Restore original xc_get_live_streams function."""
     global _original_xc_get_live_streams
@@ -186,6 +283,125 @@ def _restore_xc_get_live_streams():
         logger.info("[Timeshift] Restored xc_get_live_streams")
 
 
+def _patch_json_response():
+    """
+    Patch JsonResponse in Dispatcharr's output views to send pre-serialized JSON.
+
+    WHY THIS PATCH?
+        xc_player_api wraps our xc_get_live_streams result in
+        JsonResponse(..., safe=False), which would json.dumps the cached list
+        (thousands of dicts) again on every request. When the data is a
+        SerializedList we send its cached bytes instead - byte-identical to
+        what JsonResponse would have produced.
+    """
+    global _original_json_response
+
+    from django.http import HttpResponse
+    from apps.output import views as output_views
+
+    if _original_json_response is not None:
+        return
+
+    _original_json_response = output_views.JsonResponse
+
+    class PreSerializedJsonResponse(_original_json_response):
+        def __init__(self, data, *args, **kwargs):
+            if isinstance(data, SerializedList) and data.json_bytes:
+                # Same defaults as JsonResponse, minus the encoding work
+                for unused in ('encoder', 'safe', 'json_dumps_params'):
+                    kwargs.pop(unused, None)
+                kwargs.setdefault('content_type', 'application/json')
+                HttpResponse.__init__(self, content=data.json_bytes, **kwargs)
+                # Lets the player_api wrapper reuse pre-compressed variants
+                self.timeshift_serialized = data
+                return
+            super().__init__(data, *args, **kwargs)
+
+    output_views.JsonResponse = PreSerializedJsonResponse
+    logger.info("[Timeshift] Patched JsonResponse for pre-serialized responses")
+
+
+def _restore_json_response():
+    """Restore original JsonResponse in Dispatcharr's output views."""
+    global _original_json_response
+
+    if _original_json_response is not None:
+        from apps.output import views as output_views
+        output_views.JsonResponse = _original_json_response
+        _original_json_response = None
+        logger.info("[Timeshift] Restored JsonResponse")
+
+
+def _patch_xc_player_api():
+    """
+    Patch xc_player_api to gzip/zstd-compress its JSON responses.
+
+    WHY THIS PATCH?
+        get_live_streams and the EPG tables (get_simple_data_table with
+        base64 titles) are large JSON documents that compress ~5x, and
+        Dispatcharr sends them uncompressed. player_api.php is the one place
+        that has both the request (Accept-Encoding) and the final response.
+
+        For cached get_live_streams responses the compressed body is built
+        once per cache entry (SerializedList.compressed), other actions are
+        compressed on the fly.
+
+    Like stream_xc, the URL pattern callbacks must be patched too.
+    """
+    global _original_xc_player_api
+
+    from apps.output import views as output_views
+    from dispatcharr import urls as main_urls
+    from .compression import compress_response
+
+    if _original_xc_player_api is not None:
+        return
+
+    _original_xc_player_api = output_views.xc_player_api
+
+    @functools.wraps(_original_xc_player_api)
+    def patched_xc_player_api(request, *args, **kwargs):
+        response = _original_xc_player_api(request, *args, **kwargs)
+        if not _is_plugin_enabled():
+            return response
+        try:
+            serialized = getattr(response, 'timeshift_serialized', None)
+            get_variant = serialized.compressed if serialized is not None else None
+            return compress_response(request, response, get_variant)
+        except Exception as e:
+            logger.debug(f"[Timeshift] Response compression skipped: {e}")
+            return response
+
+    output_views.xc_player_api = patched_xc_player_api
+
+    for pattern in main_urls.urlpatterns:
+        if hasattr(pattern, 'callback') and pattern.callback == _original_xc_player_api:
+            _original_url_callbacks[id(pattern)] = _original_xc_player_api
+            pattern.callback = patched_xc_player_api
+            logger.info(f"[Timeshift] Patched URL pattern: {pattern.name}")
+
+    logger.info("[Timeshift] Patched xc_player_api for response compression")
+
+
+def _restore_xc_player_api():
+    """Restore original xc_player_api function and URL pattern callbacks."""
+    global _original_xc_player_api
+
+    if _original_xc_player_api:
+        from apps.output import views as output_views
+        from dispatcharr import urls as main_urls
+
+        output_views.xc_player_api = _original_xc_player_api
+
+        for pattern in main_urls.urlpatterns:
+            if _original_url_callbacks.get(id(pattern)) is _original_xc_player_api:
+                pattern.callback = _original_url_callbacks.pop(id(pattern))
+                logger.info(f"[Timeshift] Restored URL pattern: {pattern.name}")
+
+        _original_xc_player_api = None
+        logger.info("[Timeshift] Restored xc_player_api")
+
+
 def _patch_stream_xc():
     """
     Patch stream_xc to find channels by provider stream_id first.
@@ -221,7 +437,7 @@ def _patch_stream_xc():
         from django.shortcuts import get_object_or_404
         from rest_framework.response import Response
         from apps.accounts.models import User
-        from apps.channels.models import Channel, Stream
+        from apps.channels.models import Channel
 
         user = get_object_or_404(User, username=username)
 
@@ -240,14 +456,10 @@ def _patch_stream_xc():
 
         # TIMESHIFT FIX: First try to find by provider stream_id
         # This handles the case where API returns provider's stream_id
-        stream = Stream.objects.filter(
-            custom_properties__stream_id=channel_id_str,
-            m3u_account__account_type='XC'
-        ).first()
-        if stream:
-            channel = stream.channels.first()
-            if channel:
-                logger.info(f"[Timeshift] Live: Found channel by provider stream_id={channel_id_str}: {channel.name}")
+        # (in-memory index, see cache.py - no query on a miss)
+        channel, _stream = lookup_provider_stream(channel_id_str)
+        if channel:
+            logger.info(f"[Timeshift] Live: Found channel by provider stream_id={channel_id_str}: {channel.name}")
 
         # Fall back to original behavior (internal ID lookup)
         if not channel:
@@ -317,11 +529,10 @@ def _restore_stream_xc():
 
         # Restore URL pattern callbacks
         for pattern in main_urls.urlpatterns:
-            if id(pattern) in _original_url_callbacks:
-                pattern.callback = _original_url_callbacks[id(pattern)]
+            if _original_url_callbacks.get(id(pattern)) is _original_stream_xc:
+                pattern.callback = _original_url_callbacks.pop(id(pattern))
                 logger.info(f"[Timeshift] Restored URL pattern: {pattern.name}")
 
-        _original_url_callbacks = {}
         _original_stream_xc = None
         logger.info("[Timeshift] Restored stream_xc")
 
@@ -353,7 +564,7 @@ def _patch_xc_get_epg():
             return _original_xc_get_epg(request, user, short)
 
         from django.http import Http404
-        from apps.channels.models import Channel, Stream
+        from apps.channels.models import Channel
 
         channel_id = request.GET.get('stream_id')
         if not channel_id:
@@ -363,14 +574,10 @@ def _patch_xc_get_epg():
 
         # TIMESHIFT FIX: First try to find by provider stream_id
         # This handles the case where API returns provider's stream_id
-        stream = Stream.objects.filter(
-            custom_properties__stream_id=str(channel_id),
-            m3u_account__account_type='XC'
-        ).first()
-        if stream:
-            channel = stream.channels.first()
-            if channel:
-                logger.info(f"[Timeshift] EPG: Found channel by provider stream_id={channel_id}: {channel.name}")
+        # (in-memory index, see cache.py - no query on a miss)
+        channel, _stream = lookup_provider_stream(channel_id)
+        if channel:
+            logger.info(f"[Timeshift] EPG: Found channel by provider stream_id={channel_id}: {channel.name}")
 
         # Fall back to original behavior (internal ID lookup)
         if not channel:
@@ -415,78 +622,21 @@ def _patch_xc_get_epg():
         if has_tv_archive and not short:
             # CUSTOM EPG QUERY: Include past programs for timeshift
             # Instead of calling original function, we build EPG ourselves
-            from datetime import datetime, timezone, timedelta
+            # from the per-channel listing cache (see epg.py)
             from django.utils import timezone as django_timezone
-            import base64
+            from .epg import build_archive_listings
 
             archive_duration_days = int(props.get('tv_archive_duration', 7))
-            start_date = django_timezone.now() - timedelta(days=archive_duration_days)
-
-            # Get programs from the last X days until now + 7 days in future
-            programs = channel.epg_data.programs.filter(
-                start_time__gte=start_date
-            ).order_by('start_time') if channel.epg_data else []
-
-            output = {"epg_listings": []}
             now = django_timezone.now()
 
-            # Get timezone from plugin settings or default to Europe/Brussels
-            from zoneinfo import ZoneInfo
-            try:
-                from apps.plugins.models import PluginConfig
-                config = PluginConfig.objects.filter(key='dispatcharr_timeshift').first()
-                timezone_str = config.config.get('timezone', 'Europe/Brussels') if config and config.config else 'Europe/Brussels'
-            except Exception:
-                timezone_str = 'Europe/Brussels'
-
-            local_tz = ZoneInfo(timezone_str)
-
-            for program in programs:
-                start = program.start_time
-                end = program.end_time
-                title = program.title
-                description = program.description
-
-                # Convert timestamps to local timezone (Europe/Brussels)
-                # Original provider sends 'start' field in local time, not UTC
-                # Snappier expects this format to match the user's timezone
-                local_tz = ZoneInfo("Europe/Brussels")
-                start_local = start.astimezone(local_tz)
-                end_local = end.astimezone(local_tz)
-
-                # Generate unique ID for each program using timestamp
-                # This is critical for clients like Snappier to distinguish programs
-                program_id = int(start.timestamp())
-
-                program_output = {
-                    "id": str(program_id),
-                    "epg_id": str(program.id) if hasattr(program, 'id') and program.id else str(program_id),
-                    "title": base64.b64encode(title.encode()).decode(),
-                    "lang": "fr",  # Match provider's language field
-                    "start": start_local.strftime("%Y-%m-%d %H:%M:%S"),    # Local time (Europe/Brussels) - match original provider
-                    "end": end_local.strftime("%Y-%m-%d %H:%M:%S"),        # Local time (Europe/Brussels) - match original provider
-                    "description": base64.b64encode(description.encode()).decode(),
-                    "channel_id": props.get('epg_channel_id') or str(channel.id),  # Use EPG channel ID from provider (e.g., "RTSUn.ch")
-                    "start_timestamp": str(int(start.timestamp())),  # STRING not int - match provider format
-                    "stop_timestamp": str(int(end.timestamp())),     # STRING not int - match provider format
-                    "stream_id": props.get('stream_id'),  # Use provider's stream_id, not internal channel ID
-                    "now_playing": 0 if start > now or end < now else 1,
-                }
-
-                # Set has_archive for past programs within archive duration
-                if end < now:
-                    days_ago = (now - end).days
-                    if days_ago <= archive_duration_days:
-                        program_output["has_archive"] = 1  # INTEGER not string - match provider format
-                        logger.debug(f"[Timeshift] EPG: Set has_archive=1 for '{title}' ending {days_ago} days ago")
-                    else:
-                        program_output["has_archive"] = 0  # INTEGER not string
-                else:
-                    program_output["has_archive"] = 0  # INTEGER not string
-
-                output['epg_listings'].append(program_output)
+            # Programs from the last X days until the end of the schedule
+            output = {"epg_listings": build_archive_listings(channel, props, archive_duration_days, now)}
 
             logger.info(f"[Timeshift] EPG: Generated {len(output['epg_listings'])} programs for channel {channel.name} (including past {archive_duration_days} days)")
+            # A catch-up request usually follows: get the provider ready
+            # (opt-in, background, budgeted - see warmup.py)
+            from .warmup import schedule as schedule_warmup
+            schedule_warmup(channel, first_stream)
             # Restore original GET params
             request.GET = original_get
             return output
@@ -532,6 +682,10 @@ def _patch_generate_epg():
 
         This patch wraps the generate_epg generator to intercept timestamp
         formatting and convert to local timezone before output.
+
+    CACHING:
+        The converted guide is cached on disk per profile/user scope and
+        timezone and served with ETag/Last-Modified (see xmltv.py).
     """
     global _original_generate_epg
 
@@ -545,69 +699,26 @@ def _patch_generate_epg():
             return _original_generate_epg(request, profile_name, user)
 
         # Get timezone from plugin settings
-        from zoneinfo import ZoneInfo
-        try:
-            from apps.plugins.models import PluginConfig
-            config = PluginConfig.objects.filter(key='dispatcharr_timeshift').first()
-            timezone_str = config.config.get('timezone', 'Europe/Brussels') if config and config.config else 'Europe/Brussels'
-        except Exception:
-            timezone_str = 'Europe/Brussels'
-
-        local_tz = ZoneInfo(timezone_str)
+        timezone_str = get_plugin_timezone()
         logger.info(f"[Timeshift] XMLTV: Converting timestamps to {timezone_str}")
 
-        # Call original function to get StreamingHttpResponse
-        original_response = _original_generate_epg(request, profile_name, user)
-
-        # Extract the original generator from StreamingHttpResponse
-        original_generator = original_response.streaming_content
-
-        # Wrap the generator to intercept and modify timestamp lines
-        import re
-        timestamp_pattern = re.compile(r'(\d{14}) ([+-]\d{4})')
-
-        def timezone_converting_generator():
-            for chunk in original_generator:
-                # Ensure chunk is string (might be bytes)
-                if isinstance(chunk, bytes):
-                    chunk = chunk.decode('utf-8')
-
-                # Only process chunks that contain programme tags with timestamps
-                if 'programme start=' in chunk or 'start="' in chunk or 'stop="' in chunk:
-                    # Replace timestamp format: convert from UTC to local timezone
-                    # Pattern matches: 20251128143000 +0000
-                    def convert_timestamp(match):
-                        from datetime import datetime
-                        timestamp_str = match.group(1)
-                        original_tz = match.group(2)
-
-                        # Parse the UTC timestamp
-                        try:
-                            utc_time = datetime.strptime(timestamp_str, "%Y%m%d%H%M%S")
-                            utc_time = utc_time.replace(tzinfo=ZoneInfo("UTC"))
-
-                            # Convert to local timezone
-                            local_time = utc_time.astimezone(local_tz)
-
-                            # Format back to XMLTV format
-                            return local_time.strftime("%Y%m%d%H%M%S %z")
-                        except Exception as e:
-                            logger.warning(f"[Timeshift] XMLTV timestamp conversion failed: {e}")
-                            return match.group(0)  # Return original if conversion fails
-
-                    chunk = timestamp_pattern.sub(convert_timestamp, chunk)
-
-                yield chunk
-
-        # Return a new StreamingHttpResponse with our wrapped generator
-        from django.http import StreamingHttpResponse
-        response = StreamingHttpResponse(
-            timezone_converting_generator(),
-            content_type='application/xml'
-        )
-        response['Content-Disposition'] = 'attachment; filename="Dispatcharr.xml"'
-        response['Cache-Control'] = 'no-cache'
-        return response
+        from .xmltv import detached_request, get_converter, xmltv_cache_key, serve_xmltv
+        converter = get_converter(timezone_str)
+        # A background rebuild runs after this request is finished
+        build_request = detached_request(request)
+
+        def original_chunks():
+            # Call original function to get StreamingHttpResponse and extract
+            # its generator; only runs on a cache miss or background rebuild
+            original_response = _original_generate_epg(build_request, profile_name, user)
+            if getattr(original_response, 'streaming', False):
+                return original_response.streaming_content
+            return [original_response.content]
+
+        # Serve the converted guide from the disk cache (ETag / 304 support),
+        # rewriting programme start/stop timestamps only when (re)building
+        cache_key = xmltv_cache_key(request, profile_name, user, timezone_str)
+        return serve_xmltv(request, cache_key, original_chunks, converter)
 
     output_views.generate_epg = patched_generate_epg
     logger.info("[Timeshift] Patched generate_epg for XMLTV timezone conversion")
@@ -653,23 +764,48 @@ def _patch_url_resolver():
         return
 
     from .views import timeshift_proxy
+    from .async_views import serving_asgi, timeshift_proxy_async, use_async_proxy
+    from . import hls
 
     TIMESHIFT_PATTERN = re.compile(
         r'^/?timeshift/(?P<username>[^/]+)/(?P<password>[^/]+)/'
         r'(?P<stream_id>\d+)/(?P<timestamp>[\d\-:]+)/(?P<duration>\d+)\.ts$'
     )
+    # HLS output (opt-in): playlist and its segments
+    HLS_PLAYLIST_PATTERN = re.compile(
+        r'^/?timeshift/(?P<username>[^/]+)/(?P<password>[^/]+)/'
+        r'(?P<stream_id>\d+)/(?P<timestamp>[\d\-:]+)/(?P<duration>\d+)\.m3u8$'
+    )
+    HLS_SEGMENT_PATTERN = re.compile(
+        r'^/?timeshift/(?P<username>[^/]+)/(?P<password>[^/]+)/'
+        r'(?P<stream_id>\d+)/(?P<timestamp>[\d\-:]+)/(?P<duration>\d+)/(?P<segment>\d+)\.ts$'
+    )
 
     _original_resolve = URLResolver.resolve
 
     def patched_resolve(self, path):
-        # Only intercept if plugin is enabled
-        if _is_plugin_enabled() and (path.startswith('/timeshift/') or path.startswith('timeshift/')):
+        # Cheap prefix check first: resolve() runs for EVERY request, so the
+        # enabled flag is only looked at for actual /timeshift/ URLs
+        if path.startswith('/timeshift/') or path.startswith('timeshift/'):
             match = TIMESHIFT_PATTERN.match(path)
             if match:
+                # Async view only when opted in, httpx is installed and an
+                # ASGI server handles the request (under WSGI Django would
+                # buffer the whole async body)
+                view = timeshift_proxy_async if use_async_proxy() and serving_asgi() else timeshift_proxy
+            else:
+                match = HLS_PLAYLIST_PATTERN.match(path)
+                view = hls.timeshift_playlist
+                if not match:
+                    match = HLS_SEGMENT_PATTERN.match(path)
+                    view = hls.timeshift_segment
+                if match and not hls.is_enabled():
+                    match = None
+            if match and _is_plugin_enabled():
                 from django.urls import ResolverMatch
                 logger.debug(f"[Timeshift] Intercepted: {path}")
                 return ResolverMatch(
-                    timeshift_proxy,
+                    view,
                     (),
                     match.groupdict(),
                     route=path,
@@ -70,11 +70,177 @@ class Plugin:
                 "label": "Provider Timezone",
                 "default": "Europe/Brussels",
                 "help_text": "Timezone for timestamp conversion (IANA format, e.g. Europe/Brussels, America/New_York)"
+            },
+            {
+                "id": "live_streams_cache_ttl",
+                "type": "number",
+                "label": "Live Streams Cache TTL (seconds)",
+                "default": 300,
+                "help_text": "How long a get_live_streams response is reused per user scope and category. Changes to channels, streams or profiles invalidate it immediately. 0 disables the cache."
+            },
+            {
+                "id": "xmltv_cache_ttl",
+                "type": "number",
+                "label": "XMLTV Cache TTL (seconds)",
+                "default": 3600,
+                "help_text": "Maximum age of the cached, timezone-converted XMLTV before it is rebuilt in the background. EPG and channel changes trigger a rebuild sooner."
+            },
+            {
+                "id": "shared_index",
+                "type": "boolean",
+                "label": "Shared Memory Index",
+                "default": True,
+                "help_text": "Keep the provider stream map and archive programme timelines in one memory-mapped file shared by all workers instead of a copy per worker."
+            },
+            {
+                "id": "shared_index_max_age",
+                "type": "number",
+                "label": "Shared Index Max Age (seconds)",
+                "default": 3600,
+                "help_text": "Rebuild the shared index after this long even without detected changes (moves the programme window forward)."
+            },
+            {
+                "id": "upstream_pool_size",
+                "type": "number",
+                "label": "Upstream Pool Size",
+                "default": 4,
+                "help_text": "Keep-alive connections kept per M3U account and worker for timeshift requests."
+            },
+            {
+                "id": "upstream_idle_timeout",
+                "type": "number",
+                "label": "Upstream Idle Timeout (seconds)",
+                "default": 120,
+                "help_text": "Close an account's pooled connections after this long without timeshift traffic."
+            },
+            {
+                "id": "redirect_cache_ttl",
+                "type": "number",
+                "label": "Redirect Cache TTL (seconds)",
+                "default": 60,
+                "help_text": "How long a provider's redirect to a CDN edge is reused for seeks in the same program. 0 disables."
+            },
+            {
+                "id": "respect_max_streams",
+                "type": "boolean",
+                "label": "Respect Account Max Streams",
+                "default": True,
+                "help_text": "Count live and catch-up connections per M3U account across all workers and queue catch-up requests when the account's max_streams is reached, instead of letting the provider reject them."
+            },
+            {
+                "id": "upstream_queue_timeout",
+                "type": "number",
+                "label": "Connection Queue Timeout (seconds)",
+                "default": 10,
+                "help_text": "How long a catch-up request waits for a free provider connection before answering 503."
+            },
+            {
+                "id": "epg_duration",
+                "type": "boolean",
+                "label": "Request Programme Duration",
+                "default": True,
+                "help_text": "Ask the provider for the length of the programme being played (from the EPG) instead of a fixed 2 hours."
+            },
+            {
+                "id": "duration_padding_minutes",
+                "type": "number",
+                "label": "Duration Padding (minutes)",
+                "default": 5,
+                "help_text": "Extra minutes requested after the programme's scheduled end, for late-running programmes."
+            },
+            {
+                "id": "failover_streams",
+                "type": "boolean",
+                "label": "Catch-up Failover",
+                "default": True,
+                "help_text": "When a provider fails, is slow or is at max_streams, try the channel's other archive-capable streams (in channel stream order)."
+            },
+            {
+                "id": "hedge_delay_ms",
+                "type": "number",
+                "label": "Hedge Delay (ms)",
+                "default": 1500,
+                "help_text": "If the provider has not answered after this long, also ask the next stream and keep whichever answers first. 0 disables hedging."
+            },
+            {
+                "id": "async_proxy",
+                "type": "boolean",
+                "label": "Async Timeshift Proxy",
+                "default": False,
+                "help_text": "Relay catch-up streams with an async HTTP client when /timeshift/ is served by an ASGI server such as Daphne or Uvicorn (requires the httpx package). One process then serves many viewers instead of one per worker. This path only relays: the Segment Cache, shared connections, failover/hedging, Speculative Warm-up, Continuous Catch-up Playback and the client watchdog only apply to the regular proxy. Requests served by uWSGI (WSGI) keep using the regular proxy."
+            },
+            {
+                "id": "segment_cache_size_mb",
+                "type": "number",
+                "label": "Segment Cache Size (MB)",
+                "default": 0,
+                "help_text": "Disk budget for cached catch-up programs (shared by all workers, least recently watched evicted first). Repeat views and seeks in already-watched parts are served locally. 0 (default) disables; a useful budget fits at least one program (about 14 GB for 2 hours of HD), on a persistent Cache Directory rather than the system temp dir."
+            },
+            {
+                "id": "speculative_warmup",
+                "type": "boolean",
+                "label": "Speculative Warm-up",
+                "default": False,
+                "help_text": "When a client opens an archive channel's EPG, open a kept-alive connection to its provider in the background so the catch-up request that follows starts faster. At most once per account every 30 seconds."
+            },
+            {
+                "id": "warmup_prefetch_mb",
+                "type": "number",
+                "label": "Warm-up Prefetch (MB)",
+                "default": 0,
+                "help_text": "With Speculative Warm-up, also pull the first MBs of the channel's latest finished programme into the segment cache, only when a provider connection is free. 0 disables."
+            },
+            {
+                "id": "continuous_playback",
+                "type": "boolean",
+                "label": "Continuous Catch-up Playback",
+                "default": False,
+                "help_text": "When a catch-up window ends, keep streaming the following programmes in the same response (the next one is opened and pre-buffered before the end). Responses then have no Content-Length, so clients can't seek by byte range."
+            },
+            {
+                "id": "hls_output",
+                "type": "boolean",
+                "label": "HLS Output",
+                "default": False,
+                "help_text": "Also answer /timeshift/.../<stream_id>.m3u8 with an HLS playlist of short segments cut from the catch-up stream (for Apple clients). Segments are cached, so seeks are near-instant. Needs the segment cache."
+            },
+            {
+                "id": "hls_segment_seconds",
+                "type": "number",
+                "label": "HLS Segment Length (seconds)",
+                "default": 6,
+                "help_text": "Nominal length of HLS segments (minimum 2). Segments are cut at keyframes near these positions."
+            },
+            {
+                "id": "client_stall_timeout",
+                "type": "number",
+                "label": "Client Stall Timeout (seconds)",
+                "default": 0,
+                "help_text": "Also close the provider connection (and free its slot) when a catch-up client has not read for this long. A stall can't be told from a paused player, so keep it well above pause lengths (e.g. 600). Disconnected clients are detected without it under uWSGI. 0 disables."
+            },
+            {
+                "id": "session_buffer_kb",
+                "type": "number",
+                "label": "Session Buffer (KB)",
+                "default": 1024,
+                "help_text": "Largest chunk read from the provider per catch-up stream (minimum 64). Bounds the memory each viewer holds; nothing is read ahead of the client."
+            },
+            {
+                "id": "cache_dir",
+                "type": "string",
+                "label": "Cache Directory",
+                "default": "",
+                "help_text": "Where on-disk caches are stored. Empty uses the system temp directory; use a persistent path such as /data/cache/timeshift to keep caches across restarts."
             }
         ]
 
-        # No custom actions needed
-        self.actions = []
+        self.actions = [
+            {
+                "id": "provider_health",
+                "label": "Provider Health",
+                "description": "Show recent error rate, response time and circuit breaker state per Xtream Codes account"
+            }
+        ]
 
     def run(self, action=None, params=None, context=None):
         """
@@ -99,8 +265,29 @@ class Plugin:
             uninstall_hooks()
             return {"status": "ok", "message": "Timeshift plugin disabled"}
 
+        elif action == "provider_health":
+            return self._provider_health()
+
         return {"status": "error", "message": f"Unknown action: {action}"}
 
+    def _provider_health(self):
+        """Summarize health.stats() for every XC account."""
+        from apps.m3u.models import M3UAccount
+        from .health import stats
+
+        lines = []
+        for account in M3UAccount.objects.filter(account_type='XC').order_by('name'):
+            summary = stats(account.id)
+            if summary is None:
+                return {"status": "error", "message": "Provider health needs Redis (not available)"}
+            p95 = summary["ttfb_p95_ms"]
+            lines.append(
+                f"{account.name}: {summary['state']}, "
+                f"{summary['error_rate']:.0%} errors over {summary['samples']} requests, "
+                f"p95 response {p95 if p95 is not None else '-'} ms"
+            )
+        return {"status": "ok", "message": "\n".join(lines) or "No Xtream Codes accounts"}
+
 
 # Auto-install hooks when this module is imported (on Django startup)
 # This runs once per uWSGI worker when PluginManager discovers this plugin
@@ -0,0 +1,156 @@
+"""
+Dispatcharr Timeshift Plugin - Read-ahead for continuous catch-up playback
+
+Opens the next timeshift window in the background before the current one
+ends, so views._continuous_body can splice it into the same response.
+
+WHY?
+    A catch-up response ended with its window (the programme plus
+    padding). Binge-watching meant the client noticing the end, sending a
+    new timeshift request and waiting for auth, the provider handshake and
+    the provider-side seek: a visible hiccup at every boundary.
+
+HOW:
+    - When the client is within TRIGGER_BYTES of the end of the current
+      window, a ReadAhead opens the next one on a worker thread (EPG
+      lookup, failover, provider handshake) and pre-reads up to
+      BUFFER_BYTES of it, then pauses.
+    - When the current window ends, the request thread takes over the
+      paused body: it yields the buffered chunks and keeps iterating the
+      same generator, with no new connection.
+    - Cancelled (client gone, window cut short) the worker stops reading
+      and closes the body, releasing its provider slot.
+
+    At most BUFFER_BYTES are held per session, and only between the
+    trigger point and the splice.
+
+GitHub: https://github.com/cedric-marcoux/dispatcharr_timeshift
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from . import watchdog
+
+logger = logging.getLogger("plugins.dispatcharr_timeshift.readahead")
+
+# Start opening the next window this close to the end of the current one
+TRIGGER_BYTES = 16 * 1024 * 1024
+
+# Pre-read at most this much of the next window
+BUFFER_BYTES = 8 * 1024 * 1024
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def is_enabled():
+    from .cache import get_plugin_setting
+    return get_plugin_setting("continuous_playback", False) in (True, "true", "1", 1)
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="timeshift-readahead")
+        return _executor
+
+
+class ReadAhead:
+    """
+    The next body, opened and pre-read in the background.
+
+    Args:
+        open_body: Callable returning (info, body iterator), or (None, None)
+            if there is nothing to continue with
+    """
+
+    def __init__(self, open_body):
+        self._cancelled = threading.Event()
+        self._taken = False
+        self._future = _get_executor().submit(self._fill, open_body)
+
+    def _fill(self, open_body):
+        try:
+            info, body = open_body()
+        except Exception as e:
+            logger.warning(f"[Timeshift] Could not open the next window: {e}")
+            return None, None, []
+        finally:
+            # Worker threads touch the ORM (EPG, settings): don't keep a
+            # connection open per thread
+            from django.db import connection
+            connection.close()
+        if body is None:
+            return None, None, []
+
+        # At least one chunk even if already cancelled: closing a generator
+        # that never started skips its cleanup (the upstream response and
+        # provider slot would leak)
+        body = iter(body)
+        chunks, buffered = [], 0
+        # Pausing at BUFFER_BYTES is not a stalled client (watchdog.py)
+        with watchdog.unwatched():
+            while True:
+                try:
+                    chunk = next(body)
+                except StopIteration:
+                    break
+                except Exception as e:
+                    logger.warning(f"[Timeshift] Read-ahead failed: {e}")
+                    self._close(body)
+                    return None, None, []
+                chunks.append(chunk)
+                buffered += len(chunk)
+                if buffered >= BUFFER_BYTES or self._cancelled.is_set():
+                    break
+
+        if self._cancelled.is_set():
+            self._close(body)
+            return None, None, []
+        return info, body, chunks
+
+    @staticmethod
+    def _close(body):
+        close = getattr(body, "close", None)
+        if close is not None:
+            close()
+
+    def wait(self):
+        """
+        Wait for the next body.
+
+        Returns:
+            Tuple (info, iterator over the whole body), or (None, None)
+        """
+        self._taken = True
+        info, body, chunks = self._future.result()
+        if body is None:
+            return None, None
+
+        def chunks_then_body():
+            try:
+                yield from chunks
+                yield from body
+            finally:
+                self._close(body)
+
+        return info, chunks_then_body()
+
+    def cancel(self):
+        """Stop reading and close the next body (now or once opened)."""
+        if self._taken:
+            return  # The caller owns the body now
+        self._cancelled.set()
+
+        def close(future):
+            try:
+                _info, body, _chunks = future.result()
+            except Exception:
+                return
+            if body is not None:
+                self._close(body)
+
+        self._future.add_done_callback(close)
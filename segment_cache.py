@@ -0,0 +1,583 @@
+"""
+Dispatcharr Timeshift Plugin - Catch-up segment cache
+
+Shared on-disk cache of the bytes relayed by the timeshift proxy, keyed by
+(M3U account, provider stream_id, start, duration).
+
+WHY?
+    Popular catch-up programs (last night's match, the evening news) are
+    watched by many users, and every viewer - and every seek - went to the
+    provider through _proxy_stream. A past program's timeshift.php body
+    never changes, so what one viewer pulled can serve the next.
+
+HOW:
+    - Each program is a sparse data file (<key>.ts) plus a JSON meta file
+      listing the byte extents already stored, the total size and the
+      Content-Type.
+    - While a response is relayed, its bytes are written at their offset in
+      the data file (os.pwrite) and the extent is merged into the meta every
+      few MB and when the stream ends. Workers writing the same program at
+      once write the same bytes, so this needs no coordination beyond an
+      flock around the meta read-modify-write.
+    - A request whose start offset is already stored is answered from the
+      file; if the stored extent ends before the requested range, the rest
+      is fetched from the provider with a Range request and stored too
+      (views._serve_from_segment_cache).
+    - The data file's mtime is the LRU clock (reads touch it). When the
+      cache exceeds its size budget the least recently used programs are
+      deleted; the sweep runs at most once a minute while programs are
+      being written, in one worker at a time. Programs being fetched or
+      recorded right now are skipped, and a writer whose data file was
+      evicted anyway (no claim) stops recording instead of describing a
+      file that no longer holds its bytes.
+
+    Only programs whose requested window has fully aired are cached: a
+    window reaching into the future is still growing on the provider.
+
+UPSTREAM FAN-OUT:
+    XC accounts usually allow only 1-2 connections, so several viewers
+    starting the same program at about the same time (in any worker) must
+    not each open one. The first request claims the program (an flock on
+    <key>.live, taken BEFORE the provider is contacted) and becomes its
+    owner; while relaying, it publishes its progress (start, position,
+    total) in that file. A request that finds a live owner which has
+    reached - or will soon reach - its start offset tails the data file
+    behind the owner instead of going upstream. If the owner stalls or
+    stops short, the follower fetches the rest itself.
+
+    Like caching, this only covers fully aired windows: a window still
+    airing (start over on the current programme) has no known size to
+    follow, so each of its viewers opens its own provider connection.
+
+GitHub: https://github.com/cedric-marcoux/dispatcharr_timeshift
+"""
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import struct
+import time
+from collections import namedtuple
+
+from .ts_index import TimeIndex, TsIndexer
+
+logger = logging.getLogger("plugins.dispatcharr_timeshift.segment_cache")
+
+# Opt-in: a useful budget holds at least one long HD program (2h at
+# ~2 MB/s is ~14 GB), too much to put in the temp dir by default
+DEFAULT_SIZE_MB = 0
+
+# Merge written extents into the meta file this often while streaming
+_FLUSH_BYTES = 8 * 1024 * 1024
+_FLUSH_INTERVAL = 5.0
+
+_SWEEP_INTERVAL = 60.0
+_READ_SIZE = 256 * 1024
+
+# Live owner progress in <key>.live: start, position, total (-1 = unknown)
+_LIVE_FORMAT = struct.Struct("<qqq")
+
+LiveState = namedtuple("LiveState", ["start", "position", "total"])
+
+# One stored program in a stream's catalog (start as sent to the provider)
+CatalogEntry = namedtuple("CatalogEntry", ["start", "start_epoch", "duration", "key"])
+
+_last_sweep = 0.0
+
+
+def _budget_bytes():
+    from .cache import get_plugin_setting
+    try:
+        return int(get_plugin_setting("segment_cache_size_mb", DEFAULT_SIZE_MB)) * 1024 * 1024
+    except (TypeError, ValueError):
+        return DEFAULT_SIZE_MB * 1024 * 1024
+
+
+def is_enabled():
+    """Return True if the segment cache has a non-zero size budget."""
+    return _budget_bytes() > 0
+
+
+def _directory():
+    from .cache import get_cache_dir
+    return get_cache_dir("segments")
+
+
+def program_key(m3u_account_id, provider_stream_id, start, duration):
+    """Return the cache key for one timeshift window."""
+    raw = f"{m3u_account_id}:{provider_stream_id}:{start}:{duration}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def merge_extents(extents):
+    """Sort and merge overlapping or touching [start, end) extents."""
+    merged = []
+    for start, end in sorted(extents):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return merged
+
+
+class CachedProgram:
+    """
+    One cached timeshift window: a sparse data file and its extents.
+
+    Attributes:
+        total: Full body size in bytes, or None while unknown
+        content_type: Content-Type reported by the provider
+        extents: Sorted, merged list of stored [start, end) byte ranges
+    """
+
+    def __init__(self, key):
+        directory = _directory()
+        self.key = key
+        self.data_path = os.path.join(directory, f"{key}.ts")
+        self.meta_path = os.path.join(directory, f"{key}.json")
+        self._lock_path = os.path.join(directory, f"{key}.lock")
+        self._live_path = os.path.join(directory, f"{key}.live")
+        self._index_path = os.path.join(directory, f"{key}.idx")
+        self.total = None
+        self.content_type = "video/mp2t"
+        self.extents = []
+        self.reload()
+
+    def reload(self):
+        """Re-read the meta file (written by any worker)."""
+        try:
+            with open(self.meta_path, "r") as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            # Evicted: nothing of ours is stored any more
+            self.total = None
+            self.extents = []
+            return
+        except (OSError, ValueError):
+            return
+        self.total = meta.get("total")
+        self.content_type = meta.get("content_type") or self.content_type
+        self.extents = [list(extent) for extent in meta.get("extents", [])]
+
+    def covered_until(self, offset):
+        """
+        Return the end of the stored extent containing offset.
+
+        Returns:
+            int end offset (exclusive), or None if offset is not stored
+        """
+        for start, end in self.extents:
+            if start <= offset < end:
+                return end
+            if start > offset:
+                break
+        return None
+
+    def read(self, start, end):
+        """
+        Yield stored bytes in [start, end).
+
+        Raises:
+            OSError: The data file was evicted (only before the first chunk;
+                an open file stays readable after unlink)
+        """
+        fd = os.open(self.data_path, os.O_RDONLY)
+        try:
+            os.utime(self.data_path)
+        except OSError:
+            pass
+
+        def chunks():
+            position = start
+            try:
+                while position < end:
+                    data = os.pread(fd, min(_READ_SIZE, end - position), position)
+                    if not data:
+                        break
+                    position += len(data)
+                    yield data
+            finally:
+                os.close(fd)
+
+        return chunks()
+
+    def writer(self, offset, total=None, content_type=None, claim=None):
+        """Return a SegmentWriter storing a response body that starts at offset."""
+        return SegmentWriter(self, offset, total, content_type, claim)
+
+    def claim(self):
+        """
+        Become the live owner of this program (non-blocking).
+
+        Returns:
+            LiveClaim, or None if another request already owns it
+        """
+        fd = os.open(self._live_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+        # Nothing published yet: followers wait for the first update
+        os.ftruncate(fd, 0)
+        return LiveClaim(fd)
+
+    def live_state(self):
+        """
+        Return the live owner's progress.
+
+        Returns:
+            LiveState; start is -1 while the owner has not published yet.
+            None if nobody owns the program.
+        """
+        try:
+            fd = os.open(self._live_path, os.O_RDONLY)
+        except OSError:
+            return None
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except OSError:
+                data = os.pread(fd, _LIVE_FORMAT.size, 0)
+                if len(data) < _LIVE_FORMAT.size:
+                    return LiveState(-1, -1, None)
+                start, position, total = _LIVE_FORMAT.unpack(data)
+                return LiveState(start, position, total if total >= 0 else None)
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            return None
+        finally:
+            os.close(fd)
+
+    def record(self, extent, total=None, content_type=None, data_inode=None):
+        """
+        Merge a written extent (and what we learned) into the meta file.
+
+        Args:
+            data_inode: Inode of the data file the extent was written to;
+                if the file was evicted or replaced since, nothing is recorded
+
+        Returns:
+            bool, False if the data file is no longer data_inode
+        """
+        with open(self._lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if data_inode is not None:
+                    try:
+                        if os.stat(self.data_path).st_ino != data_inode:
+                            return False
+                    except FileNotFoundError:
+                        return False
+                self.reload()
+                if extent is not None and extent[1] > extent[0]:
+                    self.extents = merge_extents(self.extents + [list(extent)])
+                if total is not None:
+                    self.total = total
+                if content_type:
+                    self.content_type = content_type
+                meta = {"total": self.total, "content_type": self.content_type, "extents": self.extents}
+                tmp_path = f"{self.meta_path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(meta, f)
+                os.replace(tmp_path, self.meta_path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return True
+
+    def time_index(self):
+        """Return the program's TimeIndex (empty if nothing was indexed)."""
+        try:
+            with open(self._index_path, "rb") as f:
+                return TimeIndex.from_bytes(f.read())
+        except (OSError, ValueError, struct.error):
+            return TimeIndex()
+
+    def record_index(self, samples):
+        """Merge (offset, pcr) samples into <key>.idx."""
+        with open(self._lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                index = self.time_index()
+                index.merge(samples)
+                tmp_path = f"{self._index_path}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(index.to_bytes())
+                os.replace(tmp_path, self._index_path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class LiveClaim:
+    """Ownership of a program being fetched (held flock on <key>.live)."""
+
+    def __init__(self, fd):
+        self._fd = fd
+
+    def publish(self, start, position, total):
+        if self._fd is not None:
+            os.pwrite(self._fd, _LIVE_FORMAT.pack(start, position, -1 if total is None else total), 0)
+
+    def release(self):
+        if self._fd is None:
+            return
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+
+class SegmentWriter:
+    """Writes a relayed body into a CachedProgram as it streams."""
+
+    def __init__(self, program, offset, total=None, content_type=None, claim=None):
+        self.program = program
+        self.start = offset
+        self.position = offset
+        self._total = total
+        self._content_type = content_type
+        self._claim = claim
+        self._flushed_at = time.monotonic()
+        self._unflushed = 0
+        self._indexer = TsIndexer()
+        self._fd = os.open(program.data_path, os.O_WRONLY | os.O_CREAT, 0o644)
+        self._inode = os.fstat(self._fd).st_ino
+        # Size and type first, so followers can answer before any extent lands
+        self._flush()
+        if claim is not None:
+            claim.publish(self.start, self.position, total)
+
+    def write(self, data):
+        if self._fd is None:
+            return
+        try:
+            os.pwrite(self._fd, data, self.position)
+        except OSError as e:
+            # Disk full or evicted under us: stop caching, keep streaming
+            logger.warning(f"[Timeshift] Segment cache write failed: {e}")
+            self.close()
+            return
+        self._indexer.feed(self.position, data)
+        self.position += len(data)
+        self._unflushed += len(data)
+        if self._claim is not None:
+            self._claim.publish(self.start, self.position, self._total)
+        if self._unflushed >= _FLUSH_BYTES or time.monotonic() - self._flushed_at > _FLUSH_INTERVAL:
+            self._flush()
+
+    def _flush(self):
+        try:
+            if not self.program.record((self.start, self.position), self._total, self._content_type, self._inode):
+                logger.info("[Timeshift] Segment cache: program evicted while being written, no longer caching it")
+                self._stop()
+                return
+        except OSError as e:
+            logger.debug(f"[Timeshift] Could not update segment cache meta: {e}")
+        if self._indexer.samples:
+            try:
+                self.program.record_index(self._indexer.samples)
+            except OSError as e:
+                logger.debug(f"[Timeshift] Could not update segment cache index: {e}")
+            self._indexer.samples = []
+        self._unflushed = 0
+        self._flushed_at = time.monotonic()
+        # Long programs: keep the budget while they are still being written
+        sweep()
+
+    def _stop(self):
+        """Stop caching without recording anything more."""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        if self._claim is not None:
+            self._claim.release()
+            self._claim = None
+
+    def close(self, eof=False):
+        """
+        Flush and close.
+
+        Args:
+            eof: The upstream body ended normally; if its size was unknown,
+                the end offset is now known to be the total
+        """
+        if self._fd is None:
+            return
+        if eof and self._total is None:
+            self._total = self.position
+        self._flush()
+        # Extents are in the meta now: followers can stop tailing
+        self._stop()
+
+
+def parse_content_range(value):
+    """
+    Parse "bytes a-b/total".
+
+    Returns:
+        Tuple (start, end_inclusive, total_or_None), or None if unparsable
+    """
+    try:
+        unit, _, spec = value.strip().partition(" ")
+        if unit != "bytes":
+            return None
+        span, _, total = spec.partition("/")
+        first, _, last = span.partition("-")
+        return int(first), int(last), (int(total) if total.isdigit() else None)
+    except (AttributeError, ValueError):
+        return None
+
+
+# =============================================================================
+# Catalog of stored programs per stream (time seeks)
+# =============================================================================
+
+def _catalog_path(m3u_account_id, provider_stream_id):
+    name = hashlib.sha1(f"{m3u_account_id}:{provider_stream_id}".encode("utf-8")).hexdigest()
+    return os.path.join(_directory(), f"catalog-{name}.json")
+
+
+def _load_catalog(path):
+    try:
+        with open(path, "r") as f:
+            return [CatalogEntry(*entry) for entry in json.load(f)]
+    except (OSError, ValueError, TypeError):
+        return []
+
+
+def register(m3u_account_id, provider_stream_id, start, start_epoch, duration, key):
+    """List a stored program in its stream's catalog (dropping evicted ones)."""
+    path = _catalog_path(m3u_account_id, provider_stream_id)
+    directory = os.path.dirname(path)
+    with open(os.path.join(directory, "catalog.lock"), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            entries = [
+                entry for entry in _load_catalog(path)
+                if entry.key != key and os.path.exists(os.path.join(directory, f"{entry.key}.ts"))
+            ]
+            entries.append(CatalogEntry(start, start_epoch, int(duration), key))
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump([list(entry) for entry in entries], f)
+            os.replace(tmp_path, path)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def find_covering(m3u_account_id, provider_stream_id, epoch):
+    """
+    Return the stored programs of a stream whose window contains epoch
+    (strictly after their start), latest start first.
+    """
+    entries = [
+        entry for entry in _load_catalog(_catalog_path(m3u_account_id, provider_stream_id))
+        if entry.start_epoch < epoch < entry.start_epoch + entry.duration * 60
+    ]
+    return sorted(entries, key=lambda entry: entry.start_epoch, reverse=True)
+
+
+def sweep(force=False):
+    """Delete least recently used programs until the cache fits its budget."""
+    global _last_sweep
+
+    now = time.monotonic()
+    if not force and now - _last_sweep < _SWEEP_INTERVAL:
+        return
+    _last_sweep = now
+
+    directory = _directory()
+    with open(os.path.join(directory, "sweep.lock"), "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return  # Another worker is sweeping
+        try:
+            _evict(directory, _budget_bytes())
+            _prune_catalogs(directory)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _evict(directory, budget):
+    entries = []
+    used = 0
+    for name in os.listdir(directory):
+        if not name.endswith(".ts"):
+            continue
+        try:
+            st = os.stat(os.path.join(directory, name))
+        except OSError:
+            continue
+        # st_blocks: sparse files only count what was actually written
+        size = st.st_blocks * 512
+        used += size
+        entries.append((st.st_mtime, size, name[:-3]))
+
+    if used <= budget:
+        return
+
+    entries.sort()
+    removed = 0
+    for _mtime, size, key in entries:
+        if used <= budget:
+            break
+        if not _evict_program(directory, key):
+            continue
+        used -= size
+        removed += 1
+    logger.info(f"[Timeshift] Segment cache: evicted {removed} programs ({used // (1024 * 1024)} MB kept)")
+
+
+def _prune_catalogs(directory):
+    """Drop evicted programs from the stream catalogs, and empty catalogs."""
+    with open(os.path.join(directory, "catalog.lock"), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            for name in os.listdir(directory):
+                if not (name.startswith("catalog-") and name.endswith(".json")):
+                    continue
+                path = os.path.join(directory, name)
+                entries = _load_catalog(path)
+                kept = [entry for entry in entries if os.path.exists(os.path.join(directory, f"{entry.key}.ts"))]
+                try:
+                    if not kept:
+                        os.unlink(path)
+                    elif len(kept) < len(entries):
+                        tmp_path = f"{path}.{os.getpid()}.tmp"
+                        with open(tmp_path, "w") as f:
+                            json.dump([list(entry) for entry in kept], f)
+                        os.replace(tmp_path, path)
+                except OSError as e:
+                    logger.debug(f"[Timeshift] Could not prune segment cache catalog {name}: {e}")
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _evict_program(directory, key):
+    """Delete one program's files unless it is being fetched or recorded."""
+    base = os.path.join(directory, key)
+    held = []
+    try:
+        # Holding both locks keeps claim() and record() out meanwhile
+        for suffix in (".live", ".lock"):
+            try:
+                fd = os.open(base + suffix, os.O_RDONLY)
+            except FileNotFoundError:
+                continue
+            held.append(fd)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return False
+        # Meta first: readers check it before opening the data file
+        for suffix in (".json", ".ts", ".idx", ".lock", ".live"):
+            try:
+                os.unlink(base + suffix)
+            except OSError:
+                pass
+        return True
+    finally:
+        for fd in held:
+            os.close(fd)
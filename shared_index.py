@@ -0,0 +1,395 @@
+"""
+Dispatcharr Timeshift Plugin - Shared memory-mapped index
+
+One read-only index file, memory-mapped by every uWSGI worker, holding:
+- the provider stream_id -> (channel, stream, account) map (see cache.py)
+- the programme timelines of archive channels (see epg.py)
+
+WHY?
+    Each uWSGI worker has its own memory (see plugin.py), so per-process
+    caches are built N times and held N times. With 16 workers and 40k
+    streams that is a real RSS cost. A memory-mapped file is built once and
+    shared through the page cache; workers read it zero-copy through
+    memoryviews.
+
+BUILD AND SWAP:
+    - Any worker that finds the file missing or stale (generation changed,
+      or older than the max age) tries to take an flock on index.lock. The
+      winner rebuilds in a background thread, writes a temp file and
+      os.replace()s it over index.bin. Losers keep going.
+    - Readers stat the file at most every CHECK_INTERVAL seconds and map the
+      new inode when it changes; mappings of the old file stay valid until
+      the last view is released.
+    - While a rebuild runs (some process holds index.lock) the previous
+      file is still used, for at most STALE_GRACE seconds. Otherwise, or
+      if there is no file yet, callers fall back to their per-process
+      caches.
+
+FILE LAYOUT (little-endian, 8-byte aligned):
+    header   magic, version, flags, stream/epg generations, built_at, counts
+    streams  keys int64[n], values int64[n*3] (channel, stream, account)
+    reverse  stream pks int64[n_rev], provider keys int64[n_rev]
+    epg      epg_data ids int64[t], offsets int64[t+1]
+    programs starts float64[p], ends float64[p], ids int64[p]
+
+GitHub: https://github.com/cedric-marcoux/dispatcharr_timeshift
+"""
+
+import bisect
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+
+logger = logging.getLogger("plugins.dispatcharr_timeshift.shared_index")
+
+MAGIC = b"TSIX"
+VERSION = 1
+
+# magic, version, flags, stream_gen, epg_gen, built_at, n_streams, n_reverse,
+# n_timelines, n_programs
+_HEADER = struct.Struct("<4sII q q d q q q q")
+# Padded, leaving room for future header fields
+_HEADER_SIZE = 128
+
+# Set when every provider stream_id was an integer (the map is complete)
+FLAG_ALL_STREAMS = 1
+
+CHECK_INTERVAL = 2.0
+DEFAULT_MAX_AGE = 3600
+
+# A stale index is used while its replacement builds, but only briefly:
+# its mappings may already be wrong (a stream moved, a programme changed)
+STALE_GRACE = 5.0
+
+# Minimum delay between build attempts after a failure
+RETRY_DELAY = 60.0
+
+
+def _generation_int(token):
+    return token if isinstance(token, int) else 0
+
+
+class SharedIndex:
+    """Read-only view over one mapped index file."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            self.inode = (st.st_dev, st.st_ino)
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, self.flags, self.stream_generation, self.epg_generation,
+         self.built_at, n_streams, n_reverse, n_timelines, n_programs) = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Unsupported index file")
+
+        view = memoryview(self._mm)
+        offset = _HEADER_SIZE
+
+        def section(fmt, count):
+            nonlocal offset
+            size = count * 8
+            part = view[offset:offset + size].cast(fmt)
+            offset += size
+            return part
+
+        self.stream_keys = section("q", n_streams)
+        self.stream_values = section("q", n_streams * 3)
+        self.reverse_pks = section("q", n_reverse)
+        self.reverse_keys = section("q", n_reverse)
+        self.timeline_keys = section("q", n_timelines)
+        self.timeline_offsets = section("q", n_timelines + 1)
+        self.starts = section("d", n_programs)
+        self.ends = section("d", n_programs)
+        self.ids = section("q", n_programs)
+
+    @property
+    def covers_all_streams(self):
+        return bool(self.flags & FLAG_ALL_STREAMS)
+
+    def stream_ref(self, provider_stream_id):
+        """Return the StreamRef for a provider stream_id, or None."""
+        from .cache import StreamRef
+        try:
+            key = int(provider_stream_id)
+        except (TypeError, ValueError):
+            return None
+        i = bisect.bisect_left(self.stream_keys, key)
+        if i < len(self.stream_keys) and self.stream_keys[i] == key:
+            base = i * 3
+            return StreamRef(self.stream_values[base], self.stream_values[base + 1], self.stream_values[base + 2])
+        return None
+
+    def provider_id_for_stream(self, stream_pk):
+        """Return the provider stream_id (str) a stream is indexed under, or None."""
+        i = bisect.bisect_left(self.reverse_pks, stream_pk)
+        if i < len(self.reverse_pks) and self.reverse_pks[i] == stream_pk:
+            return str(self.reverse_keys[i])
+        return None
+
+    def timeline(self, epg_data_id):
+        """
+        Return a zero-copy ProgramTimeline for an EPGData, or None if it is
+        not in the index (not an archive channel).
+        """
+        from .epg import ProgramTimeline
+        i = bisect.bisect_left(self.timeline_keys, epg_data_id)
+        if i >= len(self.timeline_keys) or self.timeline_keys[i] != epg_data_id:
+            return None
+        lo, hi = self.timeline_offsets[i], self.timeline_offsets[i + 1]
+        return ProgramTimeline.from_buffers(self.starts[lo:hi], self.ends[lo:hi], self.ids[lo:hi])
+
+
+# =============================================================================
+# Building
+# =============================================================================
+
+def _paths():
+    from .cache import get_cache_dir
+    directory = get_cache_dir("index")
+    return os.path.join(directory, "index.bin"), os.path.join(directory, "index.lock")
+
+
+def _archive_epg_data_ids():
+    """EPGData ids of channels whose first stream has tv_archive enabled."""
+    from apps.channels.models import ChannelStream
+
+    rows = ChannelStream.objects.filter(
+        channel__epg_data__isnull=False,
+    ).order_by('channel_id', 'order').values_list(
+        'channel_id', 'channel__epg_data_id', 'stream__custom_properties__tv_archive'
+    )
+    seen = set()
+    epg_ids = set()
+    for channel_id, epg_data_id, tv_archive in rows.iterator(chunk_size=5000):
+        if channel_id in seen:
+            continue
+        seen.add(channel_id)
+        if tv_archive in (1, '1'):
+            epg_ids.add(epg_data_id)
+    return sorted(epg_ids)
+
+
+def build_index(path):
+    """
+    Build the index file at path (via a temp file + os.replace).
+
+    Generations are read BEFORE loading data, so a change that lands during
+    the build leaves the file marked stale and triggers another build.
+    """
+    from datetime import timedelta
+    from django.utils import timezone as django_timezone
+    from apps.epg.models import ProgramData
+    from .cache import get_generation, _build_stream_index, EPG_GENERATION
+    from .epg import TIMELINE_DAYS_BACK
+
+    stream_generation = _generation_int(get_generation("stream_index"))
+    epg_generation = _generation_int(get_generation(EPG_GENERATION))
+
+    by_provider_id, provider_id_by_stream = _build_stream_index()
+    flags = FLAG_ALL_STREAMS
+    streams = []
+    for provider_id, ref in by_provider_id.items():
+        # Only canonical integers round-trip through an int64 key
+        if provider_id.isdigit() and str(int(provider_id)) == provider_id:
+            streams.append((int(provider_id), ref))
+        else:
+            flags &= ~FLAG_ALL_STREAMS
+    streams.sort(key=lambda item: item[0])
+
+    reverse = []
+    for stream_pk, provider_id in provider_id_by_stream.items():
+        if provider_id.isdigit() and str(int(provider_id)) == provider_id:
+            reverse.append((stream_pk, int(provider_id)))
+    reverse.sort()
+
+    epg_ids = _archive_epg_data_ids()
+    window_start = django_timezone.now() - timedelta(days=TIMELINE_DAYS_BACK)
+    starts, ends, ids = array('d'), array('d'), array('q')
+    offsets = array('q', [0])
+    timeline_keys = array('q')
+    # Chunked so the IN clause stays reasonable
+    for i in range(0, len(epg_ids), 500):
+        chunk = epg_ids[i:i + 500]
+        rows = ProgramData.objects.filter(
+            epg_id__in=chunk, start_time__gte=window_start
+        ).order_by('epg_id', 'start_time').values_list('epg_id', 'id', 'start_time', 'end_time')
+        current = None
+        for epg_id, program_id, start, end in rows.iterator(chunk_size=10000):
+            if epg_id != current:
+                if current is not None:
+                    offsets.append(len(starts))
+                timeline_keys.append(epg_id)
+                current = epg_id
+            starts.append(start.timestamp())
+            ends.append(end.timestamp())
+            ids.append(program_id)
+        if current is not None:
+            offsets.append(len(starts))
+
+    header = _HEADER.pack(
+        MAGIC, VERSION, flags, stream_generation, epg_generation, time.time(),
+        len(streams), len(reverse), len(timeline_keys), len(starts),
+    )
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(header.ljust(_HEADER_SIZE, b"\0"))
+            f.write(array('q', (key for key, _ref in streams)).tobytes())
+            f.write(array('q', (value for _key, ref in streams for value in ref)).tobytes())
+            f.write(array('q', (pk for pk, _key in reverse)).tobytes())
+            f.write(array('q', (key for _pk, key in reverse)).tobytes())
+            f.write(timeline_keys.tobytes())
+            f.write(offsets.tobytes())
+            f.write(starts.tobytes())
+            f.write(ends.tobytes())
+            f.write(ids.tobytes())
+        os.replace(tmp_path, path)
+    except Exception:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    logger.info(
+        f"[Timeshift] Built shared index: {len(streams)} streams, "
+        f"{len(timeline_keys)} timelines, {len(starts)} programmes"
+    )
+
+
+def _build_running(lock_path):
+    """Return True if some process holds the build lock."""
+    try:
+        with open(lock_path, "a") as lock_file:
+            # The builder holds it exclusively
+            fcntl.flock(lock_file, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+    except BlockingIOError:
+        return True
+    except OSError:
+        return False
+    return False
+
+
+def _rebuild_in_background():
+    """Rebuild the index in a thread if no other process is building it."""
+    path, lock_path = _paths()
+    lock_file = open(lock_path, "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+
+    def run():
+        try:
+            build_index(path)
+        except Exception as e:
+            _state["failed_at"] = time.monotonic()
+            logger.error(f"[Timeshift] Shared index build failed: {e}", exc_info=True)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+            _state["building"] = False
+            from django.db import connection
+            connection.close()
+
+    _state["building"] = True
+    threading.Thread(target=run, name="timeshift-index-build", daemon=True).start()
+    return True
+
+
+# =============================================================================
+# Reader state (per worker)
+# =============================================================================
+
+_state = {"index": None, "checked_at": 0.0, "building": False, "stale_since": None, "failed_at": None}
+_state_lock = threading.Lock()
+
+
+def _enabled():
+    from .cache import get_plugin_setting
+    return get_plugin_setting("shared_index", True) not in (False, "false", "0", 0)
+
+
+def _max_age():
+    from .cache import get_plugin_setting
+    try:
+        return int(get_plugin_setting("shared_index_max_age", DEFAULT_MAX_AGE))
+    except (TypeError, ValueError):
+        return DEFAULT_MAX_AGE
+
+
+def get_shared_index():
+    """
+    Return the current SharedIndex, or None if unavailable.
+
+    Cheap on the hot path: the file is only stat()ed every CHECK_INTERVAL
+    seconds. A stale index is still returned while its replacement builds,
+    for at most STALE_GRACE seconds.
+    """
+    now = time.monotonic()
+    if now - _state["checked_at"] < CHECK_INTERVAL:
+        return _state["index"]
+
+    with _state_lock:
+        if now - _state["checked_at"] < CHECK_INTERVAL:
+            return _state["index"]
+        _state["checked_at"] = now
+
+        if not _enabled():
+            _state["index"] = None
+            return None
+
+        try:
+            _refresh()
+        except Exception as e:
+            logger.warning(f"[Timeshift] Shared index unavailable: {e}")
+            _state["index"] = None
+        return _state["index"]
+
+
+def _refresh():
+    """Map a new file if it changed; start a rebuild if it is stale."""
+    from .cache import current_generation, EPG_GENERATION
+
+    path, lock_path = _paths()
+    index = _state["index"]
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        st = None
+
+    if st is not None and (index is None or index.inode != (st.st_dev, st.st_ino)):
+        index = SharedIndex(path)
+        _state["index"] = index
+        logger.debug("[Timeshift] Mapped shared index")
+
+    stale = (
+        index is None
+        or index.stream_generation != _generation_int(current_generation("stream_index"))
+        or index.epg_generation != _generation_int(current_generation(EPG_GENERATION))
+        or time.time() - index.built_at > _max_age()
+    )
+    if not stale:
+        _state["stale_since"] = None
+        return
+
+    now = time.monotonic()
+    if _state["stale_since"] is None:
+        _state["stale_since"] = now
+    failed_at = _state["failed_at"]
+    if not _state["building"] and (failed_at is None or now - failed_at > RETRY_DELAY):
+        _rebuild_in_background()
+
+    building = _state["building"] or _build_running(lock_path)
+    if not building or now - _state["stale_since"] > STALE_GRACE:
+        # Fall back to the per-process caches until a build succeeds
+        _state["index"] = None
@@ -0,0 +1,21 @@
+"""
+Make the plugin importable as the dispatcharr_timeshift package.
+
+Dispatcharr loads the plugin directory as a package, so its modules use
+relative imports. Tests cover the modules that work without Django.
+"""
+
+import importlib.util
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = "dispatcharr_timeshift"
+
+if PACKAGE not in sys.modules:
+    spec = importlib.util.spec_from_file_location(
+        PACKAGE, os.path.join(ROOT, "__init__.py"), submodule_search_locations=[ROOT]
+    )
+    package = importlib.util.module_from_spec(spec)
+    sys.modules[PACKAGE] = package
+    spec.loader.exec_module(package)
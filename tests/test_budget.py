@@ -0,0 +1,207 @@
+"""Tests for the provider connection budget (budget.py) against a fake Redis."""
+
+from types import SimpleNamespace
+
+import pytest
+
+from dispatcharr_timeshift import budget
+
+
+class FakeClock:
+    """Stands in for the time module; sleep() advances the clock."""
+
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FakeRedis:
+    """The subset of redis-py that budget.py uses."""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.values = {}   # key -> (value, expires or None)
+        self.zsets = {}
+
+    def _alive(self, key):
+        entry = self.values.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= self.clock.now:
+            del self.values[key]
+            return None
+        return entry
+
+    def set(self, key, value, ex=None):
+        self.values[key] = (str(value), None if ex is None else self.clock.now + ex)
+
+    def mget(self, keys):
+        return [entry[0] if entry else None for entry in map(self._alive, keys)]
+
+    def exists(self, key):
+        return int(self._alive(key) is not None)
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+    def zadd(self, key, mapping):
+        self.zsets.setdefault(key, {}).update(mapping)
+
+    def zrem(self, key, *members):
+        for member in members:
+            self.zsets.get(key, {}).pop(member, None)
+
+    def zremrangebyscore(self, key, low, high):
+        zset = self.zsets.get(key, {})
+        for member in [m for m, score in zset.items() if score <= high]:
+            del zset[member]
+
+    def zcard(self, key):
+        return len(self.zsets.get(key, {}))
+
+    def zrange(self, key, start, end):
+        members = sorted(self.zsets.get(key, {}).items(), key=lambda item: item[1])
+        return [member.encode() for member, _score in members]
+
+
+ACCOUNT = SimpleNamespace(id=7)
+PROFILES = [70, 71]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(budget, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def redis(monkeypatch, clock):
+    redis = FakeRedis(clock)
+    monkeypatch.setattr(budget, "get_redis", lambda: redis)
+    monkeypatch.setattr(budget, "_setting", lambda key, default: default)
+    return redis
+
+
+@pytest.fixture
+def limit(monkeypatch):
+    """Set the account's capacity (the real one is read from the ORM)."""
+    def set_limit(value):
+        monkeypatch.setattr(budget, "_capacity", lambda account: (value, PROFILES))
+    set_limit(2)
+    return set_limit
+
+
+def leases(redis):
+    return redis.zsets.get(budget._SLOTS_KEY.format(ACCOUNT.id), {})
+
+
+def test_admits_up_to_the_limit(redis, limit):
+    first = budget.acquire(ACCOUNT, timeout=0)
+    second = budget.acquire(ACCOUNT, timeout=0)
+    assert first is not None and second is not None
+    assert len(leases(redis)) == 2
+    assert budget.acquire(ACCOUNT, timeout=0) is None
+
+
+def test_release_frees_the_slot(redis, limit):
+    slots = [budget.acquire(ACCOUNT, timeout=0) for _ in range(2)]
+    slots[0].release()
+    slots[0].release()  # Idempotent
+    assert len(leases(redis)) == 1
+    assert budget.acquire(ACCOUNT, timeout=0) is not None
+
+
+def test_live_connections_count_against_the_limit(redis, limit):
+    redis.set(budget._LIVE_KEY.format(PROFILES[0]), 1)
+    assert budget.acquire(ACCOUNT, timeout=0) is not None
+    assert budget.acquire(ACCOUNT, timeout=0) is None
+
+
+def test_unreleased_lease_expires(redis, limit, clock):
+    limit(1)
+    assert budget.acquire(ACCOUNT, timeout=0) is not None
+    assert budget.acquire(ACCOUNT, timeout=0) is None
+    clock.sleep(budget.LEASE_TTL + 1)
+    assert budget.acquire(ACCOUNT, timeout=0) is not None
+
+
+def test_refresh_keeps_the_lease(redis, limit, clock):
+    limit(1)
+    slot = budget.acquire(ACCOUNT, timeout=0)
+    clock.sleep(budget.LEASE_TTL - 1)
+    slot.refresh()
+    clock.sleep(2)
+    assert budget.acquire(ACCOUNT, timeout=0) is None
+
+
+def test_waiter_gets_a_slot_freed_while_queueing(redis, limit, clock, monkeypatch):
+    limit(1)
+    held = budget.acquire(ACCOUNT, timeout=0)
+    sleep = clock.sleep
+
+    def release_while_waiting(seconds):
+        sleep(seconds)
+        held.release()
+
+    monkeypatch.setattr(clock, "sleep", release_while_waiting)
+    assert budget.acquire(ACCOUNT, timeout=5) is not None
+
+
+def test_waiter_gives_up_after_the_timeout(redis, limit, clock):
+    limit(1)
+    budget.acquire(ACCOUNT, timeout=0)
+    started = clock.now
+    assert budget.acquire(ACCOUNT, timeout=3) is None
+    assert clock.now - started >= 3
+    # The queue entry and waiter key are cleaned up
+    assert not redis.zsets.get(budget._QUEUE_KEY.format(ACCOUNT.id))
+    assert not [key for key in redis.values if key.startswith(budget._WAITER_KEY.format(""))]
+
+
+def test_earlier_waiters_go_first(redis, limit):
+    limit(1)
+    queue_key = budget._QUEUE_KEY.format(ACCOUNT.id)
+    redis.zadd(queue_key, {"earlier": 0})
+    redis.set(budget._WAITER_KEY.format("earlier"), 1, ex=budget._WAITER_TTL)
+    assert budget.acquire(ACCOUNT, timeout=0) is None
+    # A waiter whose worker died (no waiter key) no longer holds its place
+    redis.delete(budget._WAITER_KEY.format("earlier"))
+    assert budget.acquire(ACCOUNT, timeout=0) is not None
+
+
+def test_unlimited_account_is_not_tracked(redis, limit):
+    limit(0)
+    for _ in range(5):
+        assert budget.acquire(ACCOUNT, timeout=0) is not None
+    assert not leases(redis)
+
+
+def test_admits_without_redis(monkeypatch, limit):
+    monkeypatch.setattr(budget, "get_redis", lambda: None)
+    monkeypatch.setattr(budget, "_setting", lambda key, default: default)
+    slot = budget.acquire(ACCOUNT, timeout=0)
+    slot.refresh()
+    slot.release()
+
+
+def test_admits_when_redis_fails(redis, limit, monkeypatch):
+    def broken(*args, **kwargs):
+        raise ConnectionError("redis down")
+
+    monkeypatch.setattr(redis, "zadd", broken)
+    assert budget.acquire(ACCOUNT, timeout=0) is not None
+
+
+def test_disabled_budget_admits_everything(redis, limit, monkeypatch):
+    monkeypatch.setattr(budget, "_setting", lambda key, default: False if key == "respect_max_streams" else default)
+    limit(1)
+    assert budget.acquire(ACCOUNT, timeout=0) is not None
+    assert budget.acquire(ACCOUNT, timeout=0) is not None
+    assert not leases(redis)
@@ -0,0 +1,68 @@
+"""Tests for the XMLTV timezone conversion (xmltv.TimezoneConverter)."""
+
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from dispatcharr_timeshift.xmltv import TimezoneConverter, parse_xmltv_utc
+
+# Europe/Brussels, 2024: CET -> CEST at 01:00 UTC on March 31, back on October 27
+SPRING_FORWARD = 1711846800
+FALL_BACK = 1729990800
+
+
+def expected(tz_name, epoch):
+    local = datetime.fromtimestamp(epoch, timezone.utc).astimezone(ZoneInfo(tz_name))
+    return local.strftime("%Y%m%d%H%M%S %z").encode("ascii")
+
+
+def test_offset_changes_on_the_exact_second_in_spring():
+    converter = TimezoneConverter("Europe/Brussels")
+    assert converter.offset_at(SPRING_FORWARD - 1) == 3600
+    assert converter.offset_at(SPRING_FORWARD) == 7200
+    assert converter.format_local(SPRING_FORWARD - 1) == b"20240331015959 +0100"
+    assert converter.format_local(SPRING_FORWARD) == b"20240331030000 +0200"
+
+
+def test_offset_changes_on_the_exact_second_in_autumn():
+    converter = TimezoneConverter("Europe/Brussels")
+    assert converter.offset_at(FALL_BACK - 1) == 7200
+    assert converter.offset_at(FALL_BACK) == 3600
+    # The repeated local hour is told apart by its offset
+    assert converter.format_local(FALL_BACK - 1) == b"20241027025959 +0200"
+    assert converter.format_local(FALL_BACK) == b"20241027020000 +0100"
+
+
+@pytest.mark.parametrize("tz_name", [
+    "Europe/Brussels", "America/New_York", "Australia/Sydney", "Asia/Kolkata", "UTC",
+])
+def test_matches_zoneinfo_over_a_year(tz_name):
+    converter = TimezoneConverter(tz_name)
+    start = 1704067200  # 2024-01-01 UTC
+    for epoch in range(start, start + 366 * 86400, 3 * 3600 + 17):
+        assert converter.format_local(epoch) == expected(tz_name, epoch)
+
+
+def test_table_extends_to_timestamps_far_from_now():
+    converter = TimezoneConverter("Europe/Brussels")
+    for epoch in (946684800, 2208988800):  # 2000 and 2040
+        assert converter.format_local(epoch) == expected("Europe/Brussels", epoch)
+    # Extending keeps the range already covered
+    assert converter.format_local(SPRING_FORWARD) == b"20240331030000 +0200"
+
+
+def test_rewrite_stream_converts_timestamps_split_across_chunks():
+    converter = TimezoneConverter("Europe/Brussels")
+    xml = b'<programme start="20240331005959 +0000" stop="20240331010000 +0000" channel="a">'
+    chunks = [xml[:30], xml[30:50], xml[50:]]
+    assert b"".join(converter.rewrite_stream(chunks)) == (
+        b'<programme start="20240331015959 +0100" stop="20240331030000 +0200" channel="a">'
+    )
+
+
+def test_parse_xmltv_utc():
+    assert parse_xmltv_utc(b"20240331010000") == SPRING_FORWARD
+    assert parse_xmltv_utc("20240229000000") == 1709164800
+    assert parse_xmltv_utc(b"20230229000000") is None
+    assert parse_xmltv_utc(b"2024133100000x") is None
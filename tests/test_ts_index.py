@@ -0,0 +1,134 @@
+"""Tests for ts_index: PCR parsing, unwrapping and time <-> offset lookups."""
+
+import pytest
+
+from dispatcharr_timeshift.ts_index import (
+    PCR_HZ,
+    PCR_WRAP,
+    TS_PACKET_SIZE,
+    TimeIndex,
+    TsIndexer,
+    packet_pcr,
+)
+
+
+def pcr_packet(pid, seconds):
+    """A TS packet whose adaptation field carries a PCR of seconds."""
+    base = int(round(seconds * PCR_HZ)) % (1 << 33)
+    header = bytes([
+        0x47, (pid >> 8) & 0x1F, pid & 0xFF, 0x20,   # adaptation field only
+        183, 0x10,                                    # length, PCR_flag
+        (base >> 25) & 0xFF, (base >> 17) & 0xFF, (base >> 9) & 0xFF, (base >> 1) & 0xFF,
+        ((base & 1) << 7) | 0x7E, 0x00,
+    ])
+    return header.ljust(TS_PACKET_SIZE, b"\xff")
+
+
+def plain_packet(pid=0x100):
+    return bytes([0x47, (pid >> 8) & 0x1F, pid & 0xFF, 0x10]).ljust(TS_PACKET_SIZE, b"\0")
+
+
+def stream(seconds, packets_per_second=50, pid=0x100, start=0.0):
+    """One PCR packet per second followed by plain packets."""
+    data = bytearray()
+    for second in range(seconds):
+        data += pcr_packet(pid, start + second)
+        for _ in range(packets_per_second - 1):
+            data += plain_packet(pid)
+    return bytes(data)
+
+
+def test_packet_pcr_round_trip():
+    assert packet_pcr(pcr_packet(0x101, 12.5), 0) == (0x101, 12.5)
+    assert packet_pcr(plain_packet(), 0) is None
+    assert packet_pcr(b"\0" * TS_PACKET_SIZE, 0) is None
+
+
+def test_merge_unwraps_pcr_rollover():
+    index = TimeIndex()
+    index.merge([(0, PCR_WRAP - 2.0), (1000, PCR_WRAP - 1.0), (2000, 0.0), (3000, 1.0)])
+    assert list(index.times) == [PCR_WRAP - 2.0, PCR_WRAP - 1.0, PCR_WRAP, PCR_WRAP + 1.0]
+    assert index.time_at(3000) == pytest.approx(3.0)
+
+
+def test_merge_unwraps_samples_merged_out_of_order():
+    index = TimeIndex()
+    index.merge([(2000, 0.5), (3000, 1.5)])
+    index.merge([(0, PCR_WRAP - 1.5), (1000, PCR_WRAP - 0.5)])
+    assert list(index.offsets) == [0, 1000, 2000, 3000]
+    assert index.time_at(3000) == pytest.approx(3.0)
+
+
+def test_time_at_interpolates():
+    index = TimeIndex([0, 1000, 3000], [100.0, 101.0, 103.0])
+    assert index.time_at(0) == 0.0
+    assert index.time_at(500) == pytest.approx(0.5)
+    assert index.time_at(2000) == pytest.approx(2.0)
+    # Past the last sample without max_span: the last sample's time
+    assert index.time_at(10000) == pytest.approx(3.0)
+
+
+def test_time_at_refuses_unindexed_regions():
+    index = TimeIndex([0, 1000, 100000], [0.0, 1.0, 100.0])
+    assert index.time_at(50000, max_span=5000) is None
+    assert index.time_at(500, max_span=5000) == pytest.approx(0.5)
+    # Just past the last sample: extrapolated at the last rate
+    assert index.time_at(101000, max_span=5000) == pytest.approx(100.0 + 1000 * 99.0 / 99000)
+    assert index.time_at(200000, max_span=5000) is None
+
+
+def test_lookups_need_a_sample_near_the_start():
+    index = TimeIndex([TimeIndex.START_TOLERANCE + 1], [5.0])
+    assert not index.starts_at_zero
+    assert index.time_at(0) is None
+    assert index.offset_at(0) is None
+
+
+def test_offset_at_is_packet_aligned():
+    index = TimeIndex([0, 1000, 2000], [0.0, 1.0, 2.0])
+    assert index.offset_at(1.5) == 1000 - 1000 % TS_PACKET_SIZE
+    assert index.offset_at(0) == 0
+    assert index.offset_at(-1) is None
+
+
+def test_offset_at_refuses_beyond_max_gap():
+    index = TimeIndex([0, 1880], [0.0, 1.0])
+    assert index.offset_at(5.0, max_gap=10.0) == 1880
+    assert index.offset_at(20.0, max_gap=10.0) is None
+
+
+def test_serialization_round_trip():
+    index = TimeIndex([0, 1880, 3760], [10.0, 11.0, 12.5])
+    copy = TimeIndex.from_bytes(index.to_bytes())
+    assert list(copy.offsets) == list(index.offsets)
+    assert list(copy.times) == list(index.times)
+
+
+def test_indexer_samples_about_once_per_second():
+    data = stream(10)
+    indexer = TsIndexer()
+    for pos in range(0, len(data), 4096):
+        indexer.feed(pos, data[pos:pos + 4096])
+    seconds = [pcr for _offset, pcr in indexer.samples]
+    assert seconds[:2] == [0.0, 1.0]
+    assert len(seconds) >= 8
+    assert all(offset % TS_PACKET_SIZE == 0 for offset, _pcr in indexer.samples)
+
+
+def test_indexer_aligns_on_a_range_starting_mid_packet():
+    data = stream(5)
+    start = 3 * TS_PACKET_SIZE + 100
+    indexer = TsIndexer()
+    # A short first fragment, as the relay yields it, then the rest
+    first = TS_PACKET_SIZE - 100
+    indexer.feed(start, data[start:start + first])
+    indexer.feed(start + first, data[start + first:])
+    assert indexer.samples
+    assert all(offset % TS_PACKET_SIZE == 0 for offset, _pcr in indexer.samples)
+
+
+def test_indexer_ignores_non_ts_data():
+    indexer = TsIndexer()
+    indexer.feed(0, b"<html>" + b"x" * 1000)
+    indexer.feed(1006, stream(2))
+    assert indexer.samples == []
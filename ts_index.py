@@ -0,0 +1,330 @@
+"""
+Dispatcharr Timeshift Plugin - MPEG-TS time index
+
+Maps stream time to byte offsets for catch-up programs, from the PCR
+(Program Clock Reference) timestamps carried in the transport stream.
+
+WHY?
+    Seeking could only reuse fetched content when the client seeked by
+    byte Range. Clients that seek by time send a new timeshift request with
+    a later start, which always went back to the provider - even when that
+    part of the program had just been fetched and stored by the segment
+    cache. With a time -> byte index, such a request is answered from the
+    stored bytes (views._serve_time_seek), and byte ranges can be turned
+    back into minutes (time_at) for logging and segmenting.
+
+HOW:
+    - TsIndexer watches the bytes written to the segment cache. It parses
+      packet headers only until it finds a PCR, records (pcr, offset), then
+      skips ahead about SAMPLE_INTERVAL seconds' worth of bytes (estimated
+      from the previous samples) before looking again. A few packets are
+      parsed per second of video, not all of them.
+    - Only the first PID seen carrying a PCR is used.
+    - PCRs wrap every 2^33 / 90 kHz (~26.5 h); samples are unwrapped when
+      merged.
+    - The samples of a stored program are merged into <key>.idx next to its
+      data file, whatever Range they came from.
+
+GitHub: https://github.com/cedric-marcoux/dispatcharr_timeshift
+"""
+
+import bisect
+import logging
+import struct
+from array import array
+
+logger = logging.getLogger("plugins.dispatcharr_timeshift.ts_index")
+
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+
+PCR_HZ = 90000.0
+PCR_WRAP = (1 << 33) / PCR_HZ
+
+# Seconds of stream between two samples
+SAMPLE_INTERVAL = 1.0
+
+# Packets parsed per feed() at most while looking for a PCR
+_MAX_SCAN_PACKETS = 2000
+
+_COUNT = struct.Struct("<I")
+
+
+def packet_pcr(data, pos):
+    """
+    Return (pid, pcr_seconds) of the packet at pos, or None without a PCR.
+    """
+    if data[pos] != TS_SYNC_BYTE:
+        return None
+    flags = data[pos + 3]
+    # adaptation_field_control 2 or 3: an adaptation field is present
+    if not flags & 0x20:
+        return None
+    if data[pos + 4] < 7 or not data[pos + 5] & 0x10:
+        return None
+    base = (
+        (data[pos + 6] << 25)
+        | (data[pos + 7] << 17)
+        | (data[pos + 8] << 9)
+        | (data[pos + 9] << 1)
+        | (data[pos + 10] >> 7)
+    )
+    pid = ((data[pos + 1] & 0x1F) << 8) | data[pos + 2]
+    return pid, base / PCR_HZ
+
+
+def find_keyframe(data, start=0, limit=None):
+    """
+    Return the position of the first packet in data[start:limit] that starts
+    a video PES flagged random access (a keyframe), or None.
+
+    Only packets wholly inside the window count, and positions step by
+    TS_PACKET_SIZE from start, so start must be packet-aligned.
+    """
+    end = len(data) if limit is None else min(limit, len(data))
+    pos = start
+    while pos + TS_PACKET_SIZE <= end:
+        if (
+            data[pos] == TS_SYNC_BYTE
+            and data[pos + 1] & 0x40            # payload_unit_start_indicator
+            and data[pos + 3] & 0x20            # adaptation field present
+            and data[pos + 4] > 0
+            and data[pos + 5] & 0x40            # random_access_indicator
+        ):
+            payload = pos + 5 + data[pos + 4]
+            if (
+                payload + 4 <= pos + TS_PACKET_SIZE
+                and data[payload] == 0 and data[payload + 1] == 0 and data[payload + 2] == 1
+                and 0xE0 <= data[payload + 3] <= 0xEF  # video stream_id
+            ):
+                return pos
+        pos += TS_PACKET_SIZE
+    return None
+
+
+def find_tables(data, start=0):
+    """
+    Return the first PAT packet in data[start:] followed by the first packet
+    of each PMT it lists, or b"" if there is no PAT.
+
+    Tables are assumed to fit in one packet each (true for a single-program
+    stream). start must be packet-aligned.
+    """
+    pat, pmt_pids, pmts = None, [], {}
+    pos = start
+    while pos + TS_PACKET_SIZE <= len(data):
+        if data[pos] == TS_SYNC_BYTE and data[pos + 1] & 0x40:   # payload_unit_start_indicator
+            pid = ((data[pos + 1] & 0x1F) << 8) | data[pos + 2]
+            if pat is None and pid == 0:
+                pmt_pids = _pat_program_pids(data, pos)
+                if pmt_pids:
+                    pat = bytes(data[pos:pos + TS_PACKET_SIZE])
+            elif pid in pmt_pids and pid not in pmts:
+                pmts[pid] = bytes(data[pos:pos + TS_PACKET_SIZE])
+                if len(pmts) == len(pmt_pids):
+                    break
+        pos += TS_PACKET_SIZE
+    if pat is None or not pmts:
+        return b""
+    return pat + b"".join(pmts[pid] for pid in pmt_pids if pid in pmts)
+
+
+def _pat_program_pids(data, pos):
+    """PMT PIDs listed by the PAT section starting in the packet at pos."""
+    end = pos + TS_PACKET_SIZE
+    payload = pos + 4
+    if data[pos + 3] & 0x20:                 # adaptation field present
+        payload += 1 + data[pos + 4]
+    if payload >= end:
+        return []
+    table = payload + 1 + data[payload]      # skip pointer_field
+    if table + 8 > end or data[table] != 0:  # table_id 0: program_association_section
+        return []
+    section_length = ((data[table + 1] & 0x0F) << 8) | data[table + 2]
+    entries_end = min(end, table + 3 + section_length - 4)  # before CRC_32
+    pids = []
+    for entry in range(table + 8, entries_end - 3, 4):
+        program_number = (data[entry] << 8) | data[entry + 1]
+        if program_number:                   # 0 is the network PID
+            pids.append(((data[entry + 2] & 0x1F) << 8) | data[entry + 3])
+    return pids
+
+
+class TimeIndex:
+    """
+    Sorted (offset, pcr seconds) samples of one program.
+
+    Times are unwrapped PCR values; offset_at() and time_at() work relative
+    to the first sample, which must be near offset 0 for them to mean
+    "position in the program" (see starts_at_zero).
+    """
+
+    __slots__ = ("offsets", "times")
+
+    # A first sample this close to the start is taken as the program start
+    START_TOLERANCE = 2 * 1024 * 1024
+
+    def __init__(self, offsets=(), times=()):
+        self.offsets = array('q', offsets)
+        self.times = array('d', times)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @property
+    def starts_at_zero(self):
+        return len(self.offsets) > 0 and self.offsets[0] <= self.START_TOLERANCE
+
+    def merge(self, samples):
+        """Merge (offset, pcr) samples, unwrapping PCR rollovers."""
+        merged = {}
+        for offset, pcr in zip(self.offsets, self.times):
+            merged[offset] = pcr
+        for offset, pcr in samples:
+            merged[offset] = pcr
+
+        offsets, times = array('q'), array('d')
+        wraps = 0.0
+        previous = None
+        for offset in sorted(merged):
+            pcr = merged[offset] + wraps
+            if previous is not None and pcr < previous - PCR_WRAP / 2:
+                wraps += PCR_WRAP
+                pcr += PCR_WRAP
+            offsets.append(offset)
+            times.append(pcr)
+            previous = pcr
+        self.offsets, self.times = offsets, times
+
+    def time_at(self, offset, max_span=None):
+        """
+        Seconds into the program at a byte offset (interpolated), or None.
+
+        Args:
+            max_span: Refuse to answer (None) when the samples around offset
+                are further apart than this many bytes, or offset is further
+                past the last sample (the region is not indexed). Without
+                it, offsets past the last sample get the last sample's time.
+        """
+        if not self.starts_at_zero:
+            return None
+        i = bisect.bisect_right(self.offsets, offset) - 1
+        if i < 0:
+            return 0.0
+        if i + 1 < len(self.offsets):
+            span = self.offsets[i + 1] - self.offsets[i]
+            if max_span is not None and span > max_span:
+                return None
+            fraction = (offset - self.offsets[i]) / span if span else 0.0
+            t = self.times[i] + fraction * (self.times[i + 1] - self.times[i])
+        elif max_span is None:
+            t = self.times[i]
+        elif offset - self.offsets[i] > max_span or i == 0:
+            return None
+        else:
+            # Just past the last sample: extrapolate at the last rate
+            span = self.offsets[i] - self.offsets[i - 1]
+            rate = (self.times[i] - self.times[i - 1]) / span if span else 0.0
+            t = self.times[i] + (offset - self.offsets[i]) * rate
+        return t - self.times[0]
+
+    def offset_at(self, seconds, max_gap=10.0):
+        """
+        Packet-aligned byte offset where the program reaches seconds, or None.
+
+        Args:
+            seconds: Seconds into the program
+            max_gap: Refuse to answer when the nearest sample before the
+                target is further away than this (the region is not indexed)
+        """
+        if not self.starts_at_zero:
+            return None
+        target = self.times[0] + seconds
+        i = bisect.bisect_right(self.times, target) - 1
+        if i < 0 or target - self.times[i] > max_gap:
+            return None
+        offset = self.offsets[i]
+        return offset - offset % TS_PACKET_SIZE
+
+    def to_bytes(self):
+        return _COUNT.pack(len(self.offsets)) + self.offsets.tobytes() + self.times.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        index = cls()
+        (count,) = _COUNT.unpack_from(data, 0)
+        start = _COUNT.size
+        index.offsets.frombytes(data[start:start + count * 8])
+        index.times.frombytes(data[start + count * 8:start + count * 16])
+        return index
+
+
+class TsIndexer:
+    """Collects PCR samples from bytes as they are written (see module docstring)."""
+
+    def __init__(self):
+        self.samples = []
+        self._pid = None
+        self._alignment = None      # absolute offset % 188 of packet starts
+        self._head = bytearray()    # first bytes, until alignment is known
+        self._head_offset = None
+        self._next_scan = 0
+        self._rate = None           # bytes per second of stream
+        self._disabled = False
+
+    def feed(self, offset, data):
+        """Look at a chunk written at absolute byte offset."""
+        if self._disabled:
+            return
+        end = offset + len(data)
+        if end <= self._next_scan:
+            return
+
+        if self._alignment is None:
+            # Two packets' worth before deciding: a Range response starts
+            # with a partial-packet fragment (relay.py yields it alone),
+            # too short to confirm a sync byte
+            from .relay import find_sync
+            if self._head_offset is None:
+                self._head_offset = offset
+            self._head += data
+            if len(self._head) < 2 * TS_PACKET_SIZE:
+                return
+            offset, data = self._head_offset, bytes(self._head)
+            self._head = bytearray()
+            sync = find_sync(data)
+            if sync is None:
+                self._disabled = True  # Not MPEG-TS
+                return
+            self._alignment = (offset + sync) % TS_PACKET_SIZE
+
+        # First packet boundary at or after max(offset, next_scan)
+        begin = max(offset, self._next_scan)
+        begin += (self._alignment - begin) % TS_PACKET_SIZE
+        pos = begin - offset
+        limit = len(data) - TS_PACKET_SIZE
+        scanned = 0
+
+        while pos <= limit and scanned < _MAX_SCAN_PACKETS:
+            found = packet_pcr(data, pos)
+            if found is not None and (self._pid is None or found[0] == self._pid):
+                self._pid = found[0]
+                self._record(offset + pos, found[1])
+                return
+            pos += TS_PACKET_SIZE
+            scanned += 1
+
+        self._next_scan = offset + pos
+
+    def _record(self, offset, pcr):
+        if self.samples:
+            last_offset, last_pcr = self.samples[-1]
+            elapsed = pcr - last_pcr
+            if 0 < elapsed < 60 and offset > last_offset:
+                rate = (offset - last_offset) / elapsed
+                self._rate = rate if self._rate is None else (self._rate + rate) / 2
+        self.samples.append((offset, pcr))
+        if self._rate:
+            self._next_scan = offset + int(self._rate * SAMPLE_INTERVAL * 0.9)
+        else:
+            self._next_scan = offset + TS_PACKET_SIZE
@@ -0,0 +1,207 @@
+"""
+Dispatcharr Timeshift Plugin - Upstream connections
+
+Connection handling for requests to the Xtream Codes provider made by the
+timeshift proxy (views.py).
+
+WHY POOLED SESSIONS?
+    _proxy_stream used module-level requests.get(), so every catch-up start
+    and every seek (iPlayTV sends a new Range request per scrub) paid a
+    fresh TCP - and often TLS - handshake to the provider. Each M3U account
+    now gets its own requests.Session with a keep-alive connection pool,
+    reused by every request in the worker.
+
+    Sessions unused for longer than the idle timeout are closed by a
+    lightweight reaper that runs on the request path (no thread), so
+    provider-side sockets are not held open forever.
+
+REDIRECT CACHE:
+    Many providers answer /streaming/timeshift.php with a 302 to a CDN edge.
+    requests follows it, but on every request - including every seek - so
+    each Range request paid a round trip to the provider's panel first.
+    open_stream() remembers the final URL per (account, timeshift URL) for a
+    short TTL and goes straight to the edge; any error from the cached
+    target forgets it and retries once through the panel.
+
+GitHub: https://github.com/cedric-marcoux/dispatcharr_timeshift
+"""
+
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import health
+
+logger = logging.getLogger("plugins.dispatcharr_timeshift.upstream")
+
+DEFAULT_POOL_SIZE = 4
+DEFAULT_IDLE_TIMEOUT = 120
+DEFAULT_REDIRECT_TTL = 60
+_REDIRECT_MAX_ENTRIES = 1024
+
+# Host pools per session: the panel and the CDN edge(s) it redirects to
+# must not evict each other's keep-alive connections
+HOST_POOLS = 4
+
+# How often the reaper looks for idle sessions
+_REAP_INTERVAL = 30.0
+
+_lock = threading.Lock()
+_sessions = {}  # account id -> [session, pool_size, last_used]
+_last_reap = 0.0
+_redirects = {}  # (account id, url) -> (final url, expires_at)
+
+
+def _setting_int(key, default):
+    from .cache import get_plugin_setting
+    try:
+        return int(get_plugin_setting(key, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _new_session(pool_size):
+    session = requests.Session()
+    # No automatic retries: a failed seek should surface, not be replayed
+    adapter = HTTPAdapter(pool_connections=HOST_POOLS, pool_maxsize=pool_size, max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session(m3u_account):
+    """
+    Return the pooled requests.Session for an M3U account.
+
+    A new session is created when none exists or when the configured pool
+    size changed. A replaced session is not closed: responses opened from
+    it may still be streaming; it is garbage-collected once they end.
+    """
+    pool_size = max(1, _setting_int("upstream_pool_size", DEFAULT_POOL_SIZE))
+    now = time.monotonic()
+    _reap_idle(now)
+
+    with _lock:
+        entry = _sessions.get(m3u_account.id)
+        if entry is None or entry[1] != pool_size:
+            entry = [_new_session(pool_size), pool_size, now]
+            _sessions[m3u_account.id] = entry
+            logger.debug(f"[Timeshift] New upstream session for account {m3u_account.id} (pool {pool_size})")
+        entry[2] = now
+        return entry[0]
+
+
+def touch_session(m3u_account_id):
+    """Mark a session as used (called while a stream is being relayed)."""
+    entry = _sessions.get(m3u_account_id)
+    if entry is not None:
+        entry[2] = time.monotonic()
+
+
+def _reap_idle(now):
+    """Close sessions that have not been used for the idle timeout."""
+    global _last_reap
+
+    if now - _last_reap < _REAP_INTERVAL:
+        return
+    _last_reap = now
+    idle_timeout = _setting_int("upstream_idle_timeout", DEFAULT_IDLE_TIMEOUT)
+
+    with _lock:
+        idle = [account_id for account_id, entry in _sessions.items() if now - entry[2] > idle_timeout]
+        for account_id in idle:
+            _sessions.pop(account_id)[0].close()
+            logger.debug(f"[Timeshift] Closed idle upstream session for account {account_id}")
+
+
+def close_all():
+    """Close every pooled session (used when hooks are uninstalled)."""
+    with _lock:
+        for entry in _sessions.values():
+            entry[0].close()
+        _sessions.clear()
+        _redirects.clear()
+
+
+def get_cached_redirect(m3u_account_id, url):
+    """Return the remembered redirect target for a URL, or None."""
+    entry = _redirects.get((m3u_account_id, url))
+    if entry is None:
+        return None
+    if entry[1] < time.monotonic():
+        _redirects.pop((m3u_account_id, url), None)
+        return None
+    return entry[0]
+
+
+def remember_redirect(m3u_account_id, url, final_url, ttl=None):
+    """Remember where a URL redirected to, for redirect_cache_ttl seconds."""
+    if ttl is None:
+        ttl = _setting_int("redirect_cache_ttl", DEFAULT_REDIRECT_TTL)
+    if ttl <= 0:
+        return
+    with _lock:
+        if len(_redirects) >= _REDIRECT_MAX_ENTRIES:
+            now = time.monotonic()
+            for key in [k for k, v in _redirects.items() if v[1] < now]:
+                del _redirects[key]
+            if len(_redirects) >= _REDIRECT_MAX_ENTRIES:
+                _redirects.clear()
+        _redirects[(m3u_account_id, url)] = (final_url, time.monotonic() + ttl)
+
+
+def forget_redirect(m3u_account_id, url):
+    """Drop a remembered redirect (after an upstream error)."""
+    _redirects.pop((m3u_account_id, url), None)
+
+
+def open_stream(m3u_account, url, headers, timeout=10):
+    """
+    GET a provider URL as a stream, through the account's pooled session
+    and the redirect cache.
+
+    The outcome (and time to response headers) feeds the account's health
+    (health.py).
+
+    Returns:
+        requests.Response (any status - the caller decides what is valid)
+
+    Raises:
+        requests.exceptions.RequestException: When the request fails
+    """
+    started = time.monotonic()
+    try:
+        response = _open_stream(m3u_account, url, headers, timeout)
+    except requests.exceptions.RequestException:
+        health.record_failure(m3u_account.id)
+        raise
+    if response.status_code >= 500:
+        health.record_failure(m3u_account.id)
+    else:
+        health.record_success(m3u_account.id, time.monotonic() - started)
+    return response
+
+
+def _open_stream(m3u_account, url, headers, timeout):
+    session = get_session(m3u_account)
+    target = get_cached_redirect(m3u_account.id, url)
+
+    if target is not None:
+        try:
+            response = session.get(target, headers=headers, stream=True, timeout=timeout)
+            if response.status_code in (200, 206):
+                return response
+            logger.info(f"[Timeshift] Cached redirect target returned {response.status_code}, retrying via provider")
+            response.close()
+        except requests.exceptions.RequestException as e:
+            logger.info(f"[Timeshift] Cached redirect target failed ({e}), retrying via provider")
+        forget_redirect(m3u_account.id, url)
+
+    response = session.get(url, headers=headers, stream=True, timeout=timeout)
+    if response.history and response.status_code in (200, 206) and response.url != url:
+        remember_redirect(m3u_account.id, url, response.url)
+        logger.debug("[Timeshift] Remembered provider redirect to edge")
+    return response
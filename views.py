@@ -30,13 +30,41 @@ GitHub: https://github.com/cedric-marcoux/dispatcharr_timeshift
 """
 
 import logging
+import time
 import requests
+from collections import namedtuple
 from datetime import datetime
 from zoneinfo import ZoneInfo
-from django.http import StreamingHttpResponse, Http404, HttpResponseBadRequest, HttpResponseForbidden
+from django.http import StreamingHttpResponse, HttpResponse, Http404, HttpResponseBadRequest, HttpResponseForbidden
+
+from .cache import get_plugin_setting, get_plugin_timezone, lookup_provider_stream
+from . import budget, failover, health, readahead, segment_cache, watchdog
+from .epg import catchup_duration
+from .relay import ChunkSizer, relay
+from .upstream import open_stream, touch_session
 
 logger = logging.getLogger("plugins.dispatcharr_timeshift.views")
 
+# Minutes of content requested from the provider when the EPG can't tell
+TIMESHIFT_DURATION = 120
+DEFAULT_DURATION_PADDING = 5
+
+# Following another request's upstream fetch (segment_cache.py fan-out)
+FOLLOW_POLL_INTERVAL = 0.1
+FOLLOW_HANDSHAKE_TIMEOUT = 12.0   # owner's connect + provider-side seek
+FOLLOW_STALL_TIMEOUT = 15.0
+FOLLOW_MAX_LEAD = 32 * 1024 * 1024
+
+# A time seek may be served from a stored window ending this much earlier
+# than the requested one (the same programme end, rounded differently)
+TIME_SEEK_TOLERANCE = 5 * 60
+
+
+TimeshiftTarget = namedtuple(
+    "TimeshiftTarget",
+    ["channel", "stream", "m3u_account", "url", "user_agent", "provider_stream_id", "start", "duration"]
+)
+
 
 def timeshift_proxy(request, username, password, stream_id, timestamp, duration):
     """
@@ -52,6 +80,26 @@ def timeshift_proxy(request, username, password, stream_id, timestamp, duration)
     Returns:
         StreamingHttpResponse proxying the video stream from provider
     """
+    error, target = _prepare_timeshift(username, password, timestamp, duration)
+    if error is not None:
+        return error
+
+    # Step 9: Proxy the stream (pooled keep-alive session per M3U account),
+    # through the shared segment cache when the program has fully aired,
+    # failing over to the channel's other archive streams
+    return _proxy_stream(request, _candidate_targets(target))
+
+
+def _prepare_timeshift(username, password, timestamp, duration):
+    """
+    Authenticate, resolve the channel and build the provider URL.
+
+    Shared by the WSGI view above and the ASGI view (async_views.py); it
+    only does blocking work (DB), never upstream I/O.
+
+    Returns:
+        Tuple of (error_response, None) or (None, TimeshiftTarget)
+    """
     # QUIRK: The "duration" param is actually the provider's stream_id
     # See module docstring for explanation of iPlayTV's URL format
     provider_stream_id = duration.rstrip('.ts')
@@ -61,7 +109,7 @@ def timeshift_proxy(request, username, password, stream_id, timestamp, duration)
     # Step 1: Authenticate user via xc_password
     user = _authenticate_user(username, password)
     if not user:
-        return HttpResponseForbidden("Invalid credentials")
+        return HttpResponseForbidden("Invalid credentials"), None
 
     # Step 2: Find channel by provider's stream_id
     # We search custom_properties.stream_id, NOT Dispatcharr's internal ID
@@ -72,17 +120,17 @@ def timeshift_proxy(request, username, password, stream_id, timestamp, duration)
     # Step 3: Verify user has access to this channel
     if user.user_level < channel.user_level:
         logger.warning(f"[Timeshift] Access denied for user {username} to channel {channel.name}")
-        return HttpResponseForbidden("Access denied")
+        return HttpResponseForbidden("Access denied"), None
 
     # Step 4: Verify channel supports timeshift
     props = stream.custom_properties or {}
     if props.get('tv_archive') not in (1, '1'):
-        return HttpResponseBadRequest("Timeshift not supported for this channel")
+        return HttpResponseBadRequest("Timeshift not supported for this channel"), None
 
     # Step 5: Verify it's an Xtream Codes provider
     m3u_account = stream.m3u_account
     if not m3u_account or m3u_account.account_type != 'XC':
-        return HttpResponseBadRequest("Channel not from Xtream Codes provider")
+        return HttpResponseBadRequest("Channel not from Xtream Codes provider"), None
 
     # Step 6: Use timestamp as-is (clients send local time, not UTC)
     # IPTV clients (Snappier, IPTVX) send timestamps in local timezone based on EPG data
@@ -91,6 +139,25 @@ def timeshift_proxy(request, username, password, stream_id, timestamp, duration)
     local_timestamp = timestamp  # No conversion needed
     logger.info(f"[Timeshift] Using timestamp: {timestamp} ({timezone_str})")
 
+    # Request the programme's actual length instead of a fixed 2 hours
+    duration_minutes = _program_duration(channel, local_timestamp, timezone_str)
+
+    logger.info(f"[Timeshift] Proxying to provider for channel: {channel.name} ({duration_minutes} min)")
+
+    # Steps 7-8: Provider URL and User-Agent
+    return None, _build_target(channel, stream, local_timestamp, duration_minutes)
+
+
+def _build_target(channel, stream, start, duration=TIMESHIFT_DURATION):
+    """
+    Build the TimeshiftTarget for one stream of a channel.
+
+    Returns:
+        TimeshiftTarget with the provider's timeshift URL
+    """
+    m3u_account = stream.m3u_account
+    props = stream.custom_properties or {}
+
     # Step 7: Build provider's timeshift URL
     # Format: /streaming/timeshift.php?username=X&password=Y&stream=Z&start=T&duration=M
     timeshift_url = (
@@ -98,17 +165,58 @@ def timeshift_proxy(request, username, password, stream_id, timestamp, duration)
         f"?username={m3u_account.username}"
         f"&password={m3u_account.password}"
         f"&stream={props.get('stream_id')}"
-        f"&start={local_timestamp}"
-        f"&duration=120"  # Request 2 hours of content
+        f"&start={start}"
+        f"&duration={duration}"  # Minutes: programme length (or 2 hours)
     )
 
-    logger.info(f"[Timeshift] Proxying to provider for channel: {channel.name}")
-
     # Step 8: Get User-Agent from M3U account settings
     user_agent = m3u_account.get_user_agent().user_agent
 
-    # Step 9: Proxy the stream
-    return _proxy_stream(request, timeshift_url, user_agent)
+    return TimeshiftTarget(
+        channel, stream, m3u_account, timeshift_url, user_agent,
+        props.get('stream_id'), start, duration,
+    )
+
+
+def _candidate_targets(target):
+    """Return target followed by its failover alternates (when enabled)."""
+    candidates = [target]
+    if failover.is_enabled():
+        candidates += _alternate_targets(target)
+    return candidates
+
+
+def _alternate_targets(target):
+    """
+    Return targets for the channel's other archive-capable XC streams.
+
+    Ordered by channelstream__order, like Dispatcharr's own stream
+    selection; streams without tv_archive or from non-XC/inactive
+    accounts are skipped.
+    """
+    from apps.channels.models import ChannelStream
+
+    targets = []
+    channel_streams = (
+        ChannelStream.objects
+        .filter(channel_id=target.channel.id)
+        .exclude(stream_id=target.stream.id)
+        .select_related('stream__m3u_account')
+        .order_by('order')
+    )
+    for channel_stream in channel_streams:
+        stream = channel_stream.stream
+        props = stream.custom_properties or {}
+        m3u_account = stream.m3u_account
+        if props.get('tv_archive') not in (1, '1') or not props.get('stream_id'):
+            continue
+        if not m3u_account or m3u_account.account_type != 'XC' or not getattr(m3u_account, 'is_active', True):
+            continue
+        try:
+            targets.append(_build_target(target.channel, stream, target.start, target.duration))
+        except Exception as e:
+            logger.debug(f"[Timeshift] Skipping alternate stream {stream.id}: {e}")
+    return targets
 
 
 def _authenticate_user(username, password):
@@ -144,87 +252,702 @@ def _find_channel_by_provider_stream_id(provider_stream_id):
     and is stored in stream.custom_properties.stream_id during M3U sync.
     This is different from Dispatcharr's internal channel ID.
 
+    Uses the in-memory provider stream_id index shared with the hooks.
+
     Returns:
         Tuple of (Channel, Stream) if found, (None, None) otherwise
     """
-    from apps.channels.models import Stream
-
-    # Search for stream where custom_properties.stream_id matches
-    # Only look at XC provider streams
-    stream = Stream.objects.filter(
-        custom_properties__stream_id=str(provider_stream_id),
-        m3u_account__account_type='XC'
-    ).first()
-
-    if stream:
-        channel = stream.channels.first()
-        if channel:
-            return channel, stream
+    # Resolved through the per-worker index (cache.py) instead of a
+    # JSON-field scan on every catch-up start
+    channel, stream = lookup_provider_stream(provider_stream_id)
+    if channel:
+        return channel, stream
 
     logger.error(f"[Timeshift] Channel not found for provider_stream_id={provider_stream_id}")
     return None, None
 
 
-def _proxy_stream(request, url, user_agent):
+def _proxy_stream(request, candidates):
     """
     Proxy video stream from provider to client.
 
     Supports HTTP Range requests for seek/forward/rewind functionality.
     iPlayTV sends Range headers when user seeks in the timeline.
 
+    Upstream requests go through the account's pooled session (upstream.py),
+    so seeks reuse a kept-alive connection instead of a new handshake. The
+    body is relayed by relay.relay() (adaptive, packet-aligned chunks).
+
     Args:
         request: Django request object
-        url: Provider's timeshift URL
-        user_agent: User-Agent string from M3U account settings
+        candidates: TimeshiftTargets to try, preferred first (failover.py)
 
     Returns:
         StreamingHttpResponse with video content (status 200 or 206)
     """
-    headers = {
-        'User-Agent': user_agent
-    }
+    headers = {}
 
     # Forward Range header for seek support
     # Without this, seeking in iPlayTV would fail
     range_header = request.META.get('HTTP_RANGE')
     if range_header:
         headers['Range'] = range_header
+        # Byte offsets only make sense on the provider that served the
+        # first bytes of this program
+        candidates = [failover.sticky_target(candidates)]
+
+    # Splice the following windows into this response (readahead.py)
+    continuous = not range_header and readahead.is_enabled()
+
+    primary = candidates[0]
+    program = _segment_cache_program(primary)
+    claim = None
+    if program is not None:
+        # Stored bytes, or another request already fetching this program
+        cached_response = _serve_from_segment_cache(
+            program, primary.url, dict(headers, **{'User-Agent': primary.user_agent}), primary.m3u_account
+        )
+        if cached_response is not None:
+            return _make_continuous(cached_response, primary) if continuous else cached_response
+        if not range_header:
+            # A later start inside a stored program: a seek by time
+            seek_response, stored = _serve_time_seek(primary, candidates, headers)
+            if seek_response is not None:
+                # The body runs to the stored window's end, not the primary's
+                return _make_continuous(seek_response, stored) if continuous else seek_response
+        # Claimed before contacting the provider, so requests arriving
+        # during our handshake follow us instead of opening a connection
+        claim = program.claim()
+
+    error, target, response, body = _open_provider_body(candidates, headers, program, claim, hedge=not range_header)
+    if error is not None:
+        return _upstream_error(error)
+    if not range_header:
+        failover.remember_choice(primary, target)
+
+    streaming_response = StreamingHttpResponse(
+        body,
+        content_type=response.headers.get('Content-Type', 'video/mp2t'),
+        status=response.status_code
+    )
 
-    try:
-        response = requests.get(url, headers=headers, stream=True, timeout=10)
+    # Copy headers needed for seek support
+    # Content-Range tells client which bytes are being sent
+    # Accept-Ranges tells client that seeking is supported
+    for header in ['Content-Length', 'Content-Range', 'Accept-Ranges']:
+        if header in response.headers:
+            streaming_response[header] = response.headers[header]
+    if continuous:
+        _make_continuous(streaming_response, target)
 
-        # 200 = full content, 206 = partial content (Range request)
-        if response.status_code not in (200, 206):
-            logger.error(f"[Timeshift] Provider returned {response.status_code}")
-            return HttpResponseBadRequest(f"Provider error: {response.status_code}")
+    logger.info("[Timeshift] Streaming started")
+    return streaming_response
 
-        def stream_generator():
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    yield chunk
 
-        streaming_response = StreamingHttpResponse(
-            stream_generator(),
-            content_type=response.headers.get('Content-Type', 'video/mp2t'),
-            status=response.status_code
-        )
+def _open_provider_body(candidates, headers, program=None, claim=None, hedge=True):
+    """
+    Open the first candidate that answers and relay its body through the
+    segment cache.
+
+    Respects max_streams per account (budget.py), fails over and hedges
+    across the candidates (failover.py).
+
+    Args:
+        program: CachedProgram of candidates[0], or None
+        claim: Live claim on program (released here if unused)
+
+    Returns:
+        Tuple (error, target, response, body); on failure error is a
+        failover.open_upstream error and the rest is None
+    """
+    result = failover.open_upstream(candidates, headers, hedge=hedge)
+    if result.response is None:
+        if claim is not None:
+            claim.release()
+        return result.error, None, None, None
+
+    target, response, slot = result.target, result.response, result.slot
+    if target is not candidates[0]:
+        if claim is not None:
+            claim.release()
+        program = _segment_cache_program(target)
+        claim = program.claim() if program is not None else None
+
+    writer = _segment_writer(program, response, claim) if program is not None else None
+    if writer is None and claim is not None:
+        claim.release()
+    if writer is not None:
+        _register_program(target, program)
+
+    return None, target, response, _relay_response(response, target.m3u_account, writer, slot=slot)
+
+
+# =============================================================================
+# Continuous playback (readahead.py)
+# =============================================================================
+
+def _make_continuous(response, target):
+    """
+    Make a window's response continue into the following windows.
 
-        # Copy headers needed for seek support
-        # Content-Range tells client which bytes are being sent
-        # Accept-Ranges tells client that seeking is supported
-        for header in ['Content-Length', 'Content-Range', 'Accept-Ranges']:
-            if header in response.headers:
-                streaming_response[header] = response.headers[header]
+    The spliced body's length is unknown, so Content-Length goes and byte
+    seeking is no longer offered.
+    """
+    length = response.get('Content-Length', '')
+    response.streaming_content = _continuous_body(
+        response.streaming_content, target, int(length) if length.isdigit() else None
+    )
+    for header in ('Content-Length', 'Content-Range'):
+        if header in response:
+            del response[header]
+    response['Accept-Ranges'] = 'none'
+    return response
+
+
+def _continuous_body(body, target, length):
+    """
+    Yield a window's body, then the following windows' back to back.
 
-        logger.info("[Timeshift] Streaming started")
-        return streaming_response
+    The next window is opened by a ReadAhead once the client is within
+    readahead.TRIGGER_BYTES of the end (at the end if the length is
+    unknown). A window that ends short of its length stops the chain
+    rather than skipping ahead.
+    """
+    while body is not None:
+        sent = 0
+        pending = None
+        finished = False
+        try:
+            for chunk in body:
+                yield chunk
+                sent += len(chunk)
+                if pending is None and length and length - sent <= readahead.TRIGGER_BYTES:
+                    pending = readahead.ReadAhead(lambda current=target: _open_next_window(current))
+            finished = not length or sent >= length
+        finally:
+            if not finished:
+                # Client gone or window cut short: free both connections now
+                close = getattr(body, 'close', None)
+                if close is not None:
+                    close()
+                if pending is not None:
+                    pending.cancel()
+        if not finished:
+            return
+
+        if pending is not None:
+            info, body = pending.wait()
+            if info is None:
+                # Usually the account was full while the current window
+                # held its connection: try again now that it is closed
+                info, body = _open_next_window(target)
+        else:
+            info, body = _open_next_window(target)
+        if info is None:
+            return
+        target, length = info
+        logger.info(f"[Timeshift] Continuing with the next window at {target.start} ({target.duration} min)")
+
+
+def _next_window(target):
+    """
+    Return the TimeshiftTarget starting where target's window ends, or
+    None once that would reach the live edge.
+    """
+    timezone_str = _get_plugin_timezone()
+    begin = _start_epoch(target.start, timezone_str)
+    if begin is None:
+        return None
+    next_epoch = begin + int(target.duration) * 60
+    if next_epoch > time.time() - 60:
+        return None
+    start = datetime.fromtimestamp(next_epoch, ZoneInfo(timezone_str)).strftime("%Y-%m-%d:%H-%M")
+    duration = _program_duration(target.channel, start, timezone_str)
+    return _build_target(target.channel, target.stream, start, duration)
+
+
+def _open_next_window(target):
+    """
+    Open the window following target's.
 
-    except requests.exceptions.Timeout:
+    Returns:
+        Tuple ((next target, length or None), body), or (None, None)
+    """
+    next_target = _next_window(target)
+    if next_target is None:
+        return None, None
+    candidates = _candidate_targets(next_target)
+    primary = candidates[0]
+
+    program = _segment_cache_program(primary)
+    claim = None
+    if program is not None:
+        if program.total and program.covered_until(0) is not None:
+            body = _cached_body(
+                program, primary.url, {'User-Agent': primary.user_agent}, primary.m3u_account, 0, program.total - 1
+            )
+            return (primary, program.total), body
+        claim = program.claim()
+
+    error, served_by, response, body = _open_provider_body(candidates, {}, program, claim)
+    if error is not None:
+        logger.info(f"[Timeshift] Next window unavailable ({error})")
+        return None, None
+    failover.remember_choice(primary, served_by)
+    length = response.headers.get('Content-Length', '')
+    return (served_by, int(length) if length.isdigit() else None), body
+
+
+def _upstream_error(error):
+    """Map a failover.open_upstream error to the response the client gets."""
+    if error == "busy":
+        response = HttpResponse("Provider connection limit reached", status=503)
+        response['Retry-After'] = '5'
+        return response
+    if error == "unavailable":
+        logger.error("[Timeshift] Provider unavailable (circuit open)")
+        response = HttpResponse("Provider unavailable", status=503)
+        response['Retry-After'] = '30'
+        return response
+    if error == "timeout":
         logger.error("[Timeshift] Provider timeout")
         return HttpResponseBadRequest("Provider timeout")
+    if error and error.startswith("status:"):
+        status = error.split(":", 1)[1]
+        logger.error(f"[Timeshift] Provider returned {status}")
+        return HttpResponseBadRequest(f"Provider error: {status}")
+    logger.error("[Timeshift] Provider connection error")
+    return HttpResponseBadRequest("Provider connection error")
+
+
+def _relay_response(response, m3u_account, writer=None, skip=0, limit=None, slot=None):
+    """
+    Yield a provider response body to the client.
+
+    Args:
+        response: Streaming requests.Response
+        m3u_account: M3UAccount (keeps its pooled session marked as used)
+        writer: Optional segment_cache.SegmentWriter receiving every byte
+        skip: Bytes to drop before yielding (still written to the cache)
+        limit: Maximum bytes to yield, None for the whole body
+        slot: Optional budget.Slot held for this connection (released here)
+    """
+    # Same decoding iter_content() did, but read into a reusable
+    # buffer in adaptive, TS-packet-aligned chunks (relay.py)
+    response.raw.decode_content = True
+    # Closes the upstream if the client goes away (watchdog.py)
+    session = watchdog.register(response, slot, m3u_account.id)
+    sizer = ChunkSizer(max_chunk=watchdog.session_buffer_bytes())
+    eof = False
+    try:
+        for chunk in relay(response.raw, sizer):
+            touch_session(m3u_account.id)
+            if slot is not None:
+                slot.refresh()
+            if writer is not None:
+                writer.write(chunk)
+            if skip:
+                if len(chunk) <= skip:
+                    skip -= len(chunk)
+                    continue
+                chunk = chunk[skip:]
+                skip = 0
+            if limit is not None and len(chunk) >= limit:
+                chunk = chunk[:limit]
+                limit = 0
+            elif limit is not None:
+                limit -= len(chunk)
+            session.client_wait()
+            yield chunk
+            session.client_ready()
+            if session.aborted or limit == 0:
+                break
+        else:
+            eof = not session.aborted
+    except Exception:
+        # Reading from the upstream the watchdog closed under us
+        if not session.aborted:
+            raise
+    finally:
+        watchdog.unregister(session)
+        if writer is not None:
+            writer.close(eof=eof)
+        # Hands the connection back to the pool (or drops it if the
+        # client went away mid-stream)
+        response.close()
+        if slot is not None:
+            slot.release()
+
+
+def _segment_cache_program(target):
+    """
+    Return the CachedProgram for a timeshift target, or None if not cacheable.
+
+    Only windows that have fully aired are cached (see segment_cache.py).
+    """
+    if not segment_cache.is_enabled():
+        return None
+    if not _window_has_aired(target.start, target.duration, _get_plugin_timezone()):
+        return None
+    key = segment_cache.program_key(target.m3u_account.id, target.provider_stream_id, target.start, target.duration)
+    try:
+        return segment_cache.CachedProgram(key)
+    except OSError as e:
+        logger.warning(f"[Timeshift] Segment cache unavailable: {e}")
+        return None
+
+
+def _start_epoch(start, timezone_str):
+    """Parse a YYYY-MM-DD:HH-MM provider-local timestamp; None if invalid."""
+    try:
+        return datetime.strptime(start, "%Y-%m-%d:%H-%M").replace(tzinfo=ZoneInfo(timezone_str)).timestamp()
+    except Exception:
+        return None
+
+
+def _window_has_aired(start, duration_minutes, timezone_str):
+    """Return True if [start, start + duration) lies in the past."""
+    begin = _start_epoch(start, timezone_str)
+    if begin is None:
+        return False
+    return begin + int(duration_minutes) * 60 < time.time()
+
+
+def _program_duration(channel, start, timezone_str):
+    """
+    Minutes to request from the provider for a catch-up start.
+
+    Up to the end of the EPG programme airing at start (one bisect in the
+    channel's timeline, epg.py) plus duration_padding_minutes; the fixed
+    TIMESHIFT_DURATION when disabled or the schedule doesn't know.
+    """
+    if get_plugin_setting("epg_duration", True) in (False, "false", "0", 0):
+        return TIMESHIFT_DURATION
+
+    start_epoch = _start_epoch(start, timezone_str)
+    if start_epoch is None:
+        return TIMESHIFT_DURATION
+
+    try:
+        padding = int(get_plugin_setting("duration_padding_minutes", DEFAULT_DURATION_PADDING))
+    except (TypeError, ValueError):
+        padding = DEFAULT_DURATION_PADDING
+
+    try:
+        minutes = catchup_duration(channel, start_epoch, padding)
+    except Exception as e:
+        logger.debug(f"[Timeshift] EPG duration lookup failed: {e}")
+        minutes = None
+    return minutes or TIMESHIFT_DURATION
+
+
+def _segment_writer(program, response, claim=None):
+    """
+    Return a SegmentWriter for a provider response, or None if it can't be stored.
+
+    With a claim, the writer publishes its progress for followers and
+    releases the claim when it is closed.
+    """
+    if 'Content-Encoding' in response.headers:
+        # Stored offsets must be offsets in the body the client receives
+        return None
+
+    total = None
+    if response.status_code == 206:
+        content_range = segment_cache.parse_content_range(response.headers.get('Content-Range', ''))
+        if content_range is None:
+            return None
+        offset, _last, total = content_range
+    else:
+        offset = 0
+        length = response.headers.get('Content-Length', '')
+        total = int(length) if length.isdigit() else None
+
+    try:
+        return program.writer(offset, total, response.headers.get('Content-Type'), claim)
+    except OSError as e:
+        logger.warning(f"[Timeshift] Segment cache write unavailable: {e}")
+        return None
+
+
+def _parse_range(value, total):
+    """
+    Parse a single-range "bytes=" header against a known size.
+
+    Returns:
+        Tuple (first, last) inclusive, or None (multi-range, invalid or
+        unsatisfiable: left to the provider)
+    """
+    unit, _, spec = value.strip().partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if not first:
+            length = int(last)
+            if length <= 0:
+                return None
+            return max(0, total - length), total - 1
+        first = int(first)
+        last = int(last) if last else total - 1
+    except ValueError:
+        return None
+    last = min(last, total - 1)
+    if first > last:
+        return None
+    return first, last
+
+
+def _serve_from_segment_cache(program, url, headers, m3u_account):
+    """
+    Answer a request from the segment cache if its start offset is stored,
+    or is about to be written by a live owner in any worker.
+
+    Stored bytes are sent from disk; bytes the owner is still fetching are
+    tailed as they land (upstream fan-out, see segment_cache.py). Whatever
+    neither covers is fetched from the provider with a Range request within
+    the same response (and stored).
+
+    Returns:
+        StreamingHttpResponse, or None to proxy normally
+    """
+    total = program.total
+    state = None
+    if not total:
+        # An owner may be in its handshake: wait for it to learn the size
+        state = _wait_for_owner(program)
+        if state is None or not state.total:
+            return None
+        program.reload()
+        total = state.total
+
+    range_header = headers.get('Range')
+    if range_header:
+        requested = _parse_range(range_header, total)
+        if requested is None:
+            return None
+        first, last = requested
+    else:
+        first, last = 0, total - 1
+
+    if program.covered_until(first) is None:
+        state = state or program.live_state()
+        if not _owner_will_reach(state, first):
+            return None
+        logger.info(f"[Timeshift] Following the live upstream fetch from {_describe_offset(program, first)}")
+    else:
+        logger.info(f"[Timeshift] Serving from segment cache from {_describe_offset(program, first)}")
+
+    response = StreamingHttpResponse(
+        _cached_body(program, url, headers, m3u_account, first, last),
+        content_type=program.content_type,
+        status=206 if range_header else 200
+    )
+    response['Content-Length'] = str(last + 1 - first)
+    response['Accept-Ranges'] = 'bytes'
+    if range_header:
+        response['Content-Range'] = f"bytes {first}-{last}/{total}"
+    return response
+
+
+def _serve_time_seek(primary, candidates, headers):
+    """
+    Answer a start that falls inside an already stored program (a seek by
+    time) from that program's bytes, located with its PCR index (ts_index.py).
+
+    Returns:
+        Tuple (StreamingHttpResponse, TimeshiftTarget of the stored window
+        it streams to the end), or (None, None) to proxy normally
+    """
+    epoch = _start_epoch(primary.start, _get_plugin_timezone())
+    if epoch is None:
+        return None, None
+    requested_end = epoch + int(primary.duration) * 60
+
+    for target in candidates:
+        try:
+            entries = segment_cache.find_covering(target.m3u_account.id, target.provider_stream_id, epoch)
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.start_epoch + entry.duration * 60 < requested_end - TIME_SEEK_TOLERANCE:
+                continue  # Would end the client's stream early
+            try:
+                program = segment_cache.CachedProgram(entry.key)
+            except OSError:
+                continue
+            if not program.total:
+                continue
+            offset = program.time_index().offset_at(epoch - entry.start_epoch)
+            if offset is None or program.covered_until(offset) is None:
+                continue
+
+            stored = _build_target(target.channel, target.stream, entry.start, entry.duration)
+            logger.info(
+                f"[Timeshift] Time seek to {(epoch - entry.start_epoch) / 60:.1f} min "
+                f"of {entry.start} served from segment cache (byte {offset})"
+            )
+            response = StreamingHttpResponse(
+                _cached_body(
+                    program, stored.url, dict(headers, **{'User-Agent': stored.user_agent}),
+                    stored.m3u_account, offset, program.total - 1
+                ),
+                content_type=program.content_type
+            )
+            response['Content-Length'] = str(program.total - offset)
+            # Byte offsets in this body are not the provider's for this start
+            response['Accept-Ranges'] = 'none'
+            return response, stored
+    return None, None
+
+
+def _register_program(target, program):
+    """List a program being stored in its stream's catalog (for time seeks)."""
+    start_epoch = _start_epoch(target.start, _get_plugin_timezone())
+    if start_epoch is None:
+        return
+    try:
+        segment_cache.register(
+            target.m3u_account.id, target.provider_stream_id, target.start, start_epoch, target.duration, program.key
+        )
+    except OSError as e:
+        logger.debug(f"[Timeshift] Could not update segment cache catalog: {e}")
+
+
+def _describe_offset(program, offset):
+    """Return "byte N", with the position in minutes if the program is indexed."""
+    seconds = program.time_index().time_at(offset)
+    if seconds is None:
+        return f"byte {offset}"
+    return f"byte {offset} ({seconds / 60:.1f} min)"
+
+
+def _wait_for_owner(program):
+    """
+    Wait (bounded) for a live owner to publish its first progress.
+
+    Returns:
+        LiveState with a start offset, or None if there is no owner
+    """
+    deadline = time.monotonic() + FOLLOW_HANDSHAKE_TIMEOUT
+    while True:
+        state = program.live_state()
+        if state is None or state.start >= 0:
+            return state
+        if time.monotonic() > deadline:
+            return None
+        time.sleep(FOLLOW_POLL_INTERVAL)
+
+
+def _owner_will_reach(state, offset):
+    """True if a live owner has passed offset or is close behind it."""
+    return (
+        state is not None
+        and state.start >= 0
+        and state.start <= offset <= state.position + FOLLOW_MAX_LEAD
+    )
+
+
+def _cached_body(program, url, headers, m3u_account, first, last, queue_timeout=None):
+    """
+    Yield bytes [first, last] from stored extents, the live owner's
+    progress, and finally the provider for anything left.
+
+    queue_timeout bounds the wait for a provider slot (budget.acquire).
+    """
+    position = first
+    seen_position, seen_at = None, time.monotonic()
+    reloaded = False
+
+    while position <= last:
+        end = program.covered_until(position)
+        state = None
+        if end is None:
+            state = program.live_state()
+            if state is not None and state.start >= 0 and state.start <= position < state.position:
+                end = state.position
+
+        if end is not None:
+            before = position
+            try:
+                for chunk in program.read(position, min(end, last + 1)):
+                    position += len(chunk)
+                    yield chunk
+            except OSError:
+                break  # Evicted: fetch the rest upstream
+            if position == before:
+                break  # Data file replaced under us
+            seen_at, reloaded = time.monotonic(), False
+            continue
+
+        if _owner_will_reach(state, position):
+            # Behind a live owner: wait for it unless it stalled
+            if state.position != seen_position:
+                seen_position, seen_at = state.position, time.monotonic()
+            elif time.monotonic() - seen_at > FOLLOW_STALL_TIMEOUT:
+                logger.info("[Timeshift] Live upstream fetch stalled, fetching the rest directly")
+                break
+            time.sleep(FOLLOW_POLL_INTERVAL)
+            continue
+
+        if reloaded:
+            break
+        # The owner may just have finished: its extents are in the meta now
+        program.reload()
+        reloaded = True
+
+    if position <= last:
+        yield from _fetch_remainder(program, url, headers, m3u_account, position, last, queue_timeout)
+
+
+def _fetch_remainder(program, url, headers, m3u_account, first, last, queue_timeout=None):
+    """
+    Yield bytes [first, last] from the provider, storing them as they pass.
+
+    Raises:
+        ConnectionAbortedError: The bytes can't be fetched. The response
+            already promised them (Content-Length), so the client
+            connection must be aborted rather than ended cleanly short.
+    """
+    remote_headers = dict(headers, Range=f"bytes={first}-{last}")
+    slot = budget.acquire(m3u_account, timeout=queue_timeout)
+    if slot is None:
+        # Expected for background prefetches, which never queue
+        _abort_remainder(first, last, "no free provider connection", quiet=queue_timeout == 0)
+    # After the slot: allow() may claim the half-open probe
+    if not health.allow(m3u_account.id):
+        slot.release()
+        _abort_remainder(first, last, "provider unavailable")
+    try:
+        response = open_stream(m3u_account, url, remote_headers, timeout=10)
     except requests.exceptions.RequestException as e:
-        logger.error(f"[Timeshift] Provider error: {e}")
-        return HttpResponseBadRequest("Provider connection error")
+        slot.release()
+        _abort_remainder(first, last, f"provider error: {e}")
+
+    if response.status_code not in (200, 206):
+        response.close()
+        slot.release()
+        _abort_remainder(first, last, f"provider returned {response.status_code}")
+
+    # A provider ignoring Range answers 200 from byte 0: skip ahead
+    content_range = segment_cache.parse_content_range(response.headers.get('Content-Range', ''))
+    offset = content_range[0] if response.status_code == 206 and content_range else 0
+    if offset > first:
+        response.close()
+        slot.release()
+        _abort_remainder(first, last, f"provider answered from byte {offset}")
+
+    claim = program.claim()
+    writer = _segment_writer(program, response, claim)
+    if writer is None and claim is not None:
+        claim.release()
+    yield from _relay_response(response, m3u_account, writer, skip=first - offset, limit=last + 1 - first, slot=slot)
+
+
+def _abort_remainder(first, last, reason, quiet=False):
+    log = logger.debug if quiet else logger.warning
+    log(f"[Timeshift] Could not fetch bytes {first}-{last} after cached part ({reason}), aborting response")
+    raise ConnectionAbortedError(reason)
 
 
 def _get_plugin_timezone():
@@ -235,10 +958,7 @@ def _get_plugin_timezone():
         str: Timezone string (e.g., "Europe/Brussels"), defaults to "Europe/Brussels"
     """
     try:
-        from apps.plugins.models import PluginConfig
-        config = PluginConfig.objects.filter(key='dispatcharr_timeshift').first()
-        if config and config.config:
-            return config.config.get('timezone', 'Europe/Brussels')
+        return get_plugin_timezone()
     except Exception as e:
         logger.debug(f"[Timeshift] Could not load timezone setting: {e}")
     return "Europe/Brussels"
@@ -0,0 +1,184 @@
+"""
+Dispatcharr Timeshift Plugin - Speculative upstream warm-up
+
+Opt-in: when a client opens the EPG of an archive channel
+(patched_xc_get_epg), get the provider ready for the catch-up request
+that usually follows within seconds.
+
+WHY?
+    Catch-up time to first frame was auth + channel lookup + provider
+    handshake + provider-side seek, all after the user pressed play. The
+    EPG request comes first and tells us which channel (and account) is
+    about to be used.
+
+HOW:
+    - A HEAD request to the provider's panel through the account's pooled
+      session (upstream.py) leaves a kept-alive connection in the pool,
+      so the real request skips the TCP/TLS handshake.
+    - Optionally (warmup_prefetch_mb > 0) the first MBs of the most
+      likely programme - the latest one that has fully aired - are pulled
+      into the segment cache. The real request then starts from disk, or
+      follows the warm-up fetch if it is still running.
+
+BUDGET:
+    - At most one warm-up per account every WARMUP_INTERVAL seconds,
+      across all workers (Django cache add).
+    - A small thread pool; warm-ups beyond MAX_PENDING are dropped.
+    - The prefetch only uses a provider connection that is free right now
+      (it never queues, budget.py), respects the circuit breaker
+      (health.py), and is cut off at the byte budget or PREFETCH_DEADLINE.
+
+GitHub: https://github.com/cedric-marcoux/dispatcharr_timeshift
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+logger = logging.getLogger("plugins.dispatcharr_timeshift.warmup")
+
+WARMUP_INTERVAL = 30
+CONNECT_TIMEOUT = 5
+PREFETCH_DEADLINE = 15.0
+MAX_PENDING = 4
+
+_WARMUP_KEY = "dispatcharr_timeshift:warmup:{}"
+
+_executor = None
+_pending = 0
+_lock = threading.Lock()
+
+
+def _setting(key, default):
+    from .cache import get_plugin_setting
+    return get_plugin_setting(key, default)
+
+
+def is_enabled():
+    return _setting("speculative_warmup", False) in (True, "true", "1", 1)
+
+
+def prefetch_bytes():
+    try:
+        return max(0, int(float(_setting("warmup_prefetch_mb", 0)) * 1024 * 1024))
+    except (TypeError, ValueError):
+        return 0
+
+
+def schedule(channel, stream):
+    """
+    Warm the provider for a channel in the background (never blocks).
+
+    Args:
+        channel: Channel whose EPG was just served
+        stream: Its first stream (archive-capable)
+    """
+    global _executor, _pending
+
+    if stream is None or not is_enabled():
+        return
+    m3u_account = stream.m3u_account
+    if not m3u_account or m3u_account.account_type != 'XC':
+        return
+
+    from django.core.cache import cache
+    try:
+        if not cache.add(_WARMUP_KEY.format(m3u_account.id), 1, WARMUP_INTERVAL):
+            return  # Warmed recently (any worker)
+    except Exception:
+        return
+
+    with _lock:
+        if _pending >= MAX_PENDING:
+            return
+        if _executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            _executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="timeshift-warmup")
+        _pending += 1
+    _executor.submit(_run, channel, stream)
+
+
+def _run(channel, stream):
+    global _pending
+    try:
+        _warm_connection(stream.m3u_account)
+        limit = prefetch_bytes()
+        if limit:
+            _prefetch(channel, stream, limit)
+    except Exception as e:
+        logger.debug(f"[Timeshift] Warm-up failed: {e}")
+    finally:
+        with _lock:
+            _pending -= 1
+        from django.db import connection
+        connection.close()
+
+
+def _warm_connection(m3u_account):
+    """Leave a kept-alive connection to the panel in the account's pool."""
+    from .upstream import get_session
+
+    session = get_session(m3u_account)
+    started = time.monotonic()
+    response = session.head(
+        f"{m3u_account.server_url.rstrip('/')}/",
+        headers={'User-Agent': m3u_account.get_user_agent().user_agent},
+        timeout=CONNECT_TIMEOUT,
+        allow_redirects=False,
+    )
+    # No body: closing hands the kept-alive connection back to the pool
+    response.close()
+    logger.debug(f"[Timeshift] Warmed provider connection for account {m3u_account.id} in {time.monotonic() - started:.2f}s")
+
+
+def _likely_start(channel, timezone_str):
+    """Start (provider-local YYYY-MM-DD:HH-MM) of the latest fully aired programme."""
+    from .epg import get_timeline
+
+    if not channel.epg_data_id:
+        return None
+    timeline = get_timeline(channel.epg_data)
+    now = time.time()
+    i = timeline.first_starting_at_or_after(now) - 1
+    while i >= 0 and timeline.ends[i] > now:
+        i -= 1
+    if i < 0:
+        return None
+    return datetime.fromtimestamp(timeline.starts[i], ZoneInfo(timezone_str)).strftime("%Y-%m-%d:%H-%M")
+
+
+def _prefetch(channel, stream, limit):
+    """Pull the first limit bytes of the likely programme into the segment cache."""
+    from .views import (
+        _build_target, _cached_body, _get_plugin_timezone, _program_duration, _segment_cache_program,
+    )
+
+    timezone_str = _get_plugin_timezone()
+    start = _likely_start(channel, timezone_str)
+    if start is None:
+        return
+    target = _build_target(channel, stream, start, _program_duration(channel, start, timezone_str))
+    program = _segment_cache_program(target)
+    if program is None:
+        return
+    covered = program.covered_until(0)
+    if covered is not None and covered >= limit:
+        return
+    if program.live_state() is not None:
+        return  # Already being fetched
+
+    deadline = time.monotonic() + PREFETCH_DEADLINE
+    fetched = 0
+    body = _cached_body(
+        program, target.url, {'User-Agent': target.user_agent}, target.m3u_account, 0, limit - 1, queue_timeout=0
+    )
+    try:
+        for chunk in body:
+            fetched += len(chunk)
+            if time.monotonic() > deadline:
+                break
+    finally:
+        body.close()
+    logger.info(f"[Timeshift] Warm-up: prefetched {fetched // 1024} KB of {start} for channel {channel.name}")
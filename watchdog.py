@@ -0,0 +1,198 @@
+"""
+Dispatcharr Timeshift Plugin - Relay session watchdog
+
+Watches the catch-up relays of this worker (views._relay_response) and
+releases the provider side of sessions whose client went away.
+
+WHY?
+    The relay is pulled by the WSGI server: while the client is slow,
+    nothing is read from the provider (natural backpressure). But a client
+    that disconnects while the server is blocked in a socket write - a
+    mobile app sent to the background - is only noticed when that write
+    times out, often minutes later. Meanwhile the upstream connection stays
+    open and keeps its max_streams slot (budget.py), and nothing in the
+    generator runs to notice.
+
+HOW:
+    - The relay marks when it hands a chunk to the server (client_wait)
+      and when the server asks for the next one (client_ready). Under
+      uWSGI it also notes the client socket (uwsgi.connection_fd).
+    - A daemon thread checks every CHECK_INTERVAL seconds. A session whose
+      client socket was closed by the peer is aborted: the upstream
+      response is closed (the provider sees the disconnect) and the slot
+      released. When the blocked write finally returns, the relay sees the
+      abort and ends quietly.
+    - A paused player keeps its connection open and is left alone. The
+      opt-in client_stall_timeout also aborts sessions whose client has
+      not read for that long (0, the default, disables it): a stall can't
+      be told apart from a pause, so it cuts paused viewers off too.
+    - For healthy sessions the thread also refreshes the slot lease, so a
+      lease cannot lapse while its connection is still open.
+    - Chunks taken inside unwatched() (background consumers such as the
+      read-ahead, which pauses on purpose) don't count as client waits.
+
+    Per-session memory is bounded by the relay buffer: chunks are at most
+    session_buffer_kb (relay.ChunkSizer), and nothing is read ahead of
+    the client.
+
+GitHub: https://github.com/cedric-marcoux/dispatcharr_timeshift
+"""
+
+import logging
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger("plugins.dispatcharr_timeshift.watchdog")
+
+try:
+    import uwsgi
+except ImportError:  # Not running under uWSGI
+    uwsgi = None
+
+DEFAULT_CLIENT_STALL_TIMEOUT = 0
+DEFAULT_SESSION_BUFFER_KB = 1024
+
+CHECK_INTERVAL = 1.0
+
+_sessions = set()
+_lock = threading.Lock()
+_thread = None
+_local = threading.local()
+
+
+def _setting_number(key, default):
+    from .cache import get_plugin_setting
+    try:
+        return float(get_plugin_setting(key, default))
+    except (TypeError, ValueError):
+        return float(default)
+
+
+def client_stall_timeout():
+    """Seconds a client may leave a chunk unread; 0 disables."""
+    return max(0.0, _setting_number("client_stall_timeout", DEFAULT_CLIENT_STALL_TIMEOUT))
+
+
+def session_buffer_bytes():
+    """Largest chunk a relay reads from the provider at once."""
+    return int(max(64.0, _setting_number("session_buffer_kb", DEFAULT_SESSION_BUFFER_KB)) * 1024)
+
+
+def _client_fd():
+    """Socket of the request this thread serves, or None if unknown."""
+    if uwsgi is None:
+        return None
+    try:
+        return uwsgi.connection_fd()
+    except Exception:
+        return None  # Not a request thread
+
+
+def _peer_closed(fd):
+    """Return True if the peer closed the client socket fd."""
+    try:
+        # A dup: closing it leaves the server's fd untouched
+        sock = socket.fromfd(fd, socket.AF_INET, socket.SOCK_STREAM)
+    except OSError:
+        return False
+    try:
+        sock.setblocking(False)
+        return sock.recv(1, socket.MSG_PEEK) == b""
+    except (BlockingIOError, InterruptedError):
+        return False  # Open, nothing to read
+    except OSError:
+        return True  # Reset
+    finally:
+        sock.close()
+
+
+class RelaySession:
+    """One relayed upstream response, as seen by the watchdog."""
+
+    __slots__ = ("response", "slot", "account_id", "waiting_since", "aborted", "client_fd")
+
+    def __init__(self, response, slot, account_id):
+        self.response = response
+        self.slot = slot
+        self.account_id = account_id
+        self.waiting_since = None
+        self.aborted = False
+        self.client_fd = None
+
+    def client_wait(self):
+        """A chunk was handed to the server; the client has to take it."""
+        if getattr(_local, "unwatched", False):
+            return
+        if self.client_fd is None:
+            self.client_fd = _client_fd()
+        self.waiting_since = time.monotonic()
+
+    def client_ready(self):
+        """The server asked for the next chunk."""
+        self.waiting_since = None
+
+
+@contextmanager
+def unwatched():
+    """Chunks pulled by this thread inside the block are not client waits."""
+    previous = getattr(_local, "unwatched", False)
+    _local.unwatched = True
+    try:
+        yield
+    finally:
+        _local.unwatched = previous
+
+
+def register(response, slot, account_id):
+    """Start watching a relay; call unregister() when it ends."""
+    global _thread
+
+    session = RelaySession(response, slot, account_id)
+    with _lock:
+        _sessions.add(session)
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_watch, name="timeshift-watchdog", daemon=True)
+            _thread.start()
+    return session
+
+
+def unregister(session):
+    with _lock:
+        _sessions.discard(session)
+
+
+def _watch():
+    while True:
+        time.sleep(CHECK_INTERVAL)
+        with _lock:
+            sessions = list(_sessions)
+        if not sessions:
+            continue
+        try:
+            timeout = client_stall_timeout()
+        except Exception:
+            timeout = DEFAULT_CLIENT_STALL_TIMEOUT
+
+        now = time.monotonic()
+        for session in sessions:
+            waiting_since = session.waiting_since
+            if waiting_since is not None and session.client_fd is not None and _peer_closed(session.client_fd):
+                _abort(session, "Client disconnected")
+            elif timeout and waiting_since is not None and now - waiting_since > timeout:
+                _abort(session, f"Client stalled for {now - waiting_since:.0f}s")
+            elif session.slot is not None:
+                session.slot.refresh()
+
+
+def _abort(session, reason):
+    unregister(session)
+    session.aborted = True
+    logger.info(f"[Timeshift] {reason}, closing upstream connection (account {session.account_id})")
+    try:
+        session.response.close()
+    except Exception as e:
+        logger.debug(f"[Timeshift] Error closing upstream of a gone client: {e}")
+    if session.slot is not None:
+        session.slot.release()
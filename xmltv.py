@@ -0,0 +1,614 @@
+"""
+Dispatcharr Timeshift Plugin - XMLTV timestamp rewriting
+
+Converts the UTC timestamps in Dispatcharr's XMLTV output to the configured
+local timezone (see _patch_generate_epg in hooks.py for why IPTVX needs it).
+
+WHY NOT strptime/astimezone?
+    A full XMLTV holds two timestamps per programme, and a large guide has
+    hundreds of thousands of programmes. Parsing each one with
+    datetime.strptime, building a ZoneInfo and calling astimezone() cost
+    minutes of CPU per download. Instead:
+
+    - The zone's UTC offset transitions are computed once for the window
+      covered by the guide, so the offset for a timestamp is one bisect.
+    - Timestamps are converted with integer calendar arithmetic.
+    - Chunks are rewritten as bytes (no decode/re-encode), and only inside
+      start="..." / stop="..." attributes.
+    - Results are memoized: a programme's stop is the next one's start, and
+      every channel shares the same hourly boundaries.
+
+XMLTV CACHE:
+    Even converted quickly, regenerating the whole guide for every download
+    pins a worker, and most clients pull the same guide every hour. The
+    converted output is therefore cached on disk per scope (profile, user
+    access, query parameters, host and timezone):
+
+    - First download streams through and writes the cache file as it goes.
+    - Later downloads are served from the file (sendfile where available)
+      with a content ETag and Last-Modified, and answer 304 to
+      If-None-Match / If-Modified-Since.
+    - gzip (and zstd when available) variants are written next to the file
+      during the same pass and picked by Accept-Encoding (compression.py).
+    - When the TTL expires, the stale file is still served while ONE
+      worker rebuilds it in a background thread (a lock file keeps other
+      workers out). When the EPG changed (shared "xmltv" generation, see
+      cache.py) the old file is not served: the next download streams the
+      new guide through, as on a miss.
+    - The rebuild runs after the response that triggered it has ended, so
+      it works on a copy of the request (detached_request), not the
+      request itself.
+    - After each build, files of older builds of that scope are deleted,
+      and so are scopes nobody downloaded for ORPHAN_AGE.
+
+GitHub: https://github.com/cedric-marcoux/dispatcharr_timeshift
+"""
+
+import bisect
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+logger = logging.getLogger("plugins.dispatcharr_timeshift.xmltv")
+
+# Matches: start="20251128143000 +0000" (also stop=, and start in
+# <previously-shown>). Like the original rewrite, the incoming offset is
+# assumed to be UTC - Dispatcharr always writes +0000.
+TIMESTAMP_ATTR_PATTERN = re.compile(rb'((?:start|stop)=")(\d{14}) ([+-]\d{4})(")')
+
+# Transition tables are built for +/- this many seconds around "now" and
+# extended on demand for timestamps outside
+_TABLE_MARGIN = 60 * 86400
+
+# Offset sampling step when searching for transitions (no zone changes its
+# offset twice within 6 hours)
+_SAMPLE_STEP = 6 * 3600
+
+_MEMO_MAX_ENTRIES = 200000
+
+_DAYS_IN_MONTH = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+
+def _days_from_civil(year, month, day):
+    """Days since 1970-01-01 for a proleptic Gregorian date (H. Hinnant)."""
+    year -= month <= 2
+    era = year // 400
+    yoe = year - era * 400
+    doy = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + day - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+def _civil_from_days(days):
+    """Inverse of _days_from_civil: (year, month, day)."""
+    days += 719468
+    era = days // 146097
+    doe = days - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    year = yoe + era * 400
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    day = doy - (153 * mp + 2) // 5 + 1
+    month = mp + (3 if mp < 10 else -9)
+    return year + (month <= 2), month, day
+
+
+def _is_leap(year):
+    return year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+
+
+def parse_xmltv_utc(digits):
+    """
+    Parse YYYYMMDDhhmmss (bytes or str) as UTC epoch seconds.
+
+    Returns:
+        int epoch seconds, or None if the value is not a valid date/time
+    """
+    try:
+        year = int(digits[0:4])
+        month = int(digits[4:6])
+        day = int(digits[6:8])
+        hour = int(digits[8:10])
+        minute = int(digits[10:12])
+        second = int(digits[12:14])
+    except ValueError:
+        return None
+    if not 1 <= month <= 12 or hour > 23 or minute > 59 or second > 61:
+        return None
+    max_day = 29 if month == 2 and _is_leap(year) else _DAYS_IN_MONTH[month - 1]
+    if not 1 <= day <= max_day:
+        return None
+    return _days_from_civil(year, month, day) * 86400 + hour * 3600 + minute * 60 + second
+
+
+class TimezoneConverter:
+    """
+    UTC -> local conversion for one zone, backed by a transition table.
+
+    The table is a pair of parallel lists: UTC epoch seconds at which an
+    offset starts, and that offset in seconds. Instances are shared between
+    requests (see get_converter), so the table and memo are built once per
+    worker and zone. The lists and the range they cover are published as
+    one tuple, so readers never pair new starts with old offsets.
+    """
+
+    def __init__(self, tz_name):
+        self.tz_name = tz_name
+        self._tz = ZoneInfo(tz_name)
+        self._lock = threading.Lock()
+        self._table = None  # (lo, hi, starts, offsets)
+        self._memo = {}
+        now = int(time.time())
+        self._build(now - _TABLE_MARGIN, now + _TABLE_MARGIN)
+
+    def _offset_of(self, epoch):
+        return int(datetime.fromtimestamp(epoch, timezone.utc).astimezone(self._tz).utcoffset().total_seconds())
+
+    def _build(self, lo, hi):
+        """(Re)build the transition table covering [lo, hi)."""
+        starts = [lo]
+        offsets = [self._offset_of(lo)]
+        t = lo
+        while t < hi:
+            nxt = min(t + _SAMPLE_STEP, hi)
+            offset = self._offset_of(nxt)
+            if offset != offsets[-1]:
+                # Bisect to the exact second the offset changes
+                a, b = t, nxt
+                while b - a > 1:
+                    mid = (a + b) // 2
+                    if self._offset_of(mid) == offsets[-1]:
+                        a = mid
+                    else:
+                        b = mid
+                starts.append(b)
+                offsets.append(offset)
+            t = nxt
+        self._table = (lo, hi, starts, offsets)
+
+    def offset_at(self, epoch):
+        """UTC offset in seconds for a UTC epoch."""
+        lo, hi, starts, offsets = self._table
+        if not lo <= epoch < hi:
+            with self._lock:
+                lo, hi, starts, offsets = self._table
+                if not lo <= epoch < hi:
+                    self._build(min(lo, epoch - _TABLE_MARGIN), max(hi, epoch + _TABLE_MARGIN))
+                    lo, hi, starts, offsets = self._table
+        index = bisect.bisect_right(starts, epoch) - 1
+        return offsets[index]
+
+    def format_local(self, epoch):
+        """Format a UTC epoch as local XMLTV time: b'YYYYMMDDhhmmss +hhmm'."""
+        offset = self.offset_at(epoch)
+        local = epoch + offset
+        days, secs = divmod(local, 86400)
+        year, month, day = _civil_from_days(days)
+        sign = "+" if offset >= 0 else "-"
+        off_h, off_m = divmod(abs(offset) // 60, 60)
+        return (
+            f"{year:04d}{month:02d}{day:02d}{secs // 3600:02d}{secs // 60 % 60:02d}{secs % 60:02d}"
+            f" {sign}{off_h:02d}{off_m:02d}"
+        ).encode("ascii")
+
+    def _replace(self, match):
+        digits = match.group(2)
+        converted = self._memo.get(digits)
+        if converted is None:
+            epoch = parse_xmltv_utc(digits)
+            if epoch is None:
+                logger.warning(f"[Timeshift] XMLTV timestamp conversion failed: {digits!r}")
+                return match.group(0)
+            converted = self.format_local(epoch)
+            if len(self._memo) >= _MEMO_MAX_ENTRIES:
+                self._memo.clear()
+            self._memo[digits] = converted
+        return match.group(1) + converted + match.group(4)
+
+    def rewrite(self, data):
+        """Rewrite every start/stop attribute timestamp in a bytes chunk."""
+        if b'start="' not in data and b'stop="' not in data:
+            return data
+        return TIMESTAMP_ATTR_PATTERN.sub(self._replace, data)
+
+    def rewrite_stream(self, chunks):
+        """
+        Rewrite an iterable of XMLTV chunks (bytes or str), yielding bytes.
+
+        Chunks are cut after their last '>' and the remainder is carried to
+        the next chunk, so a timestamp split across two chunks is still
+        converted (attribute values never contain '>').
+        """
+        carry = b""
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            if carry:
+                chunk = carry + chunk
+                carry = b""
+            cut = chunk.rfind(b">") + 1
+            if cut < len(chunk):
+                chunk, carry = chunk[:cut], chunk[cut:]
+            if chunk:
+                yield self.rewrite(chunk)
+        if carry:
+            yield self.rewrite(carry)
+
+
+_converters = {}
+_converters_lock = threading.Lock()
+
+
+def get_converter(tz_name):
+    """Return the shared TimezoneConverter for a zone (created on first use)."""
+    converter = _converters.get(tz_name)
+    if converter is None:
+        with _converters_lock:
+            converter = _converters.get(tz_name)
+            if converter is None:
+                converter = TimezoneConverter(tz_name)
+                _converters[tz_name] = converter
+    return converter
+
+
+# =============================================================================
+# On-disk XMLTV cache
+# =============================================================================
+
+XMLTV_DEFAULT_TTL = 3600
+
+# A builder that holds the lock longer than this is assumed dead
+_BUILD_LOCK_STALE = 30 * 60
+
+# Cache scopes not rebuilt (so not downloaded) for this long are deleted
+ORPHAN_AGE = 7 * 86400
+
+# Query parameters that identify the user rather than shape the output
+_CREDENTIAL_PARAMS = {"username", "password"}
+
+
+def xmltv_cache_key(request, profile_name, user, tz_name):
+    """
+    Build the cache scope for a generate_epg response.
+
+    The XMLTV depends on the profile, what the user may see, the query
+    parameters (days, tvg_id_source, ...), the host (absolute icon URLs)
+    and the target timezone.
+    """
+    if user is None:
+        user_scope = "anonymous"
+    elif user.user_level >= 10:
+        user_scope = "all"
+    else:
+        profile_ids = sorted(user.channel_profiles.values_list('id', flat=True))
+        user_scope = f"{user.user_level}:{','.join(str(i) for i in profile_ids)}"
+
+    params = sorted(
+        (key, value) for key, values in request.GET.lists() if key not in _CREDENTIAL_PARAMS
+        for value in values
+    )
+    raw = f"{profile_name or ''}|{user_scope}|{params}|{request.scheme}://{request.get_host()}|{tz_name}"
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def detached_request(request):
+    """
+    Return a copy of request that stays usable after its response ended.
+
+    Keeps what generate_epg reads (method, path, query, headers, scheme,
+    user), without the WSGI input/output objects.
+    """
+    from django.http import HttpRequest
+
+    scheme = request.scheme
+
+    class DetachedRequest(HttpRequest):
+        def _get_scheme(self):
+            return scheme
+
+    copy = DetachedRequest()
+    copy.method = request.method
+    copy.path = request.path
+    copy.path_info = request.path_info
+    copy.META = {key: value for key, value in request.META.items() if isinstance(value, (str, int, float, bool))}
+    copy.GET = request.GET.copy()
+    if hasattr(request, "user"):
+        copy.user = request.user
+    return copy
+
+
+def _cache_ttl():
+    from .cache import get_plugin_setting
+    try:
+        return int(get_plugin_setting("xmltv_cache_ttl", XMLTV_DEFAULT_TTL))
+    except (TypeError, ValueError):
+        return XMLTV_DEFAULT_TTL
+
+
+def _cache_paths(key):
+    from .cache import get_cache_dir
+    directory = get_cache_dir("xmltv")
+    return directory, os.path.join(directory, f"{key}.json"), os.path.join(directory, f"{key}.lock")
+
+
+def _read_meta(meta_path):
+    try:
+        with open(meta_path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _acquire_build_lock(lock_path):
+    """Take the cross-worker build lock for one cache key (non-blocking)."""
+    try:
+        fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        os.close(fd)
+        return True
+    except FileExistsError:
+        try:
+            if time.time() - os.path.getmtime(lock_path) > _BUILD_LOCK_STALE:
+                os.unlink(lock_path)
+                return _acquire_build_lock(lock_path)
+        except OSError:
+            pass
+        return False
+
+
+def _release_build_lock(lock_path):
+    try:
+        os.unlink(lock_path)
+    except OSError:
+        pass
+
+
+def _write_cache(key, chunks, generation, encoding=None):
+    """
+    Consume converted chunks into the cache, yielding them as they pass.
+
+    Besides the plain file, a compressed variant is written for every
+    encoding we support, so compression is paid once per rebuild. With
+    encoding set, the chunks yielded are that variant's compressed bytes
+    (the ones written to disk) instead of the plain ones.
+
+    Data files are named after the content hash and published by
+    atomically replacing the meta file, so readers never see a partial
+    guide. If the consumer stops early (client disconnect) nothing is
+    published.
+    """
+    from .compression import ENCODINGS, SUFFIXES, compressor
+
+    directory, meta_path, _lock_path = _cache_paths(key)
+    tmp_path = os.path.join(directory, f"{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+    variant_tmp = {enc: tmp_path + SUFFIXES[enc] for enc in ENCODINGS}
+    digest = hashlib.sha1()
+    size = 0
+    complete = False
+    files = {}
+    try:
+        files[None] = open(tmp_path, "wb")
+        compressors = {}
+        for enc, path in variant_tmp.items():
+            files[enc] = open(path, "wb")
+            compressors[enc] = compressor(enc)
+
+        for chunk in chunks:
+            files[None].write(chunk)
+            digest.update(chunk)
+            size += len(chunk)
+            out = chunk
+            for enc, c in compressors.items():
+                data = c.compress(chunk)
+                files[enc].write(data)
+                if enc == encoding:
+                    out = data
+            if out:
+                yield out
+
+        for enc, c in compressors.items():
+            data = c.flush()
+            files[enc].write(data)
+            if enc == encoding and data:
+                yield data
+        complete = True
+    finally:
+        for f in files.values():
+            f.close()
+        if not complete:
+            for path in [tmp_path, *variant_tmp.values()]:
+                _unlink_quietly(path)
+
+    etag = digest.hexdigest()[:20]
+    data_path = os.path.join(directory, f"{key}.{etag}.xml")
+    os.replace(tmp_path, data_path)
+    variants = {}
+    for enc, path in variant_tmp.items():
+        variant_path = data_path + SUFFIXES[enc]
+        os.replace(path, variant_path)
+        variants[enc] = {"file": os.path.basename(variant_path), "size": os.path.getsize(variant_path)}
+
+    old = _read_meta(meta_path)
+    meta = {
+        "file": os.path.basename(data_path),
+        "etag": etag,
+        "size": size,
+        "built_at": time.time(),
+        "generation": generation,
+        "variants": variants,
+    }
+    meta_tmp = f"{tmp_path}.json"
+    with open(meta_tmp, "w") as f:
+        json.dump(meta, f)
+    os.replace(meta_tmp, meta_path)
+
+    if old and old.get("file") and old["file"] != meta["file"]:
+        # Open FileResponses keep reading the old inodes
+        _unlink_quietly(os.path.join(directory, old["file"]))
+        for variant in (old.get("variants") or {}).values():
+            _unlink_quietly(os.path.join(directory, variant["file"]))
+    logger.info(f"[Timeshift] XMLTV: Cached {size} bytes (etag {etag}, variants: {', '.join(variants) or 'none'})")
+    _prune(directory, key, meta)
+
+
+def _prune(directory, key, meta):
+    """
+    Delete superseded files of this scope (builds that raced, leftovers of
+    killed builds) and every file of scopes not rebuilt for ORPHAN_AGE.
+    """
+    current = {f"{key}.json", f"{key}.lock", meta["file"]}
+    current.update(variant["file"] for variant in meta["variants"].values())
+    now = time.time()
+    orphans = set()
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        scope = name.split(".", 1)[0]
+        try:
+            if scope == key:
+                # Temp files of a build still running are recent
+                if name not in current and (".tmp" not in name or now - os.path.getmtime(path) > _BUILD_LOCK_STALE):
+                    os.unlink(path)
+            elif name.endswith(".json") and now - os.path.getmtime(path) > ORPHAN_AGE:
+                orphans.add(scope)
+        except OSError:
+            pass
+    if not orphans:
+        return
+    for name in os.listdir(directory):
+        if name.split(".", 1)[0] in orphans:
+            _unlink_quietly(os.path.join(directory, name))
+    logger.info(f"[Timeshift] XMLTV: Deleted {len(orphans)} cache entries unused for {ORPHAN_AGE // 86400} days")
+
+
+def _unlink_quietly(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def _rebuild_in_background(key, build_chunks, converter, generation):
+    """Rebuild a stale cache entry in a thread, in at most one worker."""
+    _directory, _meta_path, lock_path = _cache_paths(key)
+    if not _acquire_build_lock(lock_path):
+        return
+
+    def run():
+        try:
+            for _chunk in _write_cache(key, converter.rewrite_stream(build_chunks()), generation):
+                pass
+        except Exception as e:
+            logger.error(f"[Timeshift] XMLTV: Background rebuild failed: {e}", exc_info=True)
+        finally:
+            _release_build_lock(lock_path)
+            from django.db import connection
+            connection.close()
+
+    logger.info("[Timeshift] XMLTV: Cache stale, rebuilding in background")
+    threading.Thread(target=run, name="timeshift-xmltv-rebuild", daemon=True).start()
+
+
+def _not_modified(request, etag, built_at):
+    """Evaluate If-None-Match / If-Modified-Since against a cache entry."""
+    from django.utils.http import parse_http_date_safe
+
+    if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or f'"{etag}"' in tags
+
+    if_modified_since = request.META.get("HTTP_IF_MODIFIED_SINCE")
+    if if_modified_since:
+        since = parse_http_date_safe(if_modified_since)
+        return since is not None and int(built_at) <= since
+    return False
+
+
+def _set_xmltv_headers(response, encoding=None):
+    from .compression import set_encoding_headers
+
+    response['Content-Disposition'] = 'attachment; filename="Dispatcharr.xml"'
+    # Clients must revalidate, which is a cheap 304 thanks to the ETag
+    response['Cache-Control'] = 'no-cache'
+    return set_encoding_headers(response, encoding)
+
+
+def serve_xmltv(request, key, build_chunks, converter):
+    """
+    Serve a timezone-converted XMLTV from the disk cache.
+
+    The pre-compressed variant matching Accept-Encoding is sent when one
+    exists; each variant has its own ETag.
+
+    Args:
+        request: Django request (for conditional and Accept-Encoding headers)
+        key: Scope key from xmltv_cache_key()
+        build_chunks: Callable returning Dispatcharr's original (UTC) XMLTV
+            chunks; only called on a miss or a rebuild, possibly after the
+            response (must not use the live request, see detached_request)
+        converter: TimezoneConverter for the configured zone
+
+    Returns:
+        FileResponse, 304 HttpResponse, or StreamingHttpResponse on a miss
+    """
+    from django.http import FileResponse, HttpResponseNotModified, StreamingHttpResponse
+    from django.utils.http import http_date
+    from .cache import current_generation, XMLTV_GENERATION
+    from .compression import ENCODINGS, negotiate, compress_stream
+
+    generation = current_generation(XMLTV_GENERATION)
+    directory, meta_path, lock_path = _cache_paths(key)
+    meta = _read_meta(meta_path)
+
+    data_file = None
+    encoding = None
+    if meta:
+        variants = meta.get("variants") or {}
+        encoding = negotiate(request, [enc for enc in ENCODINGS if enc in variants])
+        filename = variants[encoding]["file"] if encoding else meta.get("file")
+        try:
+            data_file = open(os.path.join(directory, filename), "rb")
+        except (OSError, TypeError):
+            data_file = None
+
+    if data_file is not None and meta.get("generation") != generation:
+        # The EPG changed: the old guide is wrong, not just old
+        data_file.close()
+        data_file = None
+
+    if data_file is not None:
+        if time.time() - meta["built_at"] >= _cache_ttl():
+            _rebuild_in_background(key, build_chunks, converter, generation)
+
+        etag = f'{meta["etag"]}-{encoding}' if encoding else meta["etag"]
+        if _not_modified(request, etag, meta["built_at"]):
+            data_file.close()
+            response = HttpResponseNotModified()
+        else:
+            response = FileResponse(data_file, content_type='application/xml')
+        response["ETag"] = f'"{etag}"'
+        response["Last-Modified"] = http_date(meta["built_at"])
+        return _set_xmltv_headers(response, encoding if response.status_code == 200 else None)
+
+    # Miss: stream through, filling the cache unless another worker is
+    # already building this entry. The client gets the same compressed
+    # bytes that are written to the variant file.
+    encoding = negotiate(request)
+    chunks = converter.rewrite_stream(build_chunks())
+    if _acquire_build_lock(lock_path):
+        def filling():
+            try:
+                yield from _write_cache(key, chunks, generation, encoding)
+            finally:
+                _release_build_lock(lock_path)
+        chunks = filling()
+    elif encoding:
+        chunks = compress_stream(chunks, encoding)
+
+    response = StreamingHttpResponse(chunks, content_type='application/xml')
+    return _set_xmltv_headers(response, encoding)